@@ -0,0 +1,83 @@
+# coding: utf-8
+#
+# brat2json annotation merge: list.insert per tag boundary vs. merge_brat_annotation
+#
+import os
+import sys
+import time
+import random
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from format_converter import merge_brat_annotation, name2tag
+
+
+def insert_merge(text, entities, tid2cert):
+    """ the former combine_brat_to_json merge, one char_list.insert per start and end offset """
+    cid2tag = {}
+    for tid, tag_type, char_b, char_e in entities:
+        cid2tag['s%i' % char_b] = (tid, tag_type)
+        cid2tag['e%i' % char_e] = (tid, tag_type)
+    char_list = list(text)
+    for key in sorted(cid2tag.keys(), key=lambda x: (int(x[1:]), x[0]), reverse=True):
+        cid = int(key[1:])
+        tid, tag_type = cid2tag[key]
+        if key.startswith('e'):
+            char_list.insert(cid, '</%s>' % (name2tag[tag_type]))
+        elif key.startswith('s'):
+            elems = [name2tag[tag_type]]
+            elems.append('tid="%s"' % tid)
+            if tid in tid2cert:
+                elems.append('%s="%s"' % tid2cert[tid])
+            char_list.insert(cid, '<%s>' % (' '.join(elems)))
+    return ''.join(char_list)
+
+
+def make_doc(n_entities, seed=0):
+    """ a brat text with n entities, every third one nested in the previous, all boundaries distinct """
+    rng = random.Random(seed)
+    tag_types = list(name2tag.keys())
+    text = ''.join(rng.choice('肝腫瘤胆嚢結節認める。\n') for _ in range(n_entities * 10 + 10))
+    entities, tid2cert = [], {}
+    for i in range(n_entities):
+        tid = 'T%i' % (i + 1)
+        if i % 3 == 2:
+            entities.append((tid, rng.choice(tag_types), 10 * (i - 1) + 2, 10 * (i - 1) + 4))
+        else:
+            entities.append((tid, rng.choice(tag_types), 10 * i + 1, 10 * i + 6))
+        if rng.random() < 0.3:
+            tid2cert[tid] = ('certainty', rng.choice(['positive', 'negative', 'suspicious']))
+    return text, entities, tid2cert
+
+
+def timeit(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the brat2json annotation merge against entity count.')
+    parser.add_argument("--sizes", default='100,1000,5000,10000',
+                        help="comma separated entity counts")
+    parser.add_argument("--skip-insert", action="store_true",
+                        help="only time merge_brat_annotation")
+    args = parser.parse_args()
+
+    print('%10s %10s %12s %12s %8s' % ('entities', 'chars', 'insert(s)', 'merge(s)', 'same'))
+    for n in [int(x) for x in args.sizes.split(',')]:
+        text, entities, tid2cert = make_doc(n)
+        merge_time, merged = timeit(merge_brat_annotation, text, entities, tid2cert)
+        if args.skip_insert:
+            print('%10i %10i %12s %12.4f %8s' % (n, len(text), '-', merge_time, '-'))
+            continue
+        insert_time, inserted = timeit(insert_merge, text, entities, tid2cert, repeat=1)
+        print('%10i %10i %12.4f %12.4f %8s' % (n, len(text), insert_time, merge_time, merged == inserted))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# coding: utf-8
+#
+# throughput of the two inline markup readers of json2brat/json2norm, ElementTree and markup_lexer, on the
+# wrapped and repaired findings of a synthetic corpus
+#
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+from synth_corpus import CORPUS_COLUMNS, make_rows
+from format_converter import fix_finding_str, fix_xml_str, markup_lines
+
+
+def wrap_finding(finding):
+    """ the markup convert_report_to_brat parses for an 'mr' finding, without the comment line """
+    finding = fix_finding_str(finding)
+    return fix_xml_str('<doc>\n' + '\n'.join(['<line>%s</line>' % line.strip() for line in finding.split('\n')]) +
+                       '\n</doc>\n')
+
+
+def bench_parser(docs, parser, repeat):
+    """ (best seconds over repeat runs, reports that failed, reports with recovered markup) """
+    best, failed, recovered = None, 0, 0
+    for _ in range(repeat):
+        failed, recovered = 0, 0
+        start = time.perf_counter()
+        for doc in docs:
+            try:
+                _, problems = markup_lines(doc, 'line', parser)
+                recovered += bool(problems)
+            except Exception:
+                failed += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, failed, recovered
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare the ElementTree and markup_lexer readers of the inline markup')
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--broken", type=float, default=0.1, help="rate of broken markup in the synthetic findings")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ann_col = CORPUS_COLUMNS['mr'][-1]
+    docs = [wrap_finding(row[ann_col]) for row in make_rows(args.records, 'mr', args.seed, args.broken)]
+    n_bytes = sum(len(doc.encode('utf-8')) for doc in docs)
+    print('%-7s %9s %12s %8s %8s %10s' % ('parser', 'seconds', 'reports/s', 'MB/s', 'failed', 'recovered'))
+    for name in ('etree', 'lexer'):
+        elapsed, failed, recovered = bench_parser(docs, name, args.repeat)
+        print('%-7s %9.3f %12.0f %8.1f %8i %10i' % (name, elapsed, len(docs) / elapsed, n_bytes / elapsed / 1e6,
+                                                  failed, recovered))
@@ -0,0 +1,141 @@
+# coding: utf-8
+#
+# format_converter modes on synthetic corpora: wall time, throughput and peak memory per mode and size,
+# plus the json2brat -> brat2json -> json2brat round-trip check
+#
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+from synth_corpus import CORPUS_COLUMNS, make_corpus
+
+CONVERTER = os.path.join(BENCH_DIR, '..', 'format_converter.py')
+MODES = ['xls2json', 'xls2json-csv', 'json2brat', 'brat2json', 'json2norm', 'bio2xml', 'xls2txt']
+# brat2json keeps these attributes (read_brat_ann), the round trip can only compare them
+MERGED_ATTRS = ('certainty', 'state', 'type')
+
+
+def run_mode(python, args, log_file):
+    """ run format_converter in a child process, return (seconds, peak rss in MB, return code) """
+    start = time.perf_counter()
+    with open(log_file, 'w') as log_fo:
+        proc = subprocess.Popen([python, CONVERTER] + args, stdout=log_fo, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    return elapsed, rusage.ru_maxrss / 1024, os.waitstatus_to_exitcode(status)
+
+
+def last_line(log_file):
+    with open(log_file, errors='replace') as log_fi:
+        lines = [line.strip() for line in log_fi if line.strip()]
+    return lines[-1] if lines else ''
+
+
+def read_brat_dir(brat_file):
+    """ {file suffix: (txt, T lines, A (attribute, T id, value) set)} of a brat prefix """
+    brat_dir, brat_name = os.path.split(brat_file)
+    pairs = {}
+    for file_name in sorted(os.listdir(brat_dir)):
+        if not (file_name.startswith(brat_name + '.') and file_name.endswith('.txt')):
+            continue
+        stem = os.path.join(brat_dir, file_name[:-len('.txt')])
+        with open(stem + '.txt') as txt_fi:
+            text = txt_fi.read()
+        t_lines, attrs = [], set()
+        with open(stem + '.ann') as ann_fi:
+            for line in ann_fi:
+                if line.startswith('T'):
+                    t_lines.append(line)
+                elif line.startswith('A'):
+                    _, key, tid, value = line.split()
+                    if key in MERGED_ATTRS:
+                        attrs.add((key, tid, value))
+        pairs[file_name[len(brat_name):-len('.txt')]] = (text, t_lines, attrs)
+    return pairs
+
+
+def compare_brat_dirs(brat_a, brat_b):
+    """ names of the pairs whose txt, T lines or merged attributes (ids aside) differ """
+    pairs_a, pairs_b = read_brat_dir(brat_a), read_brat_dir(brat_b)
+    diffs = sorted(set(pairs_a) ^ set(pairs_b))
+    for name in sorted(set(pairs_a) & set(pairs_b)):
+        text_a, t_a, attrs_a = pairs_a[name]
+        text_b, t_b, attrs_b = pairs_b[name]
+        if text_a != text_b or t_a != t_b or attrs_a != attrs_b:
+            diffs.append(name)
+    return len(pairs_a), diffs
+
+
+def bench_size(python, work_dir, n_records, corpus, modes, workers, seed):
+    rid_col, pid_col, date_col, type_col, ann_col = CORPUS_COLUMNS[corpus]
+    size_dir = os.path.join(work_dir, '%s_%i' % (corpus, n_records))
+    paths = make_corpus(size_dir, n_records, corpus, seed)
+    out = lambda name: os.path.join(size_dir, name)
+    os.makedirs(out('brat_out'), exist_ok=True)
+    os.makedirs(out('norm'), exist_ok=True)
+    brat_out = os.path.join(out('brat_out'), 's')
+    # every mode reads inputs written by the synthetic corpus or by an earlier mode
+    commands = {
+        'xls2json': ['--mode', 'xls2json', '--xls', paths['xlsx'], '--json', out('corpus.json')],
+        'xls2json-csv': ['--mode', 'xls2json', '--xls', paths['csv'], '--json', out('corpus_csv.json')],
+        'json2brat': ['--mode', 'json2brat', '--corpus', corpus, '--json', out('corpus.json'), '--brat', brat_out,
+                      '--workers', str(workers)],
+        'brat2json': ['--mode', 'brat2json', '--json', out('corpus.json'), '--brat', brat_out,
+                      '--njson', out('merged.json')],
+        'json2norm': ['--mode', 'json2norm', '--json', out('merged.json'), '--norm', os.path.join(out('norm'), 'n')],
+        'bio2xml': ['--mode', 'bio2xml', '--bio', paths['bio'], '--xml', out('bio.xml')],
+        'xls2txt': ['--mode', 'xls2txt', '--xls', paths['xlsx'], '--txt', out('corpus.txt')],
+    }
+    units = {'bio2xml': 'reports'}
+    results = []
+    for mode in modes:
+        elapsed, peak_mb, rc = run_mode(python, commands[mode], out('%s.log' % mode))
+        note = '' if rc == 0 else 'failed: %s' % last_line(out('%s.log' % mode))
+        results.append((mode, n_records, elapsed, n_records / elapsed, units.get(mode, 'records'), peak_mb, note))
+
+    roundtrip = None
+    if corpus == 'mr' and {'json2brat', 'brat2json'} <= set(modes) and os.path.isfile(out('merged.json')):
+        # brat2json writes the merged markup back into 'ann', the mr annotation column
+        os.makedirs(out('brat_rt'), exist_ok=True)
+        brat_rt = os.path.join(out('brat_rt'), 's')
+        run_mode(python, ['--mode', 'json2brat', '--corpus', corpus, '--json', out('merged.json'),
+                          '--brat', brat_rt], out('roundtrip.log'))
+        roundtrip = compare_brat_dirs(brat_out, brat_rt)
+    return results, roundtrip
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Time format_converter modes on synthetic corpora')
+    parser.add_argument("--sizes", type=int, nargs='+', default=[100, 1000, 10000], help="reports per corpus")
+    parser.add_argument("--corpus", default='mr', choices=sorted(CORPUS_COLUMNS))
+    parser.add_argument("--modes", nargs='+', default=MODES, choices=MODES)
+    parser.add_argument("--workers", type=int, default=1, help="json2brat worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="keep the corpora and outputs here instead of a temp dir")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='prism_bench_')
+    failed = False
+    try:
+        print('%-13s %8s %9s %12s %10s  %s' % ('mode', 'size', 'seconds', 'per second', 'peak MB', ''))
+        for n_records in args.sizes:
+            results, roundtrip = bench_size(sys.executable, work_dir, n_records, args.corpus, args.modes,
+                                            args.workers, args.seed)
+            for mode, size, elapsed, rate, unit, peak_mb, note in results:
+                print('%-13s %8i %9.2f %8.0f %-7s %7.1f  %s' % (mode, size, elapsed, rate, unit, peak_mb, note))
+            if roundtrip:
+                n_pairs, diffs = roundtrip
+                failed |= bool(diffs)
+                print('round trip    %8i  %i/%i brat pairs identical%s' % (
+                    n_records, n_pairs - len(diffs), n_pairs, ', differing: %s' % ' '.join(diffs[:10]) if diffs else ''))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,113 @@
+# coding: utf-8
+#
+# import time of every format_converter mode, measured with `python -X importtime` on a tiny synthetic corpus
+# and checked against a per-mode budget
+#
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+from synth_corpus import make_corpus
+
+CONVERTER = os.path.join(BENCH_DIR, '..', 'format_converter.py')
+# milliseconds of imports on top of the bare interpreter start-up; xls2txt needs pyknp and the conll modes
+# data_utils and a conll file, they are left out
+BUDGETS = {
+    'bio2xml': 60,
+    'bio2brat': 60,
+    'xml2brat': 60,
+    'json2json': 60,
+    'json2norm': 60,
+    'brat2json': 60,
+    'json2brat': 100,
+    'xls2json': 600,
+    'pipeline': 600,
+}
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+XML_SAMPLE = '<DOC><TEXT><sentence>左肺に<EVENT eid="e1">結節</EVENT>を認める。</sentence>' \
+             '<sentence><TIMEX3 tid="t1">前回</TIMEX3>と著変なし。</sentence></TEXT></DOC>\n'
+
+
+def parse_importtime(stderr):
+    """ (total microseconds, {top-level module: cumulative microseconds}) of the -X importtime lines """
+    top = {}
+    for line in stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m and len(m.group(3)) == 1:
+            top[m.group(4)] = top.get(m.group(4), 0) + int(m.group(2))
+    return sum(top.values()), top
+
+
+def import_time(python, args):
+    """ (import microseconds, top-level modules, return code, last stderr line) of one run with -X importtime """
+    proc = subprocess.run([python, '-X', 'importtime'] + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    total, top = parse_importtime(proc.stderr)
+    other = [line for line in proc.stderr.splitlines() if line.strip() and not line.startswith('import time:')]
+    return total, top, proc.returncode, other[-1] if other else ''
+
+
+def mode_commands(work_dir):
+    """ --mode arguments of every budgeted mode, reading inputs written here or by an earlier mode """
+    paths = make_corpus(work_dir, 20, 'mr', formats=('csv', 'brat', 'bio'))
+    xml_file = os.path.join(work_dir, 'sample.xml')
+    with open(xml_file, 'w', encoding='utf-8') as xml_fo:
+        xml_fo.write(XML_SAMPLE)
+    out = lambda name: os.path.join(work_dir, name)
+    for name in ('brat_out', 'brat_pipe', 'xml_brat', 'norm'):
+        os.makedirs(out(name), exist_ok=True)
+    # in input order, so running them in this order once writes every input
+    return {
+        'xls2json': ['--mode', 'xls2json', '--xls', paths['csv'], '--json', out('corpus.json')],
+        'json2json': ['--mode', 'json2json', '--json', out('corpus.json'), '--njson', out('corpus.ndjson')],
+        'json2brat': ['--mode', 'json2brat', '--corpus', 'mr', '--json', out('corpus.json'),
+                      '--brat', os.path.join(out('brat_out'), 's')],
+        'brat2json': ['--mode', 'brat2json', '--json', out('corpus.json'), '--brat', os.path.join(out('brat_out'), 's'),
+                      '--njson', out('merged.json')],
+        'json2norm': ['--mode', 'json2norm', '--json', out('merged.json'), '--norm', os.path.join(out('norm'), 'n')],
+        'pipeline': ['--mode', 'pipeline', '--corpus', 'mr', '--xls', paths['csv'],
+                     '--brat', os.path.join(out('brat_pipe'), 's'), '--njson', out('pipeline.json')],
+        'bio2xml': ['--mode', 'bio2xml', '--bio', paths['bio'], '--xml', out('bio.xml')],
+        'bio2brat': ['--mode', 'bio2brat', '--bio', paths['bio'], '--brat', out('bio_brat')],
+        'xml2brat': ['--mode', 'xml2brat', '--xml', xml_file, '--brat', out('xml_brat')],
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Check the import time of each format_converter mode against its budget')
+    parser.add_argument("--modes", nargs='+', default=list(BUDGETS), choices=sorted(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the fastest one counts")
+    parser.add_argument("--top", type=int, default=3, help="slowest top-level imports to list per mode")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='prism_imports_')
+    over = []
+    try:
+        commands = mode_commands(work_dir)
+        for mode_args in commands.values():
+            subprocess.run([sys.executable, CONVERTER] + mode_args, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        # the interpreter's own start-up imports (site, encodings, ...) are not charged to the modes
+        base = min(import_time(sys.executable, ['-c', 'pass'])[0] for _ in range(args.repeat))
+        print('%-10s %9s %9s  %s' % ('mode', 'import ms', 'budget', 'slowest imports (ms)'))
+        for mode in args.modes:
+            runs = [import_time(sys.executable, [CONVERTER] + commands[mode]) for _ in range(args.repeat)]
+            total, top, rc, last = min(runs, key=lambda run: run[0])
+            import_ms = (total - base) / 1000
+            slowest = sorted(top.items(), key=lambda item: -item[1])[:args.top]
+            note = ' '.join('%s %.1f' % (name, us / 1000) for name, us in slowest)
+            if rc != 0:
+                note = 'failed: %s' % last
+            elif import_ms > BUDGETS[mode]:
+                over.append(mode)
+                note = 'OVER BUDGET  ' + note
+            print('%-10s %9.1f %9i  %s' % (mode, import_ms, BUDGETS[mode], note))
+    finally:
+        shutil.rmtree(work_dir)
+    sys.exit(1 if over else 0)
@@ -0,0 +1,230 @@
+# coding: utf-8
+#
+# synthetic 読影所見 corpora for the format_converter benchmarks: xlsx/csv in the mr/ou/ncc column layouts,
+# brat dirs and BIO files
+#
+import os
+import random
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+# rid, pid, date, title and annotated finding columns, as format_converter's json2brat reads them
+CORPUS_COLUMNS = {
+    'mr': ('表示順', '匿名ID', '記載日', 'タイトル', 'ann'),
+    'ou': ('表示順', '匿名ID', '検査実施日', 'タイトル', '所見'),
+    'ncc': ('ID', '_id', 'exam_date', 'タイトル', 'findings_demasked'),
+}
+
+VOCAB = {
+    'd': ['腫瘤', '結節', '嚢胞', '転移', '肝細胞癌', '気腫', '胸水', '石灰化'],
+    'a': ['肝', '右葉', 'S8', '胆嚢', '膵頭部', '左肺上葉', '縦隔リンパ節', '脾'],
+    'f': ['10mm', '境界明瞭', '辺縁不整', '低吸収', '15×12mm大'],
+    'c': ['増大', '縮小', '変化なし', '新出', '消失'],
+    'p': ['経過観察', '精査', 'フォロー'],
+    'cc': ['術後', '化学療法後', 'TACE後'],
+    'r': ['切除', '放射線治療', 'RFA'],
+    't-test': ['CEA', 'AFP', 'CA19-9'],
+    't-val': ['5.2', '12.0', '38'],
+    'm-key': ['ネクサバール', 'ゼローダ'],
+    'm-val': ['5mg', '400mg'],
+}
+CERTAINTIES = ['positive', 'negative', 'suspicious', 'general']
+TIMEX_TYPES = ['DATE', 'DURATION', 'SET']
+HEADERS = ['<胸部CT>', '<CHEST>', '<経過>', '<Liver>', '<ABD US>', '<CHEST;CT>']
+FILLERS = ['を認める', 'あり', 'は明らかでない', 'に著変なし', 'と比較して', 'の疑い']
+# broken inline markup that fix_finding_str/fix_xml_str repair
+BROKEN_FORMS = [
+    '<d certainty="suspicious>{}</d>',
+    '<<d certainty="negative">{}</d>',
+    '<a>{}</a>>',
+    '<d, correction="x">{}</d>',
+    '<d>{}\n</d>',
+    '{} ＜注意＞',
+    '{} A&B',
+]
+
+
+def make_entity(rng, tag=None):
+    """ one inline tag, with a certainty on some disease tags """
+    tag = tag or rng.choice(list(VOCAB))
+    attr = ' certainty="%s"' % rng.choice(CERTAINTIES) if tag == 'd' and rng.random() < 0.5 else ''
+    return '<%s%s>%s</%s>' % (tag, attr, rng.choice(VOCAB[tag]), tag)
+
+
+def make_sentence(rng, broken_rate=0.1):
+    """ a sentence of 1-3 annotated phrases, some nested or timed, some in a repairable broken form """
+    phrases = []
+    for _ in range(rng.randint(1, 3)):
+        roll = rng.random()
+        if roll < broken_rate:
+            phrases.append(rng.choice(BROKEN_FORMS).format(rng.choice(VOCAB['d'])))
+        elif roll < 0.25:
+            phrases.append('<d>%s<a>%s</a>の%s</d>' % (rng.choice(VOCAB['a']), rng.choice(VOCAB['a']),
+                                                    rng.choice(VOCAB['d'])))
+        elif roll < 0.35:
+            day = datetime(2014, 1, 1) + timedelta(days=rng.randint(0, 365))
+            phrases.append('<TIMEX3 type="%s">%s</TIMEX3>' % (rng.choice(TIMEX_TYPES), day.strftime('%Y/%m/%d')))
+        else:
+            phrases.append(make_entity(rng) + make_entity(rng, 'd'))
+        phrases.append(rng.choice(FILLERS))
+    return ''.join(phrases) + '。'
+
+
+def make_finding(rng, broken_rate=0.1):
+    """ the annotated finding of one report, 1-4 lines, sometimes under a section header """
+    lines = []
+    for _ in range(rng.randint(1, 4)):
+        header = rng.choice(HEADERS) if rng.random() < broken_rate else ''
+        lines.append(header + ''.join(make_sentence(rng, broken_rate) for _ in range(rng.randint(1, 3))))
+    return '\n'.join(lines)
+
+
+def strip_markup(finding):
+    """ the finding text without tags, for the plain 'findings' column xls2txt reads """
+    import re
+    return re.sub(r'</?[a-zA-Z][^<>]*>', '', finding)
+
+
+def make_rows(n_records, corpus='mr', seed=0, broken_rate=0.1, template_rate=0.0, n_templates=200):
+    """
+    n report rows in the corpus' column layout, in runs of 1-4 rows per 表示順 and 1-5 reports per patient; with
+    template_rate, that share of the findings is copied from a pool of n_templates templated findings
+    """
+    rid_col, pid_col, date_col, type_col, ann_col = CORPUS_COLUMNS[corpus]
+    rng = random.Random(seed)
+    template_rng = random.Random('templates %i' % seed)
+    templates = [make_finding(template_rng, broken_rate) for _ in range(n_templates)] if template_rate else []
+    rows, rid, pid = [], 0, 3276170
+    day = datetime(2014, 3, 1)
+    while len(rows) < n_records:
+        rid += 1
+        if rid == 1 or rng.random() < 0.3:
+            pid += 1
+        for _ in range(rng.randint(1, 4)):
+            day += timedelta(days=rng.randint(0, 3))
+            if template_rate and rng.random() < template_rate:
+                finding = rng.choice(templates)
+            else:
+                finding = make_finding(rng, broken_rate)
+            rows.append({
+                rid_col: rid,
+                pid_col: pid,
+                date_col: day,
+                # 'I' rows are skipped by json2brat
+                type_col: rng.choice(['S', 'O', 'A', 'P', 'S', 'O', 'I']),
+                ann_col: finding,
+                'findings': strip_markup(finding),
+            })
+            if len(rows) == n_records:
+                break
+    return rows
+
+
+def write_xls(rows, xls_file):
+    """ write the rows as .csv or .xlsx, by extension """
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    if xls_file.endswith('csv'):
+        df.to_csv(xls_file, index=False)
+    else:
+        df.to_excel(xls_file, index=False)
+
+
+def write_brat_dir(n_docs, brat_file, seed=0, reports_per_doc=3):
+    """ n brat .txt/.ann pairs in the json2brat layout ('## line id:' blocks), with certainties and relations """
+    from format_converter import tag2name
+
+    rng = random.Random(seed)
+    line_id = 0
+    for doc_index in range(1, n_docs + 1):
+        text, t_lines, a_lines, r_lines = [], [], [], []
+        offset = 0
+        for _ in range(rng.randint(1, reports_per_doc)):
+            line_id += 1
+            head_line = '## line id: %i ||| 表示順: %i ||| 匿名ID: %i ||| タイトル: S ||| 記載日: 2014-03-%02d\n' % (
+                line_id, doc_index, 3276170 + doc_index, doc_index % 28 + 1)
+            text.append(head_line)
+            offset += len(head_line)
+            for _ in range(rng.randint(1, 6)):
+                prev_tid = None
+                for _ in range(rng.randint(1, 3)):
+                    tag = rng.choice(list(VOCAB))
+                    surface = rng.choice(VOCAB[tag])
+                    tid = 'T%i' % (len(t_lines) + 1)
+                    t_lines.append('%s\t%s %i %i\t%s\n' % (tid, tag2name[tag], offset, offset + len(surface), surface))
+                    if tag == 'd' and rng.random() < 0.5:
+                        a_lines.append('A%i\tcertainty %s %s\n' % (len(a_lines) + 1, tid, rng.choice(CERTAINTIES)))
+                    if prev_tid and rng.random() < 0.3:
+                        r_lines.append('R%i\tchangeRef Arg1:%s Arg2:%s\n' % (len(r_lines) + 1, tid, prev_tid))
+                    filler = rng.choice(FILLERS)
+                    text.append(surface + filler)
+                    offset += len(surface) + len(filler)
+                    prev_tid = tid
+                text.append('。\n')
+                offset += 2
+        with open('%s.表示順%i.txt' % (brat_file, doc_index), 'w') as fot:
+            fot.write(''.join(text))
+        with open('%s.表示順%i.ann' % (brat_file, doc_index), 'w') as foa:
+            foa.write(''.join(t_lines + a_lines + r_lines))
+
+
+def write_bio(n_reports, bio_file, seed=0):
+    """ n reports of 'token bio_tag certainty' lines, each closed by an EOR line """
+    rng = random.Random(seed)
+    tags = ['d', 'a', 'f', 'c', 'p', 'r', 'cc']
+    with open(bio_file, 'w') as fo:
+        for _ in range(n_reports):
+            for _ in range(rng.randint(3, 30)):
+                if rng.random() < 0.4:
+                    fo.write('%s O _\n' % rng.choice(FILLERS))
+                    continue
+                tag = rng.choice(tags)
+                cert = rng.choice(CERTAINTIES) if tag == 'd' and rng.random() < 0.5 else '_'
+                surface = rng.choice(VOCAB[tag])
+                for token_index, token in enumerate([surface[i:i + 2] for i in range(0, len(surface), 2)]):
+                    fo.write('%s %s-%s %s\n' % (token, 'I' if token_index else 'B', tag.upper(),
+                                                '_' if token_index else cert))
+            fo.write('EOR _ _\n')
+
+
+def make_corpus(out_dir, n_records, corpus='mr', seed=0, broken_rate=0.1, formats=('xlsx', 'csv', 'brat', 'bio'),
+                template_rate=0.0):
+    """ write the requested formats under out_dir and return {format: path} """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    if 'xlsx' in formats or 'csv' in formats:
+        rows = make_rows(n_records, corpus, seed, broken_rate, template_rate)
+        for fmt in ('xlsx', 'csv'):
+            if fmt in formats:
+                paths[fmt] = os.path.join(out_dir, 'synth_%s.%s' % (corpus, fmt))
+                write_xls(rows, paths[fmt])
+    if 'brat' in formats:
+        os.makedirs(os.path.join(out_dir, 'brat'), exist_ok=True)
+        paths['brat'] = os.path.join(out_dir, 'brat', 'synth')
+        write_brat_dir(max(1, n_records // 3), paths['brat'], seed)
+    if 'bio' in formats:
+        paths['bio'] = os.path.join(out_dir, 'synth.bio')
+        write_bio(n_records, paths['bio'], seed)
+    return paths
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+    parser = ArgumentParser(description='Write a synthetic 読影所見 corpus')
+    parser.add_argument("--out-dir", default='synth', help="output directory")
+    parser.add_argument("--records", type=int, default=1000, help="number of reports")
+    parser.add_argument("--corpus", default='mr', choices=sorted(CORPUS_COLUMNS), help="xlsx/csv column layout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--broken", type=float, default=0.1,
+                        help="rate of markup written in a form fix_xml_str has to repair")
+    parser.add_argument("--templates", type=float, default=0.0,
+                        help="share of findings copied from a pool of templated findings")
+    parser.add_argument("--formats", nargs='+', default=['xlsx', 'csv', 'brat', 'bio'],
+                        choices=['xlsx', 'csv', 'brat', 'bio'])
+    args = parser.parse_args()
+
+    for fmt, path in make_corpus(args.out_dir, args.records, args.corpus, args.seed, args.broken,
+                                 args.formats, args.templates).items():
+        print('%s: %s' % (fmt, path))
@@ -1,50 +1,120 @@
 import os
 from argparse import ArgumentParser
-from transformers import BertTokenizer, BertModel
+from collections import Counter
+from multiprocessing import Pool
 
+# one tokenizer per worker process
+_tokenizer = None
 
-def extend_bert_vocab(text_file, PRE_BERT, MODEL_URL):
+
+def load_tokenizer(PRE_BERT):
+    from transformers import BertTokenizer
+    return BertTokenizer.from_pretrained(PRE_BERT, do_lower_case=False, do_basic_tokenize=False)
+
+
+def _init_worker(PRE_BERT):
+    global _tokenizer
+    _tokenizer = load_tokenizer(PRE_BERT)
+
+
+def is_unk_word(tokenizer, word):
+    """
+    whether the tokenizer maps a whitespace token to [UNK]; without basic tokenization the word pieces of a word
+    do not depend on the rest of the line, so each distinct word only has to be tokenized once
+    """
+    return tokenizer.tokenize(word) == [tokenizer.unk_token]
+
+
+def shard_ranges(text_file, n_shards):
+    """ split the file into n byte ranges; a range owns the lines that start inside it """
+    size = os.path.getsize(text_file)
+    bounds = [size * i // n_shards for i in range(n_shards + 1)]
+    return [(b, e) for b, e in zip(bounds, bounds[1:]) if e > b]
+
+
+def mine_shard(args):
+    """ (token count, Counter of [UNK] words) of the lines starting in the byte range [start, end) """
+    text_file, start, end = args
+    word_freq = Counter()
+    with open(text_file, 'rb') as fi:
+        if start > 0:
+            # the line running across start belongs to the previous shard
+            fi.seek(start - 1)
+            fi.readline()
+        while fi.tell() < end:
+            line = fi.readline()
+            if not line:
+                break
+            word_freq.update(line.decode('utf-8').split())
+    unk_freq = Counter({word: freq for word, freq in word_freq.items() if is_unk_word(_tokenizer, word)})
+    return sum(word_freq.values()), unk_freq
+
+
+def mine_unk_words(text_file, PRE_BERT, workers=None, shards_per_worker=4):
+    """ count the [UNK] words of a whitespace-tokenized text file over byte-range shards in a process pool """
+    workers = workers or os.cpu_count()
+    shards = [(text_file, start, end) for start, end in shard_ranges(text_file, workers * shards_per_worker)]
+    n_toks, unk_freq = 0, Counter()
+    with Pool(workers, initializer=_init_worker, initargs=(PRE_BERT,)) as pool:
+        for shard_toks, shard_unk_freq in pool.imap_unordered(mine_shard, shards):
+            n_toks += shard_toks
+            unk_freq.update(shard_unk_freq)
+    return n_toks, unk_freq
+
+
+def write_freq_report(unk_freq, new_toks, report_file):
+    """ tab-separated word, frequency and whether it is added, most frequent first """
+    with open(report_file, 'w', encoding='utf-8') as fo:
+        for word, freq in unk_freq.most_common():
+            fo.write('%s\t%i\t%s\n' % (word, freq, 'added' if word in new_toks else '-'))
+
+
+def extend_bert_vocab(text_file, PRE_BERT, MODEL_URL, min_freq=1, max_new_tokens=None,
+                      workers=None, report_file=None):
     # PRE_BERT='/Users/fei-c/Resources/embed/L-12_H-768_A-12_E-30_BPE'
     # MODEL_URL='./checkpoints/'
-    tokenizer = BertTokenizer.from_pretrained(PRE_BERT, do_lower_case=False, do_basic_tokenize=False)
-    model = BertModel.from_pretrained(PRE_BERT)
+    if os.path.exists(MODEL_URL):
+        raise ValueError("Output directory ({}) already exists and is not empty.".format(MODEL_URL))
 
-    unk_toks = []
-    with open(text_file, 'r') as fi:
-        for line in fi:
-            toks = line.strip().split()
-            tokenized = tokenizer.tokenize(line.strip())
-
-            deunk = []
-            for i in range(len(tokenized)):
-                tok = tokenized.pop(0)
-                if tok.startswith('##'):
-                    deunk[-1] += tok[2:]
-                else:
-                    deunk.append(tok)
-            assert len(deunk) == len(toks)
-            for d, t in zip(deunk, toks):
-                if d == '[UNK]':
-                    unk_toks.append(t)
-    print('number of [UNK] tokens: %i, vocab size of [UNK] tokens: %i' % (len(unk_toks), len(set(unk_toks))))
-
-    tokenizer.add_tokens(list(set(unk_toks)))
+    n_toks, unk_freq = mine_unk_words(text_file, PRE_BERT, workers)
+    print('number of tokens: %i, number of [UNK] tokens: %i, vocab size of [UNK] tokens: %i' % (
+        n_toks, sum(unk_freq.values()), len(unk_freq)))
+
+    # most frequent first, ties by surface, so the new token ids do not depend on the shard order
+    candidates = sorted((item for item in unk_freq.items() if item[1] >= min_freq), key=lambda x: (-x[1], x[0]))
+    new_toks = [word for word, _ in candidates[:max_new_tokens]]
+    report_file = report_file or '%s.unk_freq.tsv' % text_file
+    write_freq_report(unk_freq, set(new_toks), report_file)
+    print('%i [UNK] words with frequency >= %i, adding %i, frequency report: %s' % (
+        len(candidates), min_freq, len(new_toks), report_file))
+
+    from transformers import BertModel
+    tokenizer = load_tokenizer(PRE_BERT)
+    model = BertModel.from_pretrained(PRE_BERT)
+    tokenizer.add_tokens(new_toks)
     model.resize_token_embeddings(len(tokenizer))
 
-    if os.path.exists(MODEL_URL):
-        raise ValueError("Output directory ({}) already exists and is not empty.".format(MODEL_URL))
-    if not os.path.exists(MODEL_URL):
-        os.makedirs(MODEL_URL)
+    os.makedirs(MODEL_URL)
     model.save_pretrained(MODEL_URL)
     tokenizer.save_pretrained(MODEL_URL)
 
 
-parser = ArgumentParser(description='Add new tokens into an existing bert tokenizer.')
-parser.add_argument("--txt", dest="txt_file",
-                    help="txt file for mlm training")
-parser.add_argument("--pre", dest="pre_model",
-                    help="pre_trained bert model")
-parser.add_argument("--model", dest="model_url",
-                    help="new model dir to save")
-args = parser.parse_args()
-extend_bert_vocab(args.txt_file, args.pre_model, args.model_url)
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Add new tokens into an existing bert tokenizer.')
+    parser.add_argument("--txt", dest="txt_file",
+                        help="txt file for mlm training")
+    parser.add_argument("--pre", dest="pre_model",
+                        help="pre_trained bert model")
+    parser.add_argument("--model", dest="model_url",
+                        help="new model dir to save")
+    parser.add_argument("--min-freq", dest="min_freq", type=int, default=1,
+                        help="only add [UNK] words occurring at least this often")
+    parser.add_argument("--max-new-tokens", dest="max_new_tokens", type=int,
+                        help="add at most this many of the most frequent [UNK] words")
+    parser.add_argument("--workers", type=int,
+                        help="processes mining the text file shards, all cpus by default")
+    parser.add_argument("--report", dest="report_file",
+                        help="[UNK] word frequency report, TXT_FILE.unk_freq.tsv by default")
+    args = parser.parse_args()
+    extend_bert_vocab(args.txt_file, args.pre_model, args.model_url, min_freq=args.min_freq,
+                      max_new_tokens=args.max_new_tokens, workers=args.workers, report_file=args.report_file)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# incremental json2brat: fingerprints of the brat pairs by segment of 表示順 groups, and the plan of which to keep
+#
+# A segment is the run of groups from one group boundary between brat pairs to the next: usually one group and its
+# pair, but groups without tags join the pair of the next group, which may in turn be cut after its first reports.
+# The pairs of a segment depend on its groups only, so a segment whose groups are all unchanged keeps its pairs.
+#
+import hashlib
+from collections import deque
+from itertools import islice
+
+
+def segment_fingerprint(fingerprints):
+    """ fingerprint of a run of 表示順 groups from those of the groups: the group's own for a single group """
+    if len(fingerprints) == 1:
+        return fingerprints[0]
+    return hashlib.sha1('\n'.join(fingerprints).encode('utf-8')).hexdigest()
+
+
+def index_segments(files):
+    """ {表示順 a segment starts with: names of its pairs} of the files of a json2brat manifest """
+    segments = {}
+    for out_rid, entry in files.items():
+        segments.setdefault(entry.get('start', out_rid[len('表示順'):]), []).append(out_rid)
+    return segments
+
+
+def plan_segments(groups, prev_files, rid_of, pair_exists):
+    """
+    generate (group, fingerprint, is_last, keep, out_rids) from (group, fingerprint, is_last) triples, given the
+    files of the previous manifest: keep is the number of groups of a kept segment at its first group, -1 at its
+    other groups and 0 for the groups to convert; out_rids are the pairs of the segment the group starts, if any.
+    A segment is kept if it has the same groups as before, still ends the input or not as before, and all of its
+    pairs exist (pair_exists(out_rid)); rid_of(group) is the 表示順 of a group
+    """
+    segments = index_segments(prev_files)
+    groups = iter(groups)
+    ahead = deque()
+    while True:
+        if not ahead:
+            ahead.extend(islice(groups, 1))
+            if not ahead:
+                return
+        group, fingerprint, is_last = ahead[0]
+        out_rids = segments.get(rid_of(group), [])
+        prevs = [prev_files[out_rid] for out_rid in out_rids]
+        span = prevs[0].get('groups', 1) if prevs else 1
+        # the groups read ahead for an earlier segment may already cover this one
+        ahead.extend(islice(groups, max(0, span - len(ahead))))
+        span_groups = list(islice(ahead, span))
+        span_fingerprint = segment_fingerprint([info[1] for info in span_groups])
+        keep = (prevs and len(span_groups) == span
+                and all(prev.get('fingerprint') == span_fingerprint and prev.get('groups', 1) == span
+                        for prev in prevs)
+                and any(prev.get('final') for prev in prevs) == span_groups[-1][2]
+                and all(pair_exists(out_rid) for out_rid in out_rids))
+        for group_keep in ([span] + [-1] * (span - 1)) if keep else [0]:
+            group, fingerprint, is_last = ahead.popleft()
+            yield group, fingerprint, is_last, group_keep, out_rids
+
+
+class SegmentManifest(object):
+    """
+    the 'files' of a json2brat manifest as the pairs are written: add_group() for each group converted, add_pair()
+    for each pair written, end_segment() at each group boundary between pairs, keep() for the pairs of a kept segment
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.kept = []
+        self._rids, self._fingerprints, self._pairs = [], [], []
+
+    def add_group(self, rid, fingerprint):
+        self._rids.append(rid)
+        self._fingerprints.append(fingerprint)
+
+    def add_pair(self, out_rid, line_ids):
+        self.files[out_rid] = {'fingerprint': None, 'final': False, 'line_ids': line_ids}
+        self._pairs.append(out_rid)
+
+    def end_segment(self, final=False):
+        """ the pairs of the segment ending here get its fingerprint, final for the segment ending the input """
+        for out_rid in self._pairs:
+            entry = self.files[out_rid]
+            entry['fingerprint'] = segment_fingerprint(self._fingerprints)
+            entry['final'] = final
+            if len(self._fingerprints) > 1:
+                entry['groups'] = len(self._fingerprints)
+            if out_rid != f"表示順{self._rids[0]}":
+                entry['start'] = self._rids[0]
+        self.discard_segment()
+
+    def discard_segment(self):
+        """ forget the groups of a segment that wrote no pair """
+        self._rids.clear()
+        self._fingerprints.clear()
+        self._pairs.clear()
+
+    def keep(self, out_rids, prev_files):
+        for out_rid in out_rids:
+            self.files[out_rid] = prev_files[out_rid]
+            self.kept.append(out_rid)
+        self.discard_segment()
+
+    def stale(self, prev_manifest, shards=()):
+        """ the pairs and shards of a previous manifest this run, which wrote shards, did not produce """
+        written = set(self.files) | set(shard['name'] for shard in shards)
+        names = list(prev_manifest.get('files', {})) + [shard['name'] for shard in prev_manifest.get('shards', [])]
+        return [name for name in names if name not in written]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# packing of the json2brat 表示順 groups into brat shards capped by report count and by text length
+#
+
+SHARD_NAME = 'shard%05i'
+
+
+def shard_files(manifest, brat_file):
+    """ the '{brat_file}.{shard}' prefixes listed in a json2brat manifest, None if its output is not sharded """
+    if 'shards' not in manifest:
+        return None
+    return ['%s.%s' % (brat_file, shard['name']) for shard in manifest['shards']]
+
+
+def listed_line_ids(manifest, brat_file):
+    """ {'{brat_file}.{name}' prefix: line ids} of the brat pairs and shards a json2brat manifest lists them for """
+    listed = {}
+    for name, entry in manifest.get('files', {}).items():
+        if 'line_ids' in entry:
+            listed['%s.%s' % (brat_file, name)] = [str(line_id) for line_id in entry['line_ids']]
+    for shard in manifest.get('shards', []):
+        listed['%s.%s' % (brat_file, shard['name'])] = [str(line_id) for line_id in shard['line_ids']]
+    return listed
+
+
+def listed_pair_ends(manifest, brat_file):
+    """
+    {'{brat_file}.{shard}' prefix: line ids} of the reports that end a brat pair of the unsharded output, per shard
+    of a json2brat manifest (older manifests do not list them)
+    """
+    return {'%s.%s' % (brat_file, shard['name']): set(str(line_id) for line_id in shard['pair_ends'])
+            for shard in manifest.get('shards', []) if 'pair_ends' in shard}
+
+
+class ShardPacker(object):
+    """
+    pack the brat pairs of consecutive 表示順 groups into shards of at most max_reports reports and max_chars chars
+    of text (None for no cap): a group goes to the next shard if it does not fit in the current one, and a group
+    that does not fit in an empty shard either is split between reports. A report is never split, so a single
+    report longer than max_chars gets a shard of its own. write_shard(index, name, char_toks, tags, attrs) writes a
+    shard, and shards lists the manifest entry of every shard written; its 'pair_ends' are the line ids of the last
+    report of each pair added, whose text ends its .txt file without shards
+    """
+
+    def __init__(self, write_shard, max_reports=None, max_chars=None):
+        self.write_shard = write_shard
+        self.max_reports = max_reports
+        self.max_chars = max_chars
+        self.shards = []
+        self._reset()
+
+    def _reset(self):
+        self.char_toks, self.tags, self.attrs = [], [], []
+        self.line_ids, self.groups, self.pair_ends = [], [], []
+        self.n_chars = 0
+
+    def _fits(self, n_reports, n_chars):
+        return (not self.max_reports or len(self.line_ids) + n_reports <= self.max_reports) and \
+               (not self.max_chars or self.n_chars + n_chars <= self.max_chars)
+
+    def add(self, group, line_ids, char_toks, tags, attrs):
+        """
+        add the brat pair of a group: char_toks holds the text of each report in line_ids, tags (tid, ttype,
+        char_b, char_e, surface) and attrs (aid, key, tid, value) are numbered from T1/A1 within the group.
+        Returns the indices of the first and last shard holding its reports, the last one may still be open
+        """
+        if self.line_ids and not self._fits(len(line_ids), sum(map(len, char_toks))):
+            self.flush()
+        first = len(self.shards)
+        tag_index, attr_index, char_b = 0, 0, 0
+        for line_id, text in zip(line_ids, char_toks):
+            if self.line_ids and not self._fits(1, len(text)):
+                self.flush()
+            if not self.groups or self.groups[-1] != group:
+                self.groups.append(group)
+            # the tags of a report are the ones starting in its text, and its attrs are the ones of its tags
+            char_e, shift, tid_map = char_b + len(text), self.n_chars - char_b, {}
+            while tag_index < len(tags) and tags[tag_index][2] < char_e:
+                tid, ttype, tag_b, tag_e, surface = tags[tag_index]
+                tid_map[tid] = 'T%i' % (len(self.tags) + 1)
+                self.tags.append((tid_map[tid], ttype, tag_b + shift, tag_e + shift, surface))
+                tag_index += 1
+            while attr_index < len(attrs) and attrs[attr_index][2] in tid_map:
+                aid, key, tid, value = attrs[attr_index]
+                self.attrs.append(('A%i' % (len(self.attrs) + 1), key, tid_map[tid], value))
+                attr_index += 1
+            self.char_toks.append(text)
+            self.line_ids.append(line_id)
+            self.n_chars += len(text)
+            char_b = char_e
+        if line_ids:
+            self.pair_ends.append(line_ids[-1])
+        return first, len(self.shards)
+
+    def flush(self):
+        """ write the current shard, if it has any report """
+        if not self.line_ids:
+            return
+        name = SHARD_NAME % (len(self.shards) + 1)
+        self.shards.append({'name': name, 'groups': self.groups, 'line_ids': self.line_ids,
+                            'pair_ends': self.pair_ends, 'chars': self.n_chars})
+        self.write_shard(len(self.shards) - 1, name, self.char_toks, self.tags, self.attrs)
+        self._reset()
@@ -1,17 +1,23 @@
 # coding: utf-8
+#
+# pandas, textformatting, sentence_splitter, the repair rules and data_utils are imported on first use,
+# so every mode only loads what it needs (see benchmarks/import_budget.py)
+#
 import os
+import time
 import json
 import re
 import math
-import subprocess
 from argparse import ArgumentParser
 import xml.etree.ElementTree as ET
-import pandas as pd
 from datetime import date, datetime
-from textformatting import ssplit
+from json_stream import indent_dumper, iter_object_items
+from markup_lexer import UnsupportedMarkup, parse_markup_lines
+from report_store import ReportStore, is_report_store, write_report_store
+from run_metrics import metrics
+from text_normalize import CORPUS_FORMS, get_normalizer, normalize_columns, normalize_text, \
+    parse_col_forms
 import sys
-sys.path.append("..")
-import data_utils
 
 tag2name = {
     'd': 'Disease',
@@ -31,36 +37,61 @@ tag2name = {
 
 name2tag = {v:k for k,v in tag2name.items()}
 
+# bump when a change alters the brat output, it invalidates the json2brat --incremental fingerprints
+CONVERTER_VERSION = '1'
+
+# the json2brat columns of each corpus
+BRAT_COLUMNS = {
+    'mr': {'rid_col': '表示順', 'pid_col': '匿名ID', 'date_col': '記載日', 'type_col': 'タイトル', 'ann_col': 'ann'},
+    'ou': {'rid_col': '表示順', 'pid_col': '匿名ID', 'date_col': '検査実施日', 'type_col': 'タイトル', 'ann_col': '所見'},
+    'ncc': {'rid_col': 'ID', 'pid_col': '_id', 'date_col': 'exam_date', 'type_col': 'タイトル',
+            'ann_col': 'findings_demasked'},
+}
+
+
+# broken-markup repairs, see xml_repair_rules.json, loaded by the first fix_*_str call
+repair_engines = None
+repair_rules_digest = None
+
+
+def get_repair_engines():
+    global repair_engines
+    if repair_engines is None:
+        from xml_repair import load_repair_engines
+        repair_engines = load_repair_engines()
+    return repair_engines
+
+
+def get_repair_rules_digest():
+    """ hash of the loaded repair rules: parses cached or fingerprinted under other rules are not reused """
+    global repair_rules_digest
+    if repair_rules_digest is None:
+        from xml_repair import rules_digest
+        repair_rules_digest = rules_digest(get_repair_engines())
+    return repair_rules_digest
+
 
 def fix_finding_str(finding_str):
-    finding_str = finding_str.replace('\r</', '</')
-    finding_str = finding_str.replace('\n</', '</')
-    finding_str = finding_str.replace('＜', '&lt;')
-    finding_str = finding_str.replace('＞', '&gt;')
-    return finding_str
+    with metrics.stage('repair'):
+        return get_repair_engines()['finding'](finding_str)
 
 
 def fix_xml_str(xml_str):
-    xml_str = xml_str.replace('<代理診察>', '《代理診察》')
-    xml_str = xml_str.replace('<胸部CT>', '《胸部CT》')
-    xml_str = xml_str.replace('<胸部単純CT>', '《胸部単純CT》')
-    xml_str = xml_str.replace('<ABD US>', '《ABD US》')
-    xml_str = xml_str.replace('<CHEST>', '《CHEST》')
-    xml_str = xml_str.replace('<CHEST；CT>', '《CHEST；CT》')
-    xml_str = xml_str.replace('<CHEST;CT>', '《CHEST；CT》')
-    xml_str = xml_str.replace('<CHEST: CT>', '《CHEST: CT》')
-    xml_str = xml_str.replace('<Liver>', '《Liver》')
-    xml_str = xml_str.replace('<経過>', '《経過》')
-    xml_str = xml_str.replace('<カンファレンスのpoint>', '《カンファレンスのpoint》')
-    xml_str = xml_str.replace(', correction=', ' correction=')
-    xml_str = xml_str.replace('<長期経過>', '《長期経過》')
-    xml_str = xml_str.replace('<予習>', '《予習》')
-    xml_str = xml_str.replace('<L/D>', '《L/D》')
-    xml_str = xml_str.replace('&', '&amp;')
-    xml_str = xml_str.replace('<<', '<')
-    xml_str = xml_str.replace('>>', '>')
-    xml_str = xml_str.replace('="suspicious>', '="suspicious">')
-    return xml_str
+    with metrics.stage('repair'):
+        return get_repair_engines()['xml'](xml_str)
+
+
+def load_data_utils():
+    """ data_utils (MultiheadConll) from the python path or the parent directory, only the conll modes need it """
+    try:
+        import data_utils
+    except ImportError:
+        sys.path.append("..")
+        try:
+            import data_utils
+        except ImportError as ex:
+            raise Exception('[ERROR] conll2brat and conll2xml need data_utils on the python path or in ..') from ex
+    return data_utils
 
 # def escape_xml_str(xml_str):
 #     xml_str = xml_str.replace('<', '&lt;')
@@ -69,560 +100,1752 @@ def fix_xml_str(xml_str):
 #     return xml_str
 
 
-def read_xls(xls_file):
+def read_xls(xls_file, normalize=None):
+    """ the xls/csv rows as the central json dict; normalize optionally maps columns to a text_normalize form """
     json_dict = {}
     json_dict['読影所見'] = {}
     json_dict['文章名'] = xls_file.split('/')[-1]
 
-    if xls_file.endswith('csv'):
-        df = pd.read_csv(xls_file, index_col=None, date_parser=None, encoding='utf-8').fillna('')
-    elif xls_file.endswith('xlsx'):
-        df = pd.read_excel(xls_file, index_col=None, sheet_name=0, date_parser=None).fillna('')
-    else:
-        raise Exception('[ERROR] Unsupported excel file')
-
-    for row_index, row in df.iterrows():
-        row_dict = {}
-        for col_name in row.keys():
-            row_dict[col_name] = row[col_name]
+    with metrics.stage('load_xls'):
+        import pandas as pd
+        if xls_file.endswith('csv'):
+            df = pd.read_csv(xls_file, index_col=None, date_parser=None, encoding='utf-8').fillna('')
+        elif xls_file.endswith('xlsx'):
+            df = pd.read_excel(xls_file, index_col=None, sheet_name=0, date_parser=None).fillna('')
+        else:
+            raise Exception('[ERROR] Unsupported excel file')
+    if normalize:
+        with metrics.stage('normalize'):
+            normalize_columns(df, normalize)
+
+    with metrics.stage('load_xls'):
+        for row_index, row in df.iterrows():
+            row_dict = {}
+            for col_name in row.keys():
+                row_dict[col_name] = row[col_name]
             json_dict['読影所見'][str(row_index + 1)] = row_dict
+    metrics.count('reports', len(json_dict['読影所見']))
     return json_dict
 
 
-def dump_json(dict_data, json_file):
-
-    def json_serial(obj):
-        # 日付型の場合には、文字列に変換します
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        # 上記以外はサポート対象外.
-        raise TypeError("Type %s not serializable" % type(obj))
-
-    with open(json_file, 'w', encoding='utf-8') as json_fo:
-        json_fo.write(json.dumps(dict_data, indent=2, ensure_ascii=False, default=json_serial))
+def chunk_column_dtypes(chunks, numeric_kinds='iuf'):
+    """
+    {column: dtype} of the columns whose inferred dtype differs between the DataFrame chunks, as the whole file
+    would be read: the common dtype of the numeric_kinds (an int chunk and a float chunk with a blank give
+    float64), otherwise object. A chunk of blanks only adds a blank to the column: float64 to numbers, NaT to dates;
+    the object chunk pd.read_csv gives bools with blanks is a bool chunk with a blank
+    """
+    import numpy as np
+    chunk_dtypes, blank_cols = {}, set()
+    for df in chunks:
+        for col_name, dtype in df.dtypes.items():
+            values = df[col_name].dropna()
+            if values.empty:
+                blank_cols.add(col_name)
+                continue
+            if dtype == object and isinstance(values.iloc[0], (bool, np.bool_)) and \
+                    all(isinstance(value, (bool, np.bool_)) for value in values):
+                dtype = np.dtype(bool)
+                blank_cols.add(col_name)
+            chunk_dtypes.setdefault(col_name, set()).add(dtype)
+    col_dtypes = {}
+    for col_name, dtypes in chunk_dtypes.items():
+        numeric = all(dtype.kind in numeric_kinds for dtype in dtypes)
+        if numeric and col_name in blank_cols:
+            dtypes = dtypes | {np.dtype('float64')}
+        if len(dtypes) > 1:
+            col_dtypes[col_name] = np.result_type(*dtypes) if numeric else object
+        elif col_name in blank_cols and not numeric:
+            dtype = dtypes.pop()
+            # the bools of a chunk and those with blanks of another read back the same
+            if dtype.kind != 'b':
+                col_dtypes[col_name] = dtype if dtype.kind == 'M' else object
+    return col_dtypes
+
+
+def csv_column_dtypes(xls_file, chunksize=10000):
+    """ chunk_column_dtypes of the csv read in chunks """
+    import pandas as pd
+    return chunk_column_dtypes(pd.read_csv(xls_file, index_col=None, encoding='utf-8', chunksize=chunksize))
+
+
+def convert_xlsx_cell(cell):
+    """ the value of an openpyxl cell as pd.read_excel takes it: '' for a blank, an int for an integral number """
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+    if cell.value is None:
+        return ''
+    elif cell.data_type == TYPE_ERROR:
+        return float('nan')
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def iter_xlsx_chunks(xls_file, chunksize=10000, dtype=None):
+    """
+    DataFrames of about chunksize rows of the first sheet, read row by row and typed as pd.read_excel types the
+    whole sheet chunk by chunk: the cells converted by convert_xlsx_cell go through the same TextParser, blank rows
+    included but for the trailing ones; the cells beyond the header are dropped. The columns of {column: dtype}
+    are cast to it, dates included, which TextParser types whatever it is told
+    """
+    import numpy as np
+    from openpyxl import load_workbook
+    from pandas.io.parsers import TextParser
+
+    dtype = dtype or {}
+    parser_dtype = {col_name: col_dtype for col_name, col_dtype in dtype.items() if np.dtype(col_dtype).kind != 'M'}
+
+    def parse(rows):
+        df = TextParser([header] + rows, header=0, skip_blank_lines=False, dtype=parser_dtype).read()
+        for col_name, col_dtype in dtype.items():
+            if col_name in df and df[col_name].dtype != col_dtype:
+                df[col_name] = df[col_name].astype(col_dtype)
+        return df
+
+    wb = load_workbook(xls_file, read_only=True, data_only=True)
+    try:
+        sheet = wb.worksheets[0]
+        sheet.reset_dimensions()
+        header, rows, blank_rows = None, [], []
+        for row in sheet.rows:
+            values = [convert_xlsx_cell(cell) for cell in row]
+            while values and values[-1] == '':
+                values.pop()
+            if header is None:
+                header = values
+                continue
+            if not values:
+                # a blank row is a record unless only blank rows follow it
+                blank_rows.append([''] * len(header))
+                continue
+            rows.extend(blank_rows)
+            blank_rows = []
+            rows.append((values + [''] * len(header))[:len(header)])
+            if len(rows) >= chunksize:
+                yield parse(rows)
+                rows = []
+        if rows:
+            yield parse(rows)
+    finally:
+        wb.close()
+
+
+def iter_xls_records(xls_file, chunksize=10000, normalize=None):
+    """
+    stream (line id, row dict) pairs of the csv or xlsx in chunks of rows, normalizing columns as read_xls does;
+    the file is scanned once beforehand, so a chunk boundary cannot change the dtype of a column and the values are
+    those of read_xls (e.g. 1.0 in an xlsx column of integral numbers with a blank, see iter_xlsx_chunks)
+    """
+    if xls_file.endswith('csv'):
+        import pandas as pd
+        with metrics.stage('load_xls'):
+            col_dtypes = csv_column_dtypes(xls_file, chunksize)
+        chunks = pd.read_csv(xls_file, index_col=None, encoding='utf-8', chunksize=chunksize, dtype=col_dtypes)
+    elif xls_file.endswith('xlsx'):
+        with metrics.stage('load_xls'):
+            col_dtypes = chunk_column_dtypes(iter_xlsx_chunks(xls_file, chunksize), numeric_kinds='biuf')
+        chunks = iter_xlsx_chunks(xls_file, chunksize, dtype=col_dtypes)
+    else:
+        raise Exception('[ERROR] Unsupported excel file')
+    object_cols = [col_name for col_name, col_dtype in col_dtypes.items() if col_dtype == object]
+    line_id = 0
+    for df in chunks:
+        filled = df.fillna('')
+        # fillna turns the numbers of an object column into floats if this chunk holds nothing else
+        for col_name in object_cols:
+            if col_name in df:
+                filled[col_name] = df[col_name].where(df[col_name].notna(), '')
+        df = filled
+        if normalize:
+            with metrics.stage('normalize'):
+                normalize_columns(df, normalize)
+        for row_dict in df.to_dict('records'):
+            line_id += 1
+            metrics.count('reports')
+            yield str(line_id), row_dict
+
+
+def is_ndjson(json_file):
+    return json_file.endswith(('.ndjson', '.jsonl'))
+
+
+def json_serial(obj):
+    # 日付型の場合には、文字列に変換します
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    # 上記以外はサポート対象外.
+    raise TypeError("Type %s not serializable" % type(obj))
+
+
+def dump_json_records(records, json_file, doc_name, backend='auto', normalized=None):
+    """
+    write (line id, record) pairs one at a time, either in the layout json.dumps(indent=2) gives the whole
+    {"読影所見": ..., "文章名": ...} dict (with the orjson backend of indent_dumper if installed) or as ndjson
+    (a {"文章名": ...} header line followed by one {"line_id": ..., "record": ...} line per report),
+    or as a '.prism' report store; the file is written as '{json_file}.tmp' and renamed into place at the end.
+    doc_name may be a function giving the 文章名 once the records are read, for one read along with them.
+    normalized, the {column: form} the records were normalized with, is kept as '正規化' ahead of the records
+    """
+    def get_doc_name():
+        return doc_name() if callable(doc_name) else doc_name
+
+    if is_report_store(json_file):
+        write_report_store(records, json_file, get_doc_name, default=json_serial, normalized=normalized)
+        metrics.count_file(json_file)
+        return
+    with open(json_file + '.tmp', 'wb') as json_fo:
+        if is_ndjson(json_file):
+            header = {'文章名': get_doc_name()}
+            if normalized:
+                header['正規化'] = normalized
+            json_fo.write(b'%s\n' % json.dumps(header, ensure_ascii=False).encode('utf-8'))
+            for line_id, record in records:
+                with metrics.stage('write_json'):
+                    json_fo.write(b'%s\n' % json.dumps({'line_id': line_id, 'record': record},
+                                                       ensure_ascii=False, default=json_serial).encode('utf-8'))
+                metrics.count('records_written')
+        else:
+            dumps = indent_dumper(json_serial, backend)
+            json_fo.write(b'{\n')
+            if normalized:
+                json_fo.write(('  "正規化": %s,\n' % json.dumps(normalized, ensure_ascii=False, indent=2).replace(
+                    '\n', '\n  ')).encode('utf-8'))
+            json_fo.write('  "読影所見": {'.encode('utf-8'))
+            sep = b'\n'
+            for line_id, record in records:
+                with metrics.stage('write_json'):
+                    json_fo.write(b'%s    %s: %s' % (sep, json.dumps(line_id, ensure_ascii=False).encode('utf-8'),
+                                                     dumps(record).replace(b'\n', b'\n    ')))
+                metrics.count('records_written')
+                sep = b',\n'
+            json_fo.write(b'\n  },\n' if sep != b'\n' else b'},\n')
+            json_fo.write(('  "文章名": %s\n}' % json.dumps(get_doc_name(), ensure_ascii=False)).encode('utf-8'))
+    os.replace(json_file + '.tmp', json_file)
+    metrics.count_file(json_file)
+
+
+def iter_json_records(json_file, others=None):
+    """
+    generate the (line id, record) pairs of a central json one at a time, from the dump_json_records layouts or
+    a '.prism' report store; the other members, i.e. the 文章名 and 正規化, are collected into the 'others' dict when
+    one is given, by the end of the records at the latest (the 正規化 before the first record)
+    """
+    if is_report_store(json_file):
+        with ReportStore(json_file) as store:
+            if others is not None:
+                others['文章名'] = store.doc_name
+                if store.normalized:
+                    others['正規化'] = store.normalized
+            yield from store.items()
+        return
+    with open(json_file, 'r', encoding='utf-8') as json_fi:
+        if is_ndjson(json_file):
+            for line in json_fi:
+                if line.strip():
+                    item = json.loads(line)
+                    if 'line_id' in item:
+                        yield item['line_id'], item['record']
+                    elif others is not None:
+                        others.update(item)
+        else:
+            yield from iter_object_items(json_fi, '読影所見', others=others)
+
+
+def read_doc_name(json_file):
+    """ the 文章名 of a central json in any of the iter_json_records layouts """
+    if is_report_store(json_file):
+        with ReportStore(json_file) as store:
+            return store.doc_name
+    with open(json_file, 'r', encoding='utf-8') as json_fi:
+        if is_ndjson(json_file):
+            return json.loads(json_fi.readline())['文章名']
+        others = {}
+        for _ in iter_object_items(json_fi, '読影所見', others=others):
+            pass
+        return others.get('文章名')
+
+
+def read_normalized(json_file):
+    """ the {column: form} xls2json --normalize applied to the records of a central json, read from its head """
+    others = {}
+    records = iter_json_records(json_file, others)
+    next(records, None)
+    records.close()
+    return others.get('正規化', {})
+
+
+def iter_sentence_lines(text):
+    """ lines of `perl sentence-splitter.pl | python split_tnm.py` for text, computed in-process """
+    from sentence_splitter import split_sentences
+    for sent in split_sentences(text):
+        for line in sent.split('\n'):
+            yield line
 
 
 def split_sent_to_xml(text, head_line):
-    """ execute outside sentence-splitter code """
-    with open('tmp.txt', 'w', encoding='utf-8') as fo:
-        fo.write(text)
-    script = '''cat tmp.txt | perl -I sentence-splitter.pl | python split_tnm.py  > tmp.sent'''
-    subprocess.Popen(script, shell=True).wait()
-    with open('tmp.sent', 'r', encoding='utf-8') as fi:
-        xml_str = '<doc>\n' + \
-                  '<line>%s</line>\n' % head_line + \
-                  '\n'.join(['<line>' + line.strip() + '</line>' for line in fi]) + '\n</doc>\n'
+    """ the sentences of text as '<line>'s, after a comment line head_line unless it is None """
+    with metrics.stage('sentence_split'):
+        lines = list(iter_sentence_lines(text))
+    xml_str = '<doc>\n' + \
+              ('<line>%s</line>\n' % head_line if head_line is not None else '') + \
+              '\n'.join(['<line>' + line.strip() + '</line>' for line in lines]) + '\n</doc>\n'
     return xml_str
 
 
-def extract_txt_from_xls(xls_file, txt_file, split_sent=True, segment=True):
-    from pyknp import Juman
-    import mojimoji
-    juman = Juman()
+def extract_txt_from_xls(xls_file, txt_file, split_sent=True, segment=True,
+                         workers=1, juman_cache=None, batch_size=1000):
+    """
+    write the 'findings' sentences one per line, juman-segmented unless segment=False; lines are segmented in
+    batches through a JumanSegmenter (LRU cache, optional sqlite cache file, 'workers' juman processes)
+    """
+    from juman_segmenter import JumanSegmenter
 
-    json_dict = read_xls(xls_file)
-    tmp_file = txt_file if not split_sent else 'tmp.raw'
-    with open(tmp_file, 'w', encoding="utf-8") as fo:
+    han_to_zen = get_normalizer('han2zen')
+
+    def iter_lines():
         for report in json_dict['読影所見'].values():
-            fo.write('%s\n' % report['findings'])
-    if split_sent:
-        script = '''cat tmp.raw | perl sentence-splitter.pl | python split_tnm.py  > tmp.sent'''
-        subprocess.Popen(script, shell=True).wait()
-    if segment:
-        with open('tmp.sent', 'r', encoding='utf-8') as fi, open(txt_file, 'w', encoding='utf-8') as fo:
-            for line in fi:
-                unspace_line = ''.join(line.strip().split())
-                if not unspace_line:
+            text = '%s\n' % report['findings']
+            with metrics.stage('sentence_split'):
+                lines = list(iter_sentence_lines(text)) if split_sent else text.split('\n')[:-1]
+            for line in lines:
+                if not segment:
+                    yield line
                     continue
-                seg_line = ' '.join([w.midasi for w in juman.analysis(mojimoji.han_to_zen(unspace_line)).mrph_list()])
-                fo.write('%s\n' % seg_line)
-    os.remove('tmp.raw')
-    os.remove('tmp.sent')
-
-
-def convert_xml_to_brat(xml_file, output_dir='data/tmp'):
-    doc_toks, mention_offsets = [], []
-    tmp_offset = 0
-    root = ET.parse(xml_file).getroot()
-    for text_node in root.findall('TEXT'):
-        for sent_node in text_node.iter('sentence'):
+                unspace_line = ''.join(line.strip().split())
+                if unspace_line:
+                    yield han_to_zen(unspace_line)
+
+    json_dict = read_xls(xls_file)
+    with open(txt_file, 'w', encoding='utf-8') as fo:
+        if not segment:
+            for line in iter_lines():
+                fo.write('%s\n' % line)
+        else:
+            with JumanSegmenter(workers=workers, cache_file=juman_cache) as segmenter:
+                batch = []
+                for line in iter_lines():
+                    batch.append(line)
+                    if len(batch) == batch_size:
+                        with metrics.stage('juman'):
+                            fo.writelines('%s\n' % seg_line for seg_line in segmenter.segment(batch))
+                        batch = []
+                with metrics.stage('juman'):
+                    fo.writelines('%s\n' % seg_line for seg_line in segmenter.segment(batch))
+                stats = segmenter.stats()
+            print('[juman] %i lines segmented, %i from the memory cache, %i from the disk cache' % (
+                stats['segmented'], stats['hits'], stats['disk_hits']))
+            for key, value in stats.items():
+                metrics.count('juman_cache/%s' % key, value)
+    metrics.count_file(txt_file)
+
+
+def iter_xml_sentences(xml_file):
+    """
+    generate the 'sentence' elements ET.parse(xml_file).getroot().findall('TEXT') would reach through
+    iter('sentence'), in the same order, parsing incrementally; each outermost sentence is cleared and detached once
+    its sentences are consumed, and so is every element outside a sentence once it ends
+    """
+    stack, sentence_depth = [], 0
+    for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            sentence_depth += elem.tag == 'sentence'
+            continue
+        stack.pop()
+        sentence_depth -= elem.tag == 'sentence'
+        if sentence_depth:
+            continue
+        if elem.tag == 'sentence' and len(stack) > 1 and stack[1].tag == 'TEXT':
+            yield from elem.iter('sentence')
+        if stack:
+            elem.clear()
+            stack[-1].remove(elem)
+
+
+def convert_xml_to_brat(xml_file, output_dir='data/tmp', validate=False, sink=None):
+    """ write the TimeBank-style xml_file as {output_dir}/{name}.txt/.ann to the sink, one sentence at a time """
+    from output_sink import FileSink
+
+    sink = sink or FileSink()
+    output_file = '%s/%s' % (output_dir, xml_file.split('/')[-1].split('.')[0])
+    tmp_offset, last_char = 0, ''
+    with sink.open('%s.txt' % output_file) as fot, sink.open('%s.ann' % output_file) as foa:
+        for sent_node in iter_xml_sentences(xml_file):
+            sent_segs, sent_offset, mention_offsets = [], tmp_offset, []
             for tag in sent_node.iter():
                 try:
                     if tag.text and tag.text.strip():
-                        char_seg = list(tag.text.strip())
-                        doc_toks += char_seg
+                        seg = tag.text.strip()
+                        sent_segs.append(seg)
                         if tag.tag in ['EVENT', 'event'] and 'eid' in tag.attrib:
-                            mention_offsets.append((tag.attrib['eid'], 'EVENT', tmp_offset, tmp_offset + len(char_seg), tag.text.strip()))
+                            mention_offsets.append((tag.attrib['eid'], 'EVENT', tmp_offset, tmp_offset + len(seg), seg))
                         elif tag.tag in ['TIMEX3'] and 'tid' in tag.attrib:
-                            mention_offsets.append((tag.attrib['tid'], 'TIMEX3', tmp_offset, tmp_offset + len(char_seg), tag.text.strip()))
-                        tmp_offset += len(char_seg)
+                            mention_offsets.append((tag.attrib['tid'], 'TIMEX3', tmp_offset, tmp_offset + len(seg), seg))
+                        tmp_offset += len(seg)
+                        last_char = seg[-1]
                     if tag.tag != 'sentence' and tag.tail and tag.tail.strip():
-                        char_seg = list(tag.tail.strip())
-                        doc_toks += char_seg
-                        tmp_offset += len(char_seg)
+                        seg = tag.tail.strip()
+                        sent_segs.append(seg)
+                        tmp_offset += len(seg)
+                        last_char = seg[-1]
                 except Exception as ex:
+                    metrics.count('parse_failures/xml2brat')
                     print('[ERROR]', ex)
-            if len(doc_toks) > 1:
-                if not (doc_toks[-1] == '\n'):
-                    doc_toks += ['\n']
-                    tmp_offset += 1
-            else:
-                doc_toks += ['\n']
+            if tmp_offset <= 1 or last_char != '\n':
+                sent_segs.append('\n')
                 tmp_offset += 1
-    output_file = '%s/%s' % (output_dir, xml_file.split('/')[-1].split('.')[0])
-    with open('%s.txt' % output_file, 'w') as fot:
-        fot.write('%s' % (''.join(doc_toks)))
-
-    with open('%s.ann' % output_file, 'w') as foa:
-        for mid, mtype, offs_b, offs_e, m in mention_offsets:
-            assert ''.join([doc_toks[i] for i in range(offs_b, offs_e)]) == m
-            foa.write('%s\t%s\t%i\t%i\t%s\n' % (mid, mtype, offs_b, offs_e, m))
-
-
-def extract_normtime_from_json(json_file, normtime_file):
-    import mojimoji
-
-    with open(json_file) as json_fi:
-        json_dict = json.load(json_fi)
-        pid_to_print = None
-        pdate_to_print = None
-        present_lines = []
-        for line_id, instance in json_dict['読影所見'].items():
-
-            if 'ann' not in instance or not instance['タイトル']:
-                continue
-
-            present_id = str(instance['表示順'])
-            present_date = str(instance['記載日']).split('T')[0]
-
-            if pid_to_print and present_id != pid_to_print:
-                out_file = f"{normtime_file}_{pid_to_print}_{pdate_to_print}.txt"
-                with open(out_file, 'w', encoding='utf8') as fo:
-                    for out_line in present_lines:
-                        fo.write(out_line)
-                print(f"output file: {out_file}...")
-                present_lines = []
-
-            pid_to_print = present_id
-            pdate_to_print = present_date
-
-            head_items = []
-            head_items.append(f"line id: {line_id}")
-            head_items.append(f"表示順: {present_id}")
-            patient_id = str(instance['匿名ID'])
-            head_items.append(f"匿名ID: {patient_id}")
-            head_items.append(f"タイトル: {instance['タイトル'].strip()}")
-            head_items.append(f"記載日: {present_date}")
-            head_line = f"## {' ||| '.join(head_items)}"
-
-            finding = instance['ann']
-            # finding = '\n'.join(ssplit(finding))
-            xml_str = '<doc>\n' + \
-                      '<s>%s</s>\n' % head_line + \
-                      '\n'.join(['<s>' + line.strip() + '</s>' for line in finding.split('\n')]) + '\n</doc>\n'
-            # xml_str = "<doc><s><a>sjdf</a>sdf</s></doc>"
-            xml_str = fix_xml_str(xml_str)
-            # print(xml_str)
-            try:
-                root = ET.ElementTree(ET.fromstring(xml_str)).getroot()
-                for sent_node in root.iter('s'):
-                    sent_text, timex_list, char_index = [], [], 0
-                    for tag in sent_node.iter():
-
-                        if tag.text:
-                            text_char = list(tag.text.replace('\n', ''))
-                            sent_text.append(''.join(text_char))
-
-                            if tag.tag == 'TIMEX3':
-                                timex_entry = f"\t{char_index}\t{char_index + len(text_char)}\t{tag.attrib['type']}\n"
-                                timex_list.append(timex_entry)
-                            char_index += len(text_char)
-
-                        if tag.tail:
-                            tail_char = list(tag.tail.replace('\n', ''))
-                            sent_text.append(''.join(tail_char))
-                            char_index += len(tail_char)
-
-                    present_lines.append(f"{''.join(sent_text)}\n")
-                    for t in timex_list:
-                        present_lines.append(t)
-                    present_lines.append('\n')
-
-            except Exception as ex:
-                print('[ERROR] line number：', line_id)
-                print(ex)
-                print(xml_str)
-
-        if pid_to_print:
+                last_char = '\n'
+            sent_text = ''.join(sent_segs)
+            fot.write(sent_text)
+            for mid, mtype, offs_b, offs_e, m in mention_offsets:
+                if validate:
+                    assert sent_text[offs_b - sent_offset:offs_e - sent_offset] == m
+                foa.write('%s\t%s\t%i\t%i\t%s\n' % (mid, mtype, offs_b, offs_e, m))
+
+
+def convert_xml_dir_to_brat(xml_dir, output_dir, validate=False, workers=1, sink=None):
+    """
+    convert every .xml file of xml_dir with convert_xml_to_brat, in a pool of 'workers' processes: they write their
+    files in place, or send them back for the sink of this process if it is not a plain FileSink
+    """
+    from functools import partial
+    from multiprocessing import Pool
+    from output_sink import FileSink
+
+    sink = sink or FileSink()
+    xml_files = [os.path.join(xml_dir, file_name) for file_name in sorted(os.listdir(xml_dir))
+                 if file_name.endswith('.xml')]
+    if workers > 1:
+        collect = type(sink) is not FileSink
+        with Pool(workers) as pool:
+            results = pool.imap(partial(convert_xml_file, output_dir=output_dir, validate=validate, collect=collect),
+                                xml_files)
+            errors = []
+            for error, files in results:
+                errors.append(error)
+                for name, data in files or []:
+                    sink.write(name, data)
+    else:
+        errors = [convert_xml_file(xml_file, output_dir, validate, sink=sink)[0] for xml_file in xml_files]
+    for xml_file, error in zip(xml_files, errors):
+        if error:
+            print('[ERROR] %s: %s' % (xml_file, error))
+    print('Converted %i xml files to brat, %i failed.' % (len(xml_files), sum(1 for error in errors if error)))
+
+
+def convert_xml_file(xml_file, output_dir, validate=False, sink=None, collect=False):
+    """
+    convert_xml_to_brat for the batch mode, returning (error message, None) instead of raising; with collect=True the
+    files are not written but returned as (name, bytes) pairs instead of None
+    """
+    from output_sink import MemorySink
+
+    if collect:
+        sink = MemorySink()
+    try:
+        convert_xml_to_brat(xml_file, output_dir, validate, sink=sink)
+    except Exception as ex:
+        return str(ex), None
+    return None, sink.files if collect else None
+
+
+def etree_markup_lines(xml_str, line_tag, line_tail=False):
+    """
+    the (text, tag, attrs) items of every line element in the order of `for tag in line.iter()`: an element's text
+    with its tag (None for the line itself), then its tail as (tail, None, None) (the line's own tail only with
+    line_tail=True); raises on markup ElementTree cannot parse
+    """
+    root = ET.fromstring(xml_str)
+    lines = []
+    for sent_node in root.iter(line_tag):
+        items = []
+        for tag in sent_node.iter():
+            if tag.text:
+                items.append((tag.text, None, {}) if tag.tag == line_tag else (tag.text, tag.tag, tag.attrib))
+            if tag.tail and (line_tail or tag.tag != line_tag):
+                items.append((tag.tail, None, None))
+        lines.append(items)
+    return lines
+
+
+def markup_lines(xml_str, line_tag, parser='etree', line_tail=False):
+    """
+    (lines, problems) of a wrapped report, see etree_markup_lines; parser='lexer' reads it with markup_lexer, which
+    gives the same lines on well-formed markup and recovers broken markup tag by tag instead of failing the report
+    (the recoveries are listed in problems), falling back to ElementTree on structures it does not reproduce
+    """
+    if parser == 'lexer':
+        try:
+            return parse_markup_lines(xml_str, line_tag, tag2name, line_tail)
+        except UnsupportedMarkup:
+            pass
+    return etree_markup_lines(xml_str, line_tag, line_tail), []
+
+
+def extract_normtime_from_json(json_file, normtime_file, parser='etree', sink=None):
+    from output_sink import FileSink
+
+    sink = sink or FileSink()
+    pid_to_print = None
+    pdate_to_print = None
+    present_lines = []
+    for line_id, instance in metrics.timed_iter('read_json', iter_json_records(json_file)):
+
+        if 'ann' not in instance or not instance['タイトル']:
+            continue
+        metrics.count('reports')
+
+        present_id = str(instance['表示順'])
+        present_date = str(instance['記載日']).split('T')[0]
+
+        if pid_to_print and present_id != pid_to_print:
             out_file = f"{normtime_file}_{pid_to_print}_{pdate_to_print}.txt"
-            with open(out_file, 'w', encoding='utf8') as fo:
+            with metrics.stage('write_norm'), sink.open(out_file, encoding='utf8') as fo:
                 for out_line in present_lines:
                     fo.write(out_line)
             print(f"output file: {out_file}...")
+            present_lines = []
+
+        pid_to_print = present_id
+        pdate_to_print = present_date
+
+        head_items = []
+        head_items.append(f"line id: {line_id}")
+        head_items.append(f"表示順: {present_id}")
+        patient_id = str(instance['匿名ID'])
+        head_items.append(f"匿名ID: {patient_id}")
+        head_items.append(f"タイトル: {instance['タイトル'].strip()}")
+        head_items.append(f"記載日: {present_date}")
+        head_line = f"## {' ||| '.join(head_items)}"
+
+        finding = instance['ann']
+        # finding = '\n'.join(ssplit(finding))
+        xml_str = '<doc>\n' + \
+                  '<s>%s</s>\n' % head_line + \
+                  '\n'.join(['<s>' + line.strip() + '</s>' for line in finding.split('\n')]) + '\n</doc>\n'
+        # xml_str = "<doc><s><a>sjdf</a>sdf</s></doc>"
+        xml_str = fix_xml_str(xml_str)
+        # print(xml_str)
+        try:
+            with metrics.stage('xml_parse'):
+                lines, problems = markup_lines(xml_str, 's', parser, line_tail=True)
+            if problems:
+                metrics.count('markup_recoveries/json2norm')
+                print('[RECOVERED] line number：', line_id, '; '.join(problems))
+            for items in lines:
+                sent_text, timex_list, char_index = [], [], 0
+                for text, tag, attrs in items:
+                    text_char = list(text.replace('\n', ''))
+                    sent_text.append(''.join(text_char))
+
+                    if tag == 'TIMEX3':
+                        timex_entry = f"\t{char_index}\t{char_index + len(text_char)}\t{attrs['type']}\n"
+                        timex_list.append(timex_entry)
+                    char_index += len(text_char)
+
+                present_lines.append(f"{''.join(sent_text)}\n")
+                for t in timex_list:
+                    present_lines.append(t)
+                present_lines.append('\n')
+
+        except Exception as ex:
+            metrics.count('parse_failures/json2norm')
+            print('[ERROR] line number：', line_id)
+            print(ex)
+            print(xml_str)
+
+    if pid_to_print:
+        out_file = f"{normtime_file}_{pid_to_print}_{pdate_to_print}.txt"
+        with metrics.stage('write_norm'), sink.open(out_file, encoding='utf8') as fo:
+            for out_line in present_lines:
+                fo.write(out_line)
+        print(f"output file: {out_file}...")
+
+
+def report_markup(finding, corpus, sent_split=False, head_line=None, normalized=False):
+    """
+    the repaired '<doc><line>...' markup of a finding, one '<line>' per line (or sentence with sent_split), after
+    the comment line head_line unless it is None; normalized=True for a finding xls2json already put in the
+    CORPUS_FORMS form of the corpus, which the repairs leave in that form
+    """
+    finding = fix_finding_str(finding)
+    if sent_split:
+        xml_str = split_sent_to_xml(finding, head_line)
+    else:
+        if corpus in ['ou', 'ncc']:
+            if not normalized:
+                with metrics.stage('normalize'):
+                    finding = normalize_text(finding, CORPUS_FORMS[corpus])
+            from textformatting import ssplit
+            with metrics.stage('sentence_split'):
+                finding = '\n'.join(ssplit(finding))
+        xml_str = '<doc>\n' + \
+                  (f'<line>{head_line}</line>\n' if head_line is not None else '') + \
+                  '\n'.join([f'<line>{line.strip()}</line>' for line in finding.split('\n')]) + '\n</doc>\n'
+    return fix_xml_str(xml_str)
+
+
+def markup_to_brat(lines, headed=False):
+    """
+    (text segments, tags, attrs) of the line items of markup_lines, char offsets counted from the first line;
+    headed=True for a finding read without the comment line it follows in its report
+    """
+    segs, tags, attrs = [], [], []
+    char_offset, last_char = 0, '\n' if headed else ''
+    for items in lines:
+        for text, tag, tag_attrs in items:
+            if tag is not None:
+                for key, value in tag_attrs.items():
+                    attrs.append((key, len(tags), value))
+                tags.append((
+                    tag,
+                    char_offset,
+                    char_offset + len(text),
+                    text
+                ))
+            segs.append(text)
+            char_offset += len(text)
+            last_char = text[-1]
+        # every line ends with a line break, unless the report so far is longer than one char and already does
+        if (char_offset <= 1 and not headed) or last_char != '\n':
+            segs.append('\n')
+            char_offset += 1
+            last_char = '\n'
+    return segs, tags, attrs
+
+
+# chars that keep a comment line from being read as plain text before a cached finding
+UNSAFE_HEAD_RE = re.compile('[<>&\x00-\x08\x0a-\x1f\ufffe\uffff]')
+
+
+def finding_cache_key(instance, corpus, type_col, ann_col, sent_split=False, parser='etree'):
+    """ the parse cache key of a report's finding, None for the reports convert_report_to_brat skips """
+    from parse_cache import content_key
+    if ann_col not in instance or (type_col in instance and instance[type_col].strip() in ['I']):
+        return None
+    return content_key(instance[ann_col], corpus, sent_split, parser, sent_split or corpus in ['mr'],
+                       CONVERTER_VERSION, get_repair_rules_digest())
+
+
+def parse_finding(finding, corpus, sent_split=False, parser='etree', headed=False, normalized=False):
+    """
+    the parse cache entry of a finding read without its comment line, (text, tags, attrs, problems) with offsets
+    relative to the finding; None if it does not parse
+    """
+    xml_str = report_markup(finding, corpus, sent_split, normalized=normalized)
+    try:
+        with metrics.stage('xml_parse'):
+            lines, problems = markup_lines(xml_str, 'line', parser)
+    except Exception:
+        return None
+    segs, tags, attrs = markup_to_brat(lines, headed)
+    return ''.join(segs), tags, attrs, problems
+
+
+def convert_report_to_brat(line_id, instance, corpus,
+                           rid_col, pid_col, date_col, type_col, ann_col,
+                           sent_split=False, validate=False, parser='etree', cache=None, normalized=False):
+    """
+    convert one report into (text, tags, attrs, error), with char offsets relative to the report text,
+    tags as (ttype, char_b, char_e, surface) and attrs as (key, tag index, value); None if the report is skipped.
+    parser is 'etree' or 'lexer', see markup_lines. With a ParseCache, a finding that was parsed before is only
+    shifted behind the comment line of the report. normalized=True skips the normalization, see report_markup
+    """
+    '''
+    comment line: ## line id: 1 ||| 表示順: 1 ||| 匿名ID: 3276171 ||| タイトル: S ||| 記載日: 2014-03-20
+    '''
+    line_id = int(line_id)
+    comment_items = [f"line id: {line_id}"]
+
+    patient_id = str(instance[pid_col]).strip()
+    report_id = str(instance[rid_col])
+    comment_items.append(f"表示順: {report_id}")
+
+    if ann_col not in instance:
+        return None
+    finding = instance[ann_col]
+
+    comment_items.append(f"匿名ID: {patient_id}")
+
+    if type_col in instance:
+        if instance[type_col].strip() in ['I']:
+            return None
+        comment_items.append("タイトル: %s" % instance['タイトル'].strip())
+
+    comment_items.append(f"記載日: {str(instance[date_col]).split('T')[0]}")
+    head_line = "## %s" % ' ||| '.join(comment_items)
+    headed = sent_split or corpus in ['mr']
+
+    if cache is not None and not (headed and (UNSAFE_HEAD_RE.search(head_line) or fix_xml_str(head_line) != head_line)):
+        key = finding_cache_key(instance, corpus, type_col, ann_col, sent_split, parser)
+        entry = cache.get(key)
+        if entry is None:
+            entry = parse_finding(finding, corpus, sent_split, parser, headed, normalized)
+            if entry is not None:
+                cache.put(key, entry)
+        # a finding that does not parse takes the path below, which reports it
+        if entry is not None:
+            text, tags, attrs, problems = entry
+            if headed:
+                shift = len(head_line) + 1
+                text = head_line + '\n' + text
+                tags = [(ttype, char_b + shift, char_e + shift, t) for ttype, char_b, char_e, t in tags]
+            if problems:
+                metrics.count('markup_recoveries/%s' % corpus)
+                print(f'[RECOVERED] line number：{line_id}, rid: {report_id}, %s' % '; '.join(problems))
+            if not validate or all(text[char_b:char_e] == t for ttype, char_b, char_e, t in tags):
+                return text, tags, attrs, None
+
+    xml_str = report_markup(finding, corpus, sent_split, head_line if headed else None, normalized)
+    tmp_segs, tmp_tags = [], []
+    try:
+        with metrics.stage('xml_parse'):
+            lines, problems = markup_lines(xml_str, 'line', parser)
+        if problems:
+            metrics.count('markup_recoveries/%s' % corpus)
+            print(f'[RECOVERED] line number：{line_id}, rid: {report_id}, %s' % '; '.join(problems))
+        tmp_segs, tmp_tags, tmp_attrs = markup_to_brat(lines)
+        text = ''.join(tmp_segs)
+        if validate:
+            for ttype, char_b, char_e, t in tmp_tags:
+                assert text[char_b:char_e] == t, 'offsets %i-%i do not match %s' % (char_b, char_e, t)
+        return text, tmp_tags, tmp_attrs, None
+
+    except Exception as ex:
+        metrics.count('parse_failures/%s' % corpus)
+        text = ''.join(tmp_segs)
+        error = [f'[ERROR] line number：{line_id}, rid: {report_id}', str(ex), xml_str, '', str(tmp_segs), '']
+        for ttype, char_b, char_e, t in tmp_tags:
+            error.append(f"{char_b} {char_e} {text[char_b:char_e]} {t}")
+        error.append('')
+        return '', [], [], '\n'.join(error)
+
+
+def convert_report_group(group, **kwargs):
+    """ convert one 表示順 group of (line id, instance) pairs, used as the process pool task """
+    return [convert_report_to_brat(line_id, instance, **kwargs) for line_id, instance in group]
+
+
+def convert_report_group_in_pool(task, metered=False, **kwargs):
+    """
+    convert_report_group as a pool task on (group, cache entries), the entries the main process has for the
+    group's findings or None without a cache; returns (results, the worker's metrics for the group or None,
+    the cache entries parsed here)
+    """
+    from parse_cache import ParseCache
+    group, entries = task
+    if metered:
+        metrics.enable()
+        metrics.reset()
+    cache = None
+    if entries is not None:
+        cache = ParseCache(cache_size=len(entries) + len(group), keep_added=True)
+        cache.update(entries)
+    results = convert_report_group(group, cache=cache, **kwargs)
+    return results, metrics.snapshot() if metered else None, cache.take_added() if cache else {}
+
+
+def iter_report_groups(records, rid_col):
+    """ split (line id, instance) pairs into runs of consecutive reports sharing the same 表示順 """
+    group, group_rid = [], None
+    for line_id, instance in records:
+        report_id = str(instance[rid_col])
+        if group and report_id != group_rid:
+            yield group
+            group = []
+        group.append((line_id, instance))
+        group_rid = report_id
+    if group:
+        yield group
+
+
+def write_brat_files(sink, brat_file, out_rid, char_toks, tags, attrs):
+    """ write {brat_file}.{out_rid}.txt/.ann to the sink """
+    with metrics.stage('write_brat'):
+        with sink.open(f'{brat_file}.{out_rid}.txt') as fot:
+            fot.write(''.join(char_toks))
+        with sink.open(f'{brat_file}.{out_rid}.ann') as foa:
+            foa.writelines(format_brat_ann(tags, attrs))
+
+
+def format_brat_ann(tags, attrs):
+    """ the .ann lines of the T and A entries of a brat pair """
+    ann_lines = []
+    for tid, ttype, char_b, char_e, t in tags:
+        ann_lines.append('%s\t%s %s %s\t%s\n' % (
+            tid,
+            tag2name[ttype],
+            char_b,
+            char_e,
+            t
+        ))
+
+    for aid, key, tid, value in attrs:
+        if key != 'tid':
+            ann_lines.append('%s\t%s %s %s\n' % (
+                aid,
+                key,
+                tid,
+                value
+            ))
+    return ann_lines
+
+
+def group_fingerprint(group, settings):
+    """ content hash of one 表示順 group: its (line id, record) pairs plus the corpus settings and converter version """
+    import hashlib
+    group_str = json.dumps({'settings': settings, 'records': group},
+                           ensure_ascii=False, sort_keys=True, default=json_serial)
+    return hashlib.sha1(group_str.encode('utf-8')).hexdigest()
+
+
+def iter_lookahead(items):
+    """ generate (item, is_last) pairs, reading one item ahead """
+    items = iter(items)
+    try:
+        prev = next(items)
+    except StopIteration:
+        return
+    for item in items:
+        yield prev, False
+        prev = item
+    yield prev, True
+
+
+def iter_group_results(items, convert_group, pool=None, window=1):
+    """
+    generate (item, results) in input order from (item, group, skip) triples: skipped groups get None results, the
+    others are converted in the pool with at most 'window' groups submitted ahead, or in place without a pool
+    """
+    from collections import deque
+    from functools import partial
+
+    pending = deque()
+    for item, group, skip in items:
+        if skip:
+            get_results = lambda: None
+        elif pool:
+            get_results = pool.apply_async(convert_group, (group,)).get
+        else:
+            get_results = partial(convert_group, group)
+        pending.append((item, get_results))
+        while len(pending) > (window if pool else 0):
+            item, get_results = pending.popleft()
+            yield item, get_results()
+    while pending:
+        item, get_results = pending.popleft()
+        yield item, get_results()
 
 
 def extract_brat_from_json(json_file, brat_file, corpus,
                            rid_col, pid_col, date_col, type_col, ann_col,
-                           sent_split=False):
-    import mojimoji
-
-    with open(json_file) as json_fi:
-        json_dict = json.load(json_fi)
+                           sent_split=False, validate=False, workers=1, incremental=False, parser='etree',
+                           cache_size=0, cache_file=None, shard_reports=None, shard_chars=None, sink=None):
+    """
+    write one brat .txt/.ann pair per 表示順 group to the sink (files in place by default); the '{brat_file}.manifest.json' records a fingerprint per
+    written pair, and with incremental=True the groups whose fingerprint and files are unchanged are not rewritten.
+    With shard_reports and/or shard_chars, consecutive groups are packed instead into '{brat_file}.shard00001'...
+    pairs of at most that many reports and chars, listed with their line ids in the manifest (see ShardPacker).
+    The records are streamed from the json (or ndjson) file, so only the groups in flight are held in memory.
+    Parsed findings are cached by content, in an LRU of cache_size findings and in the sqlite cache_file if given.
+    """
+    normalized = read_normalized(json_file)
+    records = metrics.timed_iter('read_json', iter_json_records(json_file))
+    for _ in iter_brat_units(records, brat_file, corpus, rid_col, pid_col, date_col, type_col, ann_col,
+                             sent_split=sent_split, validate=validate, workers=workers, incremental=incremental,
+                             parser=parser, cache_size=cache_size, cache_file=cache_file,
+                             shard_reports=shard_reports, shard_chars=shard_chars, sink=sink, normalized=normalized):
+        pass
+
+
+def iter_brat_units(records, brat_file, corpus,
+                    rid_col, pid_col, date_col, type_col, ann_col,
+                    sent_split=False, validate=False, workers=1, incremental=False, parser='etree',
+                    cache_size=0, cache_file=None, shard_reports=None, shard_chars=None, sink=None, normalized=None):
+    """
+    write the brat pairs of a stream of (line id, record) pairs as extract_brat_from_json does, generating
+    (unit records, unit) once per brat pair in input order: the (line id, record) pairs it covers and its
+    (char_toks, tags, attrs), or None for kept pairs and for trailing records no pair was written for. With
+    shards, a unit is the list of the shards holding the reports of the records, once they are written.
+    normalized is the {column: form} of the records' 正規化; an ann_col in the corpus form is not normalized again
+    """
+    from functools import partial
+    from collections import deque
+    from multiprocessing import Pool
+    from parse_cache import ParseCache
+    from brat_shards import ShardPacker
+    from brat_incremental import SegmentManifest, plan_segments
+    from output_sink import FileSink
+
+    sink = sink or FileSink()
+    settings = {'corpus': corpus, 'rid_col': rid_col, 'pid_col': pid_col, 'date_col': date_col,
+                'type_col': type_col, 'ann_col': ann_col, 'sent_split': sent_split, 'parser': parser,
+                'version': CONVERTER_VERSION, 'repair_rules': get_repair_rules_digest()}
+    packer = None
+    if shard_reports or shard_chars:
+        if incremental:
+            raise Exception('[ERROR] incremental json2brat does not support sharded brat output')
+        settings['shards'] = {'reports': shard_reports, 'chars': shard_chars}
+        # the written shards, until the pairs in them are drained
+        shard_units = {}
+
+        def write_shard(index, name, char_toks, tags, attrs):
+            write_brat_files(sink, brat_file, name, char_toks, tags, attrs)
+            shard_units[index] = (char_toks, tags, attrs, set(packer.shards[index]['pair_ends']))
+
+        packer = ShardPacker(write_shard, shard_reports, shard_chars)
+    manifest_file = f'{brat_file}.manifest.json'
+    prev_manifest, prev_files = {}, {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as manifest_fi:
+            prev_manifest = json.load(manifest_fi)
+        if incremental and prev_manifest.get('settings') == settings:
+            prev_files = prev_manifest.get('files', {})
+
+    def pair_exists(out_rid):
+        return os.path.isfile(f'{brat_file}.{out_rid}.txt') and os.path.isfile(f'{brat_file}.{out_rid}.ann')
+
+    def plan_groups():
+        """ (group info, group, keep) per group, see plan_segments """
+        groups = ((group, group_fingerprint(group, settings), is_last)
+                  for group, is_last in iter_lookahead(iter_report_groups(records, rid_col)))
+        for info in plan_segments(groups, prev_files, lambda group: str(group[0][1][rid_col]), pair_exists):
+            yield info, info[0], info[3]
+
+    def cache_entries(group):
+        """ the cached entries of a group's findings, looked up here for a pool worker """
+        entries = {}
+        for line_id, instance in group:
+            key = finding_cache_key(instance, corpus, type_col, ann_col, sent_split, parser)
+            if key is not None and key not in entries:
+                entry = cache.get(key)
+                if entry is not None:
+                    entries[key] = entry
+        return entries
+
+    # the findings xls2json --normalize already put in the corpus form
+    ann_normalized = CORPUS_FORMS[corpus] is not None and (normalized or {}).get(ann_col) == CORPUS_FORMS[corpus]
+    group_kwargs = dict(corpus=corpus, rid_col=rid_col, pid_col=pid_col, date_col=date_col, type_col=type_col,
+                        ann_col=ann_col, sent_split=sent_split, validate=validate, parser=parser,
+                        normalized=ann_normalized)
+    cache = ParseCache(cache_size, cache_file) if cache_size or cache_file else None
+    convert_group = partial(convert_report_group, cache=cache, **group_kwargs)
+    pool = Pool(workers) if workers > 1 else None
+    # pool workers send their metrics back with each group's results
+    metered = pool is not None and metrics.enabled
+    try:
+        if pool:
+            # the cache stays in this process: a worker gets the entries of its group and sends back the new ones
+            group_results = iter_group_results(
+                ((info, (group, cache_entries(group) if cache and not keep else None), keep)
+                 for info, group, keep in plan_groups()),
+                partial(convert_report_group_in_pool, metered=metered, **group_kwargs), pool, window=2 * workers)
+        else:
+            group_results = iter_group_results(plan_groups(), convert_group)
+
+        # reports are converted independently, the 表示順 groups are stitched together here in order
         char_toks, tags, attrs = [], [], []
         char_offset, tag_offset, attr_offset = 0, 1, 1
         prev_delimiter_flag = None
-        for line_id, instance in json_dict['読影所見'].items():
-
-            '''
-            comment line: ## line id: 1 ||| 表示順: 1 ||| 匿名ID: 3276171 ||| タイトル: S ||| 記載日: 2014-03-20
-            '''
-            line_id = int(line_id)
-            comment_items = [f"line id: {line_id}"]
-
-            patient_id = str(instance[pid_col]).strip()
-            report_id = str(instance[rid_col])
-            curr_delimiter_flag = report_id
-            comment_items.append(f"表示順: {curr_delimiter_flag}")
-
-            # print(line_id, report_id)
-
-            if not prev_delimiter_flag:
-                prev_delimiter_flag = curr_delimiter_flag
-
-            if tags and curr_delimiter_flag != prev_delimiter_flag:
-
-                out_rid = f"表示順{prev_delimiter_flag}"
-
-                with open(f'{brat_file}.{out_rid}.txt', 'w') as fot:
-                    fot.write('%s' % (''.join(char_toks)))
-
-                with open(f'{brat_file}.{out_rid}.ann', 'w') as foa:
-                    for tid, ttype, char_b, char_e, t in tags:
-                        foa.write('%s\t%s %s %s\t%s\n' % (
-                            tid,
-                            tag2name[ttype],
-                            char_b,
-                            char_e,
-                            t
-                        ))
-
-                    for aid, key, tid, value in attrs:
-
-                        if key != 'tid':
-                            foa.write('%s\t%s %s %s\n' % (
-                                aid,
-                                key,
-                                tid,
-                                value
-                            ))
-                print('Converted json to brat, 表示順: %s processed.' % prev_delimiter_flag)
-
-                # reset caches
-                char_toks, tags, attrs = [], [], []
-                char_offset, tag_offset, attr_offset = 0, 1, 1
-                prev_delimiter_flag = curr_delimiter_flag
-
-            if ann_col not in instance:
+        unit_line_ids, unit_records = [], []
+        segments = SegmentManifest()
+        # the groups still to pass of a kept segment
+        span_left = 0
+        flushed = deque()
+
+        def flush(out_rid):
+            if packer:
+                # the shards the pair goes to, its records wait for them to be written
+                flushed.append((unit_records, packer.add(out_rid, unit_line_ids, char_toks, tags, attrs)))
+            else:
+                write_brat_files(sink, brat_file, out_rid, char_toks, tags, attrs)
+                segments.add_pair(out_rid, unit_line_ids)
+                flushed.append((unit_records, (char_toks, tags, attrs)))
+
+        def drain():
+            """
+            the flushed (unit records, unit) pairs that are ready; with shards, the records of the pairs whose shards
+            are all written go out together, with the list of those shards as their unit
+            """
+            if not packer:
+                while flushed:
+                    yield flushed.popleft()
+                return
+            ready_records, first, last = [], None, None
+            while flushed and (flushed[0][1] is None or flushed[0][1][1] < len(packer.shards)):
+                unit_records, unit = flushed.popleft()
+                ready_records.extend(unit_records)
+                if unit is not None:
+                    first = unit[0] if first is None else first
+                    last = unit[1]
+            if ready_records:
+                yield ready_records, None if first is None else [shard_units[i] for i in range(first, last + 1)]
+            # the shards no waiting pair needs any more
+            needed = min([unit[0] for _, unit in flushed if unit is not None] + [len(packer.shards)])
+            for index in [index for index in shard_units if index < needed]:
+                del shard_units[index]
+
+        for (group, fingerprint, is_last, keep, kept_rids), results in group_results:
+            curr_delimiter_flag = str(group[0][1][rid_col])
+            if keep < 0 and span_left:
+                # a later group of the kept segment
+                span_left -= 1
+                flushed.append((list(group), None))
+                yield from drain()
                 continue
-            finding = instance[ann_col]
-            finding = fix_finding_str(finding)
-
-            comment_items.append(f"匿名ID: {patient_id}")
-
-            if type_col in instance:
-                if instance[type_col].strip() in ['I']:
+            if keep > 0:
+                # the first report's delimiter check, done early to see whether a new brat pair starts here
+                if not prev_delimiter_flag:
+                    prev_delimiter_flag = curr_delimiter_flag
+                if tags and curr_delimiter_flag != prev_delimiter_flag:
+                    flush(f"表示順{prev_delimiter_flag}")
+                    segments.end_segment()
+                    print('Converted json to brat, 表示順: %s processed.' % prev_delimiter_flag)
+
+                    # reset caches
+                    char_toks, tags, attrs = [], [], []
+                    char_offset, tag_offset, attr_offset = 0, 1, 1
+                    prev_delimiter_flag = curr_delimiter_flag
+                    unit_line_ids, unit_records = [], []
+                if not char_toks and not tags and prev_delimiter_flag == curr_delimiter_flag:
+                    segments.keep(kept_rids, prev_files)
+                    if unit_records:
+                        flushed.append((unit_records, None))
+                    flushed.append((list(group), None))
+                    prev_delimiter_flag = None
+                    unit_line_ids, unit_records = [], []
+                    span_left = keep - 1
+                    yield from drain()
                     continue
-                comment_items.append("タイトル: %s" % instance['タイトル'].strip())
-
-            comment_items.append(f"記載日: {str(instance[date_col]).split('T')[0]}")
-            head_line = "## %s" % ' ||| '.join(comment_items)
-
-            if sent_split:
-                xml_str = split_sent_to_xml(finding, head_line)
-            else:
-                if corpus in ['ou', 'ncc']:
-                    finding = '\n'.join(ssplit(mojimoji.zen_to_han(finding, kana=False)))
-                xml_str = '<doc>\n' + \
-                          (f'<line>{head_line}</line>\n' if corpus in ['mr'] else '') + \
-                          '\n'.join([f'<line>{line.strip()}</line>' for line in finding.split('\n')]) + '\n</doc>\n'
-
-            xml_str = fix_xml_str(xml_str)
-            tmp_char_toks, tmp_tags, tmp_attrs = [], [], []
-            tmp_char_offset, tmp_tag_offset, tmp_attr_offset = char_offset, tag_offset, attr_offset
-            try:
-                root = ET.ElementTree(ET.fromstring(xml_str)).getroot()
-                for sent_node in root.iter('line'):
-                    for tag in sent_node.iter():
-                        if tag.text:
-                            char_seg = list(tag.text)
-                            tmp_char_toks += char_seg
-                            if tag.tag != 'line':
-                                tmp_tags.append((
-                                    'T%i' % tmp_tag_offset,
-                                    tag.tag,
-                                    tmp_char_offset,
-                                    tmp_char_offset + len(char_seg),
-                                    tag.text
-                                ))
-                                if tag.attrib:
-                                    for key, value in tag.attrib.items():
-                                        tmp_attrs.append((
-                                            'A%i' % tmp_attr_offset,
-                                            key,
-                                            'T%i' % tmp_tag_offset,
-                                            value
-                                        ))
-                                        tmp_attr_offset += 1
-                                tmp_tag_offset += 1
-                            tmp_char_offset += len(char_seg)
-                        if tag.tag != 'line' and tag.tail:
-                            char_seg = list(tag.tail)
-                            tmp_char_toks += char_seg
-                            tmp_char_offset += len(char_seg)
-                    if len(tmp_char_toks) > 1:
-                        if not (tmp_char_toks[-1] == '\n'):
-                            tmp_char_toks += ['\n']
-                            tmp_char_offset += 1
-                    else:
-                        tmp_char_toks += ['\n']
-                        tmp_char_offset += 1
-                char_toks += tmp_char_toks
-                tags += tmp_tags
-                attrs += tmp_attrs
-                char_offset, tag_offset, attr_offset = tmp_char_offset, tmp_tag_offset, tmp_attr_offset
-                for tid, ttype, char_b, char_e, t in tmp_tags:
-                    assert ''.join([char_toks[i] for i in range(char_b, char_e)]) == t
-
-            except Exception as ex:
-                print(f'[ERROR] line number：{line_id}, rid: {report_id}')
-                print(ex)
-                print(xml_str)
-                print()
-                print(tmp_char_toks)
-                print()
-                for tid, ttype, char_b, char_e, t in tmp_tags:
-                    print(char_b, char_e, ''.join([char_toks[i] for i in range(char_b, char_e)]), t)
-                print()
-
-            if line_id == len(json_dict['読影所見']) and char_toks:
-                out_rid = f"表示順{curr_delimiter_flag}"
-
-                with open(f'{brat_file}.{out_rid}.txt', 'w') as fot:
-                    fot.write('%s' % (''.join(char_toks)))
-
-                with open(f'{brat_file}.{out_rid}.ann', 'w') as foa:
-                    for tid, ttype, char_b, char_e, t in tags:
-                        foa.write('%s\t%s %s %s\t%s\n' % (
-                            tid,
-                            tag2name[ttype],
-                            char_b,
-                            char_e,
-                            t
-                        ))
-
-                    for aid, key, tid, value in attrs:
-                        if key != 'tid':
-                            foa.write('%s\t%s %s %s\n' % (
-                                aid,
-                                key,
-                                tid,
-                                value
-                            ))
-                print('Converted json to brat, 表示順: %s processed.' % prev_delimiter_flag)
-
-
-def combine_brat_to_json(json_file, brat_file, new_json):
+            if keep:
+                results = convert_group(group)
+            elif pool:
+                results, worker_metrics, added = results
+                if worker_metrics:
+                    metrics.merge(worker_metrics)
+                for key, entry in added.items():
+                    cache.put(key, entry)
+
+            for record_index, ((line_id, instance), result) in enumerate(zip(group, results)):
+                line_id = int(line_id)
+                curr_delimiter_flag = str(instance[rid_col])
+
+                if not prev_delimiter_flag:
+                    prev_delimiter_flag = curr_delimiter_flag
+
+                if tags and curr_delimiter_flag != prev_delimiter_flag:
+                    flush(f"表示順{prev_delimiter_flag}")
+                    if record_index == 0:
+                        segments.end_segment()
+                    print('Converted json to brat, 表示順: %s processed.' % prev_delimiter_flag)
+
+                    # reset caches
+                    char_toks, tags, attrs = [], [], []
+                    char_offset, tag_offset, attr_offset = 0, 1, 1
+                    prev_delimiter_flag = curr_delimiter_flag
+                    unit_line_ids, unit_records = [], []
+
+                if record_index == 0:
+                    segments.add_group(curr_delimiter_flag, fingerprint)
+                unit_records.append((group[record_index][0], instance))
+
+                if result is None:
+                    continue
+                metrics.count('reports')
+                text, tmp_tags, tmp_attrs, error = result
+                if error:
+                    print(error)
+                else:
+                    char_toks.append(text)
+                    for tag_index, (ttype, char_b, char_e, t) in enumerate(tmp_tags):
+                        tags.append(('T%i' % (tag_offset + tag_index), ttype,
+                                     char_offset + char_b, char_offset + char_e, t))
+                    for attr_index, (key, tag_index, value) in enumerate(tmp_attrs):
+                        attrs.append(('A%i' % (attr_offset + attr_index), key,
+                                      'T%i' % (tag_offset + tag_index), value))
+                    char_offset += len(text)
+                    tag_offset += len(tmp_tags)
+                    attr_offset += len(tmp_attrs)
+                    unit_line_ids.append(str(line_id))
+
+                if is_last and record_index == len(group) - 1 and char_toks:
+                    flush(f"表示順{curr_delimiter_flag}")
+                    segments.end_segment(final=True)
+                    print('Converted json to brat, 表示順: %s processed.' % prev_delimiter_flag)
+                    unit_records = []
+            yield from drain()
+        if unit_records:
+            flushed.append((unit_records, None))
+        # the trailing reports without a pair end the last segment as well
+        segments.end_segment(final=True)
+        if packer:
+            packer.flush()
+        yield from drain()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if cache:
+            cache.close()
+
+    if cache:
+        stats = cache.stats()
+        for name in ('hits', 'disk_hits', 'misses'):
+            metrics.count('parse_cache/%s' % name, stats[name])
+        print('[parse cache] %i hits, %i disk hits, %i misses, hit rate %.1f%%, %i entries in memory' % (
+            stats['hits'], stats['disk_hits'], stats['misses'], 100 * stats['hit_rate'], stats['entries']))
+    # brat2json would merge the pairs of the previous run this one did not write back in
+    stale = segments.stale(prev_manifest, packer.shards if packer else ())
+    for name in stale:
+        sink.remove(f'{brat_file}.{name}.txt')
+        sink.remove(f'{brat_file}.{name}.ann')
+    if incremental:
+        print('[incremental] %i brat files written, %i unchanged kept, %i from the previous run no longer produced '
+              'and removed' % (len(segments.files) - len(segments.kept), len(segments.kept), len(stale)))
+    elif stale:
+        print('%i brat files from the previous run no longer produced and removed' % len(stale))
+    manifest = {'settings': settings, 'files': segments.files}
+    if packer:
+        # brat2json reads the shards from here rather than listing the brat directory
+        manifest['shards'] = packer.shards
+        print('%i brat shards written' % len(packer.shards))
+    with open(manifest_file, 'w', encoding='utf-8') as manifest_fo:
+        json.dump(manifest, manifest_fo, ensure_ascii=False, indent=2)
+
+
+def merge_brat_annotation(text, entities, tid2cert):
+    """
+    rebuild the inline xml annotation of a brat text from its (tid, tag type, char_b, char_e) entities,
+    sorting the tag boundaries once and writing text slices and tags in one forward pass
+    """
+    events = []
+    for order, (tid, tag_type, char_b, char_e) in enumerate(entities):
+        elems = [name2tag[tag_type]]
+        elems.append('tid="%s"' % tid)
+        if tid in tid2cert:
+            elems.append('%s="%s"' % tid2cert[tid])
+        start_tag = '<%s>' % (' '.join(elems))
+        end_tag = '</%s>' % (name2tag[tag_type])
+        # at one offset: end tags (innermost first), then zero-length spans, then start tags (outermost first)
+        if char_b == char_e:
+            events.append((char_b, 1, 0, order, start_tag + end_tag))
+        else:
+            events.append((char_e, 0, -char_b, -order, end_tag))
+            events.append((char_b, 2, -char_e, order, start_tag))
+    events.sort()
+
+    segs, prev_offset = [], 0
+    for offset, _, _, _, tag in events:
+        if offset > prev_offset:
+            segs.append(text[prev_offset:offset])
+            prev_offset = offset
+        segs.append(tag)
+    segs.append(text[prev_offset:])
+    return ''.join(segs)
+
+
+def read_brat_ann(ann_lines):
+    """ parse .ann lines into (entities, tid2cert, rid2rels) """
     from collections import defaultdict
-    with open(json_file, 'r') as json_fi:
-        json_dict = json.load(json_fi)
-
-        brat_dir, brat_name = os.path.split(brat_file)
-        brat_file_list = set([os.path.join(brat_dir, '.'.join(filename.split('.')[:-1])) for filename in sorted(os.listdir(brat_dir)) if filename.startswith(brat_name)])
-
-        for file_name in brat_file_list:
-            print(file_name)
-            # if file_name != "data/brat/sample001":
-            #     continue
-            # print(file_name)
-            tid2cert, cid2tag, rid2rels = {}, {}, defaultdict(list)
-            ann_filename = '%s.ann' % file_name
-            if os.path.isfile(ann_filename):
-                with open(ann_filename, 'r') as ann_fi:
-
-                    for entity_line in ann_fi:
-                        try:
-                            entity_line = entity_line.strip()
-                            if entity_line.startswith('T'):
-                                tid, tag_type, b_cid, e_cid, surf = entity_line.split(None, 4)
-                                cid2tag['s' + b_cid] = (tid, tag_type)
-                                cid2tag['e' + e_cid] = (tid, tag_type)
-                            elif entity_line.startswith('A'):
-                                mod_id, mod_type, entity_id, mod_label = entity_line.split()
-                                if mod_type in ['certainty', 'state', 'type']:
-                                    tid2cert[entity_id] = (mod_type, mod_label)
-                                elif mod_type in ['DCT-Rel']:
-                                    rid2rels[entity_id].append((entity_id, entity_id, mod_label))
-                                else:
-                                    print("[error]", mod_type)
-                            elif entity_line.startswith('R'):
-                                rel_id, rel, tail_id, head_id = entity_line.split()
-                                rid2rels[rel_id].append((tail_id.split(':')[-1], head_id.split(':')[-1], rel))
-                        except Exception as ex:
-                            print(ex)
-                            print(entity_line)
+    tid2cert, entities, rid2rels = {}, [], defaultdict(list)
+    for entity_line in ann_lines:
+        try:
+            entity_line = entity_line.strip()
+            if entity_line.startswith('T'):
+                # zero-length spans have no surface field
+                tid, tag_type, b_cid, e_cid = entity_line.split(None, 4)[:4]
+                entities.append((tid, tag_type, int(b_cid), int(e_cid)))
+            elif entity_line.startswith('A'):
+                mod_id, mod_type, entity_id, mod_label = entity_line.split()
+                if mod_type in ['certainty', 'state', 'type']:
+                    tid2cert[entity_id] = (mod_type, mod_label)
+                elif mod_type in ['DCT-Rel']:
+                    rid2rels[entity_id].append((entity_id, entity_id, mod_label))
+                else:
+                    print("[error]", mod_type)
+            elif entity_line.startswith('R'):
+                rel_id, rel, tail_id, head_id = entity_line.split()
+                rid2rels[rel_id].append((tail_id.split(':')[-1], head_id.split(':')[-1], rel))
+        except Exception as ex:
+            print(ex)
+            print(entity_line)
+    return entities, tid2cert, rid2rels
+
+
+def index_brat_lines(raw_str, pair_ends=None):
+    """
+    offset index of the '## line id:' blocks of a brat text: sorted block start offsets, plus the
+    (line id, char_b, char_e) of each block, i.e. the text lines between its comment line and the next one.
+    The last block keeps the final newline of the text; for a shard, pair_ends are the line ids whose blocks end
+    a brat pair without shards, and only these keep their final newline, as they would there
+    """
+    starts, blocks = [], []
+    line_b = 0
+    for line in raw_str.split('\n'):
+        z = re.match(r"## line id: (\w+)", line)
+        if z:
+            if blocks:
+                blocks[-1][2] = line_b if pair_ends and blocks[-1][0] in pair_ends else max(blocks[-1][1], line_b - 1)
+            block_b = min(line_b + len(line) + 1, len(raw_str))
+            starts.append(block_b)
+            blocks.append([z.groups()[0], block_b, len(raw_str)])
+        line_b += len(line) + 1
+    if pair_ends is not None and blocks and blocks[-1][0] not in pair_ends and raw_str.endswith('\n'):
+        blocks[-1][2] = max(blocks[-1][1], len(raw_str) - 1)
+    return starts, [tuple(block) for block in blocks]
+
+
+def merge_brat_pair(raw_str, ann_lines, pair_ends=None):
+    """
+    {line id: {'raw_text', 'ann', 'rels'}} of one brat .txt/.ann pair, every entity, attribute and relation
+    is assigned to the line id block that contains it (by bisecting the block offsets) and merged relative to it;
+    pair_ends as for index_brat_lines
+    """
+    from bisect import bisect_right
+    entities, tid2cert, rid2rels = read_brat_ann(ann_lines)
+    starts, blocks = index_brat_lines(raw_str, pair_ends)
+
+    block_entities = [[] for _ in blocks]
+    tid2block = {}
+    for tid, tag_type, char_b, char_e in entities:
+        block_index = bisect_right(starts, char_b) - 1
+        if block_index < 0:
+            continue
+        line_id, block_b, block_e = blocks[block_index]
+        if char_b > block_e:
+            # inside the next comment line
+            continue
+        block_entities[block_index].append((tid, tag_type, char_b - block_b, min(char_e, block_e) - block_b))
+        tid2block[tid] = block_index
+
+    # relations and DCT-Rel attributes go to the block of their first argument
+    block_rels = [[] for _ in blocks]
+    for rels in rid2rels.values():
+        for r in rels:
+            if r[0] in tid2block:
+                block_rels[tid2block[r[0]]].append(r)
+
+    merged = {}
+    for (line_id, block_b, block_e), b_entities, b_rels in zip(blocks, block_entities, block_rels):
+        block_str = raw_str[block_b:block_e]
+        merged[line_id] = {
+            'raw_text': block_str,
+            'ann': merge_brat_annotation(block_str, b_entities, tid2cert),
+            'rels': '\n'.join([str(r) for r in b_rels]),
+        }
+    return merged
+
+
+def file_fingerprint(file_name, prev=None):
+    """ {'mtime', 'size', 'sha1'} of a file, the hash is reused from prev when mtime and size did not change """
+    import hashlib
+    stat = os.stat(file_name)
+    if prev and prev.get('mtime') == stat.st_mtime_ns and prev.get('size') == stat.st_size:
+        return dict(prev)
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as fi:
+        for block in iter(lambda: fi.read(1 << 20), b''):
+            sha1.update(block)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': sha1.hexdigest()}
+
+
+def list_brat_files(brat_file):
+    """ sorted '{brat_dir}/{name}' prefixes of the .txt files whose name starts with the brat file name """
+    brat_dir, brat_name = os.path.split(brat_file)
+    return [os.path.join(brat_dir, filename[:-len('.txt')]) for filename in sorted(os.listdir(brat_dir))
+            if filename.startswith(brat_name) and filename.endswith('.txt')]
+
+
+def scan_brat_line_ids(txt_file):
+    """ the line ids of the '## line id:' blocks of a brat text, in the order merge_brat_pair gives them """
+    with open(txt_file, 'r') as txt_fi:
+        return re.findall(r"^## line id: (\w+)", txt_fi.read(), re.M)
+
+
+def combine_brat_to_json(json_file, brat_file, new_json, incremental=False):
+    """
+    merge the brat annotation back into the json; with incremental=True, only the brat pairs whose content
+    changed since the last run (per the '{new_json}.manifest.json' file hashes) are merged into the previous new_json.
+    The pairs of a sharded json2brat output are the shards listed in '{brat_file}.manifest.json'.
+    The records are streamed from the json to new_json: the line ids of every pair are taken from the json2brat
+    manifest (or scanned from the brat text if it does not list them), and a pair is read and merged when the first
+    of its records comes, then dropped after its last one, so only the pairs in use are held in memory
+    """
+    manifest_file = '%s.manifest.json' % new_json
+    manifest = {}
+    if incremental and os.path.isfile(manifest_file) and os.path.isfile(new_json):
+        with open(manifest_file, 'r', encoding='utf-8') as manifest_fi:
+            manifest = json.load(manifest_fi)
+
+    source = file_fingerprint(json_file, manifest.get('source'))
+    if manifest.get('source', {}).get('sha1') == source['sha1']:
+        base_json = new_json
+    else:
+        if incremental:
+            print('[incremental] no manifest for %s, or its source json changed, merging every brat file' % new_json)
+        base_json, manifest = json_file, {}
+
+    prev_brat = manifest.get('brat', {})
+    new_manifest = {'source': source, 'brat': {}}
+    skipped = []
+    brat_files, listed, pair_ends = None, {}, {}
+    if os.path.isfile('%s.manifest.json' % brat_file):
+        from brat_shards import listed_line_ids, listed_pair_ends, shard_files
+        with open('%s.manifest.json' % brat_file, 'r', encoding='utf-8') as brat_manifest_fi:
+            brat_manifest = json.load(brat_manifest_fi)
+        brat_files = shard_files(brat_manifest, brat_file)
+        listed = listed_line_ids(brat_manifest, brat_file)
+        pair_ends = listed_pair_ends(brat_manifest, brat_file)
+    # the pair each line id is merged from, the last listed one if several hold it
+    line_pairs = {}
+    for file_name in list_brat_files(brat_file) if brat_files is None else brat_files:
+        ann_filename = '%s.ann' % file_name
+        prev = prev_brat.get(file_name, {})
+        entry = {'txt': file_fingerprint('%s.txt' % file_name, prev.get('txt'))}
+        if os.path.isfile(ann_filename):
+            entry['ann'] = file_fingerprint(ann_filename, prev.get('ann'))
+        if prev and prev.get('txt', {}).get('sha1') == entry['txt']['sha1'] \
+                and prev.get('ann', {}).get('sha1') == entry.get('ann', {}).get('sha1'):
+            entry['line_ids'] = prev.get('line_ids', [])
+            new_manifest['brat'][file_name] = entry
+            skipped.append(file_name)
+            continue
+        if file_name in listed:
+            entry['line_ids'] = listed[file_name]
+        else:
+            with metrics.stage('read_brat'):
+                entry['line_ids'] = scan_brat_line_ids('%s.txt' % file_name)
+        for line_id in entry['line_ids']:
+            line_pairs[line_id] = file_name
+        new_manifest['brat'][file_name] = entry
+
+    # the records each pair still has to patch, and the merged fields of the pairs read
+    from collections import Counter
+    pending = Counter(line_pairs.values())
+    merged_pairs = {}
+
+    def read_pair(file_name):
+        print(file_name)
+        with metrics.stage('read_brat'):
+            ann_lines = []
+            if os.path.isfile('%s.ann' % file_name):
+                with open('%s.ann' % file_name, 'r') as ann_fi:
+                    ann_lines = ann_fi.readlines()
 
             with open('%s.txt' % file_name, 'r') as txt_fi:
-                char_list = list(txt_fi.read())
-                ''' writing raw_text to json'''
-                raw_str = ''.join(char_list)
-                line_id, patient_id = None, None
-                line_cache = []
-                for line in raw_str.split('\n'):
-                    z = re.match(r"## line id: (\w+)", line)
-                    if z:
-                        if line_id in json_dict['読影所見']:
-                            json_dict['読影所見'][line_id]["raw_text"] = '\n'.join(line_cache)
-                        line_id = z.groups()[0]
-                        line_cache = []
-                    else:
-                        line_cache.append(line)
-                if line_id in json_dict['読影所見']:
-                    json_dict['読影所見'][line_id]["raw_text"] = '\n'.join(line_cache)
-
-                ''' writing new_ann to json'''
-                for key in sorted(cid2tag.keys(), key=lambda x: (int(x[1:]), x[0]), reverse=True):
-                    cid = int(key[1:])
-                    tid, tag_type = cid2tag[key]
-                    # print(key, tag_type)
-                    if key.startswith('e'):
-                        char_list.insert(cid, '</%s>' % (name2tag[tag_type]))
-                    elif key.startswith('s'):
-                        elems = [name2tag[tag_type]]
-                        elems.append('tid="%s"' % tid)
-                        if tid in tid2cert:
-                            elems.append('%s="%s"' % tid2cert[tid])
-                        char_list.insert(cid, '<%s>' % (' '.join(elems)))
-
-                txt_line = ''.join(char_list)
-                line_id, patient_id = None, None
-                line_cache = []
-                for line in txt_line.split('\n'):
-                    z = re.match(r"## line id: (\w+)", line)
-                    if z:
-                        if line_id in json_dict['読影所見']:
-                            json_dict['読影所見'][line_id]["ann"] = '\n'.join(line_cache)
-                            json_dict['読影所見'][line_id]["rels"] = '\n'.join([str(r) for rels in rid2rels.values() for r in rels])
-                        line_id = z.groups()[0]
-                        line_cache = []
-                    else:
-                        line_cache.append(line)
-
-                if line_id in json_dict['読影所見']:
-                    json_dict['読影所見'][line_id]["ann"] = '\n'.join(line_cache)
-                    json_dict['読影所見'][line_id]["rels"] = '\n'.join([str(r) for rels in rid2rels.values() for r in rels])
-        dump_json(json_dict, new_json)
+                raw_str = txt_fi.read()
+
+        with metrics.stage('merge_brat'):
+            merged = merge_brat_pair(raw_str, ann_lines, pair_ends.get(file_name))
+        metrics.count('reports', len(merged))
+        unlisted = set(merged) - set(new_manifest['brat'][file_name]['line_ids'])
+        if unlisted:
+            raise Exception('[ERROR] %s.txt holds line ids %s that %s.manifest.json does not list for it, '
+                            'rerun json2brat or remove the manifest' % (file_name, ', '.join(sorted(unlisted)), brat_file))
+        return merged
+
+    def patch_records(records):
+        for line_id, record in records:
+            file_name = line_pairs.get(line_id)
+            if file_name is not None:
+                if file_name not in merged_pairs:
+                    merged_pairs[file_name] = read_pair(file_name)
+                if line_id in merged_pairs[file_name]:
+                    record.update(merged_pairs[file_name][line_id])
+                pending[file_name] -= 1
+                if not pending[file_name]:
+                    del merged_pairs[file_name]
+            yield line_id, record
+
+    doc_info = {}
+    records = metrics.timed_iter('read_json', iter_json_records(base_json, others=doc_info))
+    if is_ndjson(new_json):
+        # the ndjson header needs the 文章名 before the records, the json layout only has it after them
+        doc_name = read_doc_name(base_json)
+    else:
+        doc_name = lambda: doc_info.get('文章名')
+    dump_json_records(patch_records(records), new_json, doc_name, normalized=read_normalized(base_json))
+
+    if incremental:
+        removed = [file_name for file_name in prev_brat if file_name not in new_manifest['brat']]
+        print('[incremental] %i brat files merged, %i unchanged skipped, %i removed (their lines keep the last merge)' % (
+            len(new_manifest['brat']) - len(skipped), len(skipped), len(removed)))
+        for file_name in removed:
+            print('[incremental] removed: %s' % file_name)
+    with open(manifest_file, 'w', encoding='utf-8') as manifest_fo:
+        json.dump(new_manifest, manifest_fo, ensure_ascii=False, indent=2)
+
+
+def as_json_record(record):
+    """ a record as it reads back from the central json, i.e. with its dates as iso strings """
+    return {key: json_serial(value) if isinstance(value, (datetime, date)) else value
+            for key, value in record.items()}
+
+
+def tee_json_records(records, json_file, doc_name, queue_size=1000, normalized=None):
+    """ pass (line id, record) pairs through while a thread writes them to json_file with dump_json_records """
+    import queue
+    import threading
+    done = object()
+    pending = queue.Queue(queue_size)
+    errors = []
+
+    def write():
+        try:
+            dump_json_records(iter(pending.get, done), json_file, doc_name, normalized=normalized)
+        except Exception as ex:
+            errors.append(ex)
+            # keep taking records, so the reading side does not block on a full queue
+            for _ in iter(pending.get, done):
+                pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    try:
+        for item in records:
+            pending.put(item)
+            yield item
+    finally:
+        pending.put(done)
+        writer.join()
+    if errors:
+        raise errors[0]
+
+
+def merge_brat_unit(unit_records, unit):
+    """
+    the (line id, record) pairs of one iter_brat_units unit with its brat pair (or list of shards) merged in, giving
+    the same records as brat2json reading the pairs back from their .txt/.ann files; a shard comes with the line ids
+    ending the pairs in it
+    """
+    if unit is None:
+        return unit_records
+    import io
+    merged = {}
+    for char_toks, tags, attrs, pair_ends in unit if isinstance(unit, list) else [unit + (None,)]:
+        # the universal newline translation of reading the files back
+        raw_str = io.StringIO(''.join(char_toks), newline=None).read()
+        ann_lines = io.StringIO(''.join(format_brat_ann(tags, attrs)), newline=None).readlines()
+        with metrics.stage('merge_brat'):
+            merged.update(merge_brat_pair(raw_str, ann_lines, pair_ends))
+    return [(line_id, {**record, **merged[line_id]} if line_id in merged else record)
+            for line_id, record in unit_records]
+
+
+def run_pipeline(xls_file, brat_file, corpus, json_file=None, new_json=None,
+                 normalize=None, stream=False, chunksize=10000, workers=1, validate=False, parser='etree',
+                 cache_size=0, cache_file=None, shard_reports=None, shard_chars=None, sink=None):
+    """
+    xls2json, json2brat and brat2json in one process: the xls is loaded once and its records are streamed to the
+    brat writer, json_file optionally keeps the intermediate json, and with new_json every brat pair is merged back
+    into its records in memory as soon as it is written, so no json or brat file is parsed back
+    """
+    doc_name = xls_file.split('/')[-1]
+    if stream:
+        records = iter_xls_records(xls_file, chunksize=chunksize, normalize=normalize)
+    else:
+        records = read_xls(xls_file, normalize=normalize)['読影所見'].items()
+    records = ((line_id, as_json_record(record)) for line_id, record in records)
+    if json_file:
+        records = tee_json_records(records, json_file, doc_name, normalized=normalize)
+    units = iter_brat_units(records, brat_file, corpus, sent_split=False, validate=validate, workers=workers,
+                            parser=parser, cache_size=cache_size, cache_file=cache_file,
+                            shard_reports=shard_reports, shard_chars=shard_chars, sink=sink, normalized=normalize,
+                            **BRAT_COLUMNS[corpus])
+    if new_json:
+        dump_json_records((item for unit_records, unit in units for item in merge_brat_unit(unit_records, unit)),
+                          new_json, doc_name, normalized=normalize)
+    else:
+        for _ in units:
+            pass
 
 
-def convert_bio_to_xml(bio_file, xml_file):
-    with open(bio_file, 'r') as fi, open(xml_file, 'w') as fo:
-        tmp_report_xml = ""
+def iter_bio_events(bio_file):
+    """
+    read 'token bio_tag certainty' lines as a stream of ('open', tag, certainty or None), ('close', tag),
+    ('text', token) and ('eor',) events; a report still open at its EOR is not closed
+    """
+    with open(bio_file, 'r') as fi:
         prev_bio_tag = "O"
         for line in fi:
             token, bio_tag, cert_tag = line.split()
-            if token != "EOR":
-                if bio_tag.startswith('B'):
-                    if prev_bio_tag != "O":
-                        tmp_report_xml += "</%s>" % prev_bio_tag.split('-')[-1].lower()
-                    tmp_report_xml += "<%s%s>%s" % (
-                        bio_tag.split('-')[-1].lower(),
-                        " certainty=\"%s\"" % cert_tag if cert_tag != '_' else "",
-                        token
-                    )
-                elif bio_tag.startswith('I'):
-                    if prev_bio_tag != "O":
-                        if prev_bio_tag.split('-')[-1] != bio_tag.split('-')[-1]:
-                            tmp_report_xml += "</%s>" % prev_bio_tag.split('-')[-1].lower()
-                            tmp_report_xml += "<%s>%s" % (
-                                bio_tag.split('-')[-1].lower(),
-                                token
-                            )
-                        else:
-                            tmp_report_xml += token
-                    else:
-                        tmp_report_xml += "<%s>%s" % (
-                            bio_tag.split('-')[-1].lower(),
-                            token
-                        )
-                else:
-                    if prev_bio_tag != "O":
-                        tmp_report_xml += "</%s>" % prev_bio_tag.split('-')[-1].lower()
-                    tmp_report_xml += token
-                prev_bio_tag = bio_tag
-            else:
-                fo.write(tmp_report_xml.replace('#', '') + '\n')
-                fo.write('\n')
-                tmp_report_xml = ""
+            if token == "EOR":
+                yield ('eor',)
                 prev_bio_tag = "O"
+                continue
+            prev_tag, tag = prev_bio_tag.split('-')[-1].lower(), bio_tag.split('-')[-1].lower()
+            if bio_tag.startswith('B'):
+                if prev_bio_tag != "O":
+                    yield ('close', prev_tag)
+                yield ('open', tag, cert_tag if cert_tag != '_' else None)
+            elif bio_tag.startswith('I'):
+                if prev_bio_tag == "O":
+                    yield ('open', tag, None)
+                elif prev_bio_tag.split('-')[-1] != bio_tag.split('-')[-1]:
+                    yield ('close', prev_tag)
+                    yield ('open', tag, None)
+            elif prev_bio_tag != "O":
+                yield ('close', prev_tag)
+            yield ('text', token)
+            prev_bio_tag = bio_tag
 
 
-parser = ArgumentParser(description='Convert xls 読影所見 to the json format')
-parser.add_argument("--mode", dest="mode",
-                    help="convert_mode, i.e. xls2txt, xls2json, json2brat and brat2json", metavar="CONVERT_MODE")
-parser.add_argument("--corpus",
-                    help="corpus: ncc, ou, mr", metavar="CORPUS")
-parser.add_argument("--xls", dest="xls_file",
-                    help="input excel file", metavar="INPUT_FILE")
-parser.add_argument("--json", dest="json_file",
-                    help="output excel file", metavar="OUTPUT_FILE")
-parser.add_argument("--brat", dest="brat_file",
-                    help="output brat txt and ann files", metavar="ANNOTATION_FILE")
-parser.add_argument("--bio", dest="bio_file",
-                    help="input bio file", metavar="BIO_FILE")
-parser.add_argument("--txt", dest="txt_file",
-                    help="output raw file", metavar="TXT_FILE")
-parser.add_argument("--xml", dest="xml_file",
-                    help="output xml file", metavar="XML_FILE")
-parser.add_argument("--njson", dest="new_json",
-                    help="output new json", metavar="OUTPUT_FILE")
-parser.add_argument("--conll", dest="conll_file",
-                    help="conll file", metavar="CONLL_FILE")
-parser.add_argument("--norm", dest="normtime_file",)
-args = parser.parse_args()
-
-if args.mode in 'xls2json':
-    finding_json = read_xls(args.xls_file)
-    dump_json(finding_json, args.json_file)
-elif args.mode in 'xls2txt':
-    extract_txt_from_xls(args.xls_file, args.txt_file)
-elif args.mode == 'json2brat':
-    if args.corpus in ['mr']:
-        extract_brat_from_json(args.json_file, args.brat_file, args.corpus,
-                               rid_col='表示順', pid_col='匿名ID',
-                               date_col='記載日', type_col='タイトル', ann_col='ann',
-                               sent_split=False)
-    elif args.corpus in ['ou']:
-        extract_brat_from_json(args.json_file, args.brat_file, args.corpus,
-                               rid_col='表示順', pid_col='匿名ID',
-                               date_col='検査実施日', type_col='タイトル', ann_col='所見',
-                               sent_split=False)
-    elif args.corpus in ['ncc']:
-        extract_brat_from_json(args.json_file, args.brat_file, args.corpus,
-                               rid_col='ID', pid_col='_id',
-                               date_col='exam_date', type_col='タイトル', ann_col='findings_demasked',
-                               sent_split=False)
+def convert_bio_to_xml(bio_file, xml_file):
+    with open(xml_file, 'w') as fo:
+        report_segs = []
+        for event in iter_bio_events(bio_file):
+            if event[0] == 'text':
+                report_segs.append(event[1])
+            elif event[0] == 'open':
+                report_segs.append("<%s%s>" % (event[1], " certainty=\"%s\"" % event[2] if event[2] else ""))
+            elif event[0] == 'close':
+                report_segs.append("</%s>" % event[1])
+            else:
+                metrics.count('reports')
+                fo.write(''.join(report_segs).replace('#', '') + '\n')
+                fo.write('\n')
+                report_segs = []
+    metrics.count_file(xml_file)
+
+
+def convert_bio_to_brat(bio_file, brat_file, sink=None):
+    """
+    write {brat_file}.txt/.ann straight from the BIO events, one report per line: T lines as the tags close,
+    then the certainty A lines, kept in a temp file meanwhile; a tag open at EOR ends with its report
+    """
+    import shutil
+    import tempfile
+    from output_sink import FileSink
+
+    sink = sink or FileSink()
+    # iter_bio_events lowercases the tags, 'TIMEX3' among them
+    bio_tag2name = {tag.lower(): name for tag, name in tag2name.items()}
+    tag_num, attr_num, char_offset = 0, 0, 0
+    # [tag, char_b, certainty, surface segs] of the open tag
+    entity = None
+    with sink.open(f'{brat_file}.txt') as fot, sink.open(f'{brat_file}.ann') as foa, \
+            tempfile.TemporaryFile('w+') as attr_fo:
+
+        def close_entity():
+            nonlocal tag_num, attr_num
+            tag, char_b, cert, segs = entity
+            tag_num += 1
+            foa.write('T%i\t%s %i %i\t%s\n' % (tag_num, bio_tag2name.get(tag, tag), char_b, char_offset, ''.join(segs)))
+            if cert:
+                attr_num += 1
+                attr_fo.write('A%i\tcertainty T%i %s\n' % (attr_num, tag_num, cert))
+
+        for event in iter_bio_events(bio_file):
+            if event[0] == 'text':
+                token = event[1].replace('#', '')
+                fot.write(token)
+                char_offset += len(token)
+                if entity:
+                    entity[3].append(token)
+            elif event[0] == 'open':
+                entity = [event[1], char_offset, event[2], []]
+            elif entity:
+                close_entity()
+                entity = None
+            if event[0] == 'eor':
+                metrics.count('reports')
+                fot.write('\n')
+                char_offset += 1
+        if entity:
+            close_entity()
+        attr_fo.seek(0)
+        shutil.copyfileobj(attr_fo, foa)
+
+
+def mode_xls2json(args):
+    normalize = parse_col_forms(args.normalize)
+    if args.stream:
+        dump_json_records(iter_xls_records(args.xls_file, chunksize=args.chunksize, normalize=normalize),
+                          args.json_file, args.xls_file.split('/')[-1], normalized=normalize)
     else:
+        finding_json = read_xls(args.xls_file, normalize=normalize)
+        dump_json_records(finding_json['読影所見'].items(), args.json_file, finding_json['文章名'],
+                          normalized=normalize)
+
+
+def mode_json2json(args):
+    dump_json_records(iter_json_records(args.json_file), args.new_json, read_doc_name(args.json_file),
+                      normalized=read_normalized(args.json_file))
+
+
+def mode_xls2txt(args):
+    extract_txt_from_xls(args.xls_file, args.txt_file, workers=args.workers, juman_cache=args.juman_cache)
+
+
+def open_output_sink(args, root):
+    """ the sink of a mode's output files: the --archive file, members named relative to root, or files in place """
+    from output_sink import open_sink
+    return open_sink(args.archive, root or '.', args.io_queue)
+
+
+def mode_json2brat(args):
+    if args.corpus not in BRAT_COLUMNS:
         raise Exception(f"Uknown corpus {args.corpus}")
-elif args.mode == 'brat2json':
-    combine_brat_to_json(args.json_file, args.brat_file, args.new_json)
-elif args.mode == 'bio2xml':
+    if args.incremental and args.archive:
+        raise Exception('[ERROR] incremental json2brat does not support archive output')
+    with open_output_sink(args, os.path.dirname(args.brat_file)) as sink:
+        extract_brat_from_json(args.json_file, args.brat_file, args.corpus, sent_split=False,
+                               validate=args.validate, workers=args.workers, incremental=args.incremental,
+                               parser=args.parser, cache_size=args.parse_cache_size, cache_file=args.parse_cache,
+                               shard_reports=args.shard_reports, shard_chars=args.shard_chars, sink=sink,
+                               **BRAT_COLUMNS[args.corpus])
+
+
+def mode_pipeline(args):
+    if args.corpus not in BRAT_COLUMNS:
+        raise Exception(f"Uknown corpus {args.corpus}")
+    with open_output_sink(args, os.path.dirname(args.brat_file)) as sink:
+        run_pipeline(args.xls_file, args.brat_file, args.corpus, json_file=args.json_file, new_json=args.new_json,
+                     normalize=parse_col_forms(args.normalize), stream=args.stream, chunksize=args.chunksize,
+                     workers=args.workers, validate=args.validate, parser=args.parser,
+                     cache_size=args.parse_cache_size, cache_file=args.parse_cache,
+                     shard_reports=args.shard_reports, shard_chars=args.shard_chars, sink=sink)
+
+
+def mode_brat2json(args):
+    combine_brat_to_json(args.json_file, args.brat_file, args.new_json, incremental=args.incremental)
+
+
+def mode_bio2xml(args):
     convert_bio_to_xml(args.bio_file, args.xml_file)
-elif args.mode == 'conll2brat':
-    doc_conll = data_utils.MultiheadConll(args.conll_file)
+
+
+def mode_xml2brat(args):
+    with open_output_sink(args, args.brat_file) as sink:
+        if os.path.isdir(args.xml_file):
+            convert_xml_dir_to_brat(args.xml_file, args.brat_file, validate=args.validate, workers=args.workers,
+                                    sink=sink)
+        else:
+            convert_xml_to_brat(args.xml_file, args.brat_file, validate=args.validate, sink=sink)
+
+
+def mode_bio2brat(args):
+    with open_output_sink(args, os.path.dirname(args.brat_file)) as sink:
+        convert_bio_to_brat(args.bio_file, args.brat_file, sink=sink)
+
+
+def mode_conll2brat(args):
+    doc_conll = load_data_utils().MultiheadConll(args.conll_file)
     doc_conll.doc_to_brat(args.brat_file)
-elif args.mode == 'conll2xml':
-    doc_conll = data_utils.MultiheadConll(args.conll_file)
+
+
+def mode_conll2xml(args):
+    doc_conll = load_data_utils().MultiheadConll(args.conll_file)
     doc_conll.doc_to_xml(args.xml_file)
-elif args.mode == 'json2norm':
-    extract_normtime_from_json(args.json_file, args.normtime_file)
 
 
+def mode_json2norm(args):
+    with open_output_sink(args, os.path.dirname(args.normtime_file)) as sink:
+        extract_normtime_from_json(args.json_file, args.normtime_file, parser=args.parser, sink=sink)
+
+
+# --mode name: function running it with the parsed command line arguments
+MODES = {
+    'xls2json': mode_xls2json,
+    'json2json': mode_json2json,
+    'xls2txt': mode_xls2txt,
+    'json2brat': mode_json2brat,
+    'pipeline': mode_pipeline,
+    'brat2json': mode_brat2json,
+    'bio2xml': mode_bio2xml,
+    'xml2brat': mode_xml2brat,
+    'bio2brat': mode_bio2brat,
+    'conll2brat': mode_conll2brat,
+    'conll2xml': mode_conll2xml,
+    'json2norm': mode_json2norm,
+}
+
+
+def run_mode(args):
+    """ run one conversion mode with the parsed command line arguments """
+    MODES[args.mode](args)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Convert xls 読影所見 to the json format')
+    parser.add_argument("--mode", dest="mode", choices=sorted(MODES),
+                        help="convert_mode, i.e. xls2txt, xls2json, json2json, json2brat, brat2json and pipeline "
+                             "(xls2json, json2brat and brat2json in one process)", metavar="CONVERT_MODE")
+    parser.add_argument("--corpus",
+                        help="corpus: ncc, ou, mr", metavar="CORPUS")
+    parser.add_argument("--xls", dest="xls_file",
+                        help="input excel file", metavar="INPUT_FILE")
+    parser.add_argument("--json", dest="json_file",
+                        help="output excel file", metavar="OUTPUT_FILE")
+    parser.add_argument("--brat", dest="brat_file",
+                        help="output brat txt and ann files", metavar="ANNOTATION_FILE")
+    parser.add_argument("--bio", dest="bio_file",
+                        help="input bio file", metavar="BIO_FILE")
+    parser.add_argument("--txt", dest="txt_file",
+                        help="output raw file", metavar="TXT_FILE")
+    parser.add_argument("--xml", dest="xml_file",
+                        help="output xml file", metavar="XML_FILE")
+    parser.add_argument("--njson", dest="new_json",
+                        help="output new json", metavar="OUTPUT_FILE")
+    parser.add_argument("--conll", dest="conll_file",
+                        help="conll file", metavar="CONLL_FILE")
+    parser.add_argument("--norm", dest="normtime_file",)
+    parser.add_argument("--stream", action="store_true",
+                        help="xls2json, pipeline: read csv in chunks / xlsx row by row and write records one at a time")
+    parser.add_argument("--normalize", nargs='+', metavar="COLUMN=FORM",
+                        help="xls2json, pipeline: normalize columns in the json, FORM is zen2han, han2zen or h2z")
+    parser.add_argument("--chunksize", type=int, default=10000,
+                        help="rows per csv chunk in --stream mode", metavar="N")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="json2brat, pipeline: number of worker processes converting 表示順 groups, "
+                             "xls2txt: number of juman processes", metavar="N")
+    parser.add_argument("--juman-cache", dest="juman_cache",
+                        help="xls2txt: sqlite file caching juman segmentations across runs", metavar="CACHE_FILE")
+    parser.add_argument("--incremental", action="store_true",
+                        help="json2brat: only rewrite changed 表示順 groups, brat2json: only re-merge changed brat files")
+    parser.add_argument("--parser", default='etree', choices=['etree', 'lexer'],
+                        help="json2brat, json2norm, pipeline: read the inline markup with ElementTree, or with "
+                             "markup_lexer, which recovers broken tags one by one instead of dropping the report")
+    parser.add_argument("--shard-reports", dest="shard_reports", type=int,
+                        help="json2brat, pipeline: pack the 表示順 groups into brat shards of at most this many reports "
+                             "(T/A ids are numbered per shard, brat2json otherwise gives the unsharded json)")
+    parser.add_argument("--shard-chars", dest="shard_chars", type=int,
+                        help="json2brat, pipeline: pack the 表示順 groups into brat shards of at most this many chars")
+    parser.add_argument("--parse-cache-size", dest="parse_cache_size", type=int, default=10000,
+                        help="json2brat, pipeline: parsed findings kept in memory for repeated texts, 0 to disable")
+    parser.add_argument("--parse-cache", dest="parse_cache",
+                        help="json2brat, pipeline: sqlite file caching parsed findings across runs", metavar="CACHE_FILE")
+    parser.add_argument("--archive",
+                        help="json2brat, pipeline, json2norm, xml2brat, bio2brat: write the output files into one "
+                             ".tar, .tar.gz/.tgz, .tar.bz2, .tar.xz or .zip archive instead, named relative to the "
+                             "output directory", metavar="ARCHIVE_FILE")
+    parser.add_argument("--io-queue", dest="io_queue", type=int, default=0,
+                        help="json2brat, pipeline, json2norm, xml2brat, bio2brat: write the output files in a "
+                             "background thread, with at most N files waiting (0 writes them in place)", metavar="N")
+    parser.add_argument("--validate", action="store_true",
+                        help="json2brat, pipeline: check every tag offset against the extracted text")
+    parser.add_argument("--metrics", dest="metrics_file",
+                        help="write a json summary of stage times, report and byte counts and parse failures "
+                             "('-' for stdout)", metavar="METRICS_FILE")
+    parser.add_argument("--profile", action="store_true",
+                        help="also run the mode under cProfile, dumped to METRICS_FILE.prof "
+                             "(format_converter.MODE.prof without --metrics)")
+    args = parser.parse_args()
+
+    if args.metrics_file or args.profile:
+        metrics.enable()
+    start = time.perf_counter()
+    profile_file = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(run_mode, args)
+        profile_file = '%s.prof' % (args.metrics_file if args.metrics_file not in [None, '-']
+                                    else f'format_converter.{args.mode}')
+        profiler.dump_stats(profile_file)
+    else:
+        run_mode(args)
+    if metrics.enabled:
+        metrics.write_summary(args.metrics_file or '-', time.perf_counter() - start,
+                              mode=args.mode, corpus=args.corpus, argv=sys.argv[1:], profile=profile_file)
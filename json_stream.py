@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# incremental reading and writing of large json objects, one member at a time
+#
+import json
+import re
+from datetime import date, datetime
+from json.encoder import encode_basestring
+
+ws_re = re.compile(r'[ \t\n\r]*')
+# record values written on one line by json.dumps(indent=2), dates through the default
+FLAT_TYPES = (str, int, float, type(None), datetime, date)
+# the ones orjson writes exactly as json.dumps(indent=2, ensure_ascii=False) does
+ORJSON_TYPES = (str, int, type(None), datetime, date)
+
+
+class JsonStreamReader(object):
+    """ tokenize a json text from a file object, decoding one value at a time from a sliding buffer """
+
+    def __init__(self, fi, chunk_size=1 << 20):
+        self.fi = fi
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf, self.pos, self.eof = '', 0, False
+
+    def _fill(self):
+        # read at least as much as is already buffered, so a value larger than a chunk is not re-decoded once per chunk
+        chunk = self.fi.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ the next non-whitespace character, '' at the end of the file """
+        while True:
+            self.pos = ws_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def take(self, chars):
+        """ consume the next non-whitespace character, which must be one of chars """
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise json.JSONDecodeError('Expecting %s' % ' or '.join(repr(c) for c in chars), self.buf, self.pos)
+        self.pos += 1
+        return ch
+
+    def decode(self):
+        """ decode the next complete value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number ending at the buffer end may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_object(self):
+        """ generate the member keys of the next object, the caller consumes each member value before the next key """
+        self.take('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.take(':')
+            yield key
+            if self.take(',}') == '}':
+                return
+
+
+def iter_object_items(fi, key, chunk_size=1 << 20, others=None):
+    """
+    generate the (key, value) items of the top-level member 'key' of a json object; the other members are
+    skipped, or collected into the 'others' dict when one is given
+    """
+    reader = JsonStreamReader(fi, chunk_size)
+    for name in reader.iter_object():
+        if name != key:
+            value = reader.decode()
+            if others is not None:
+                others[name] = value
+            continue
+        for item_key in reader.iter_object():
+            yield item_key, reader.decode()
+
+
+def load_orjson():
+    """ the orjson module, None if it is not installed """
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def indent_dumper(default=None, backend='auto'):
+    """
+    a function giving the utf-8 bytes of json.dumps(record, indent=2, ensure_ascii=False, default=default), for a
+    default that gives strings. json only has a C encoder without indent, so a record of string keys and scalar
+    or date values is written here line by line from the C encoded keys and values; with backend='auto' and orjson
+    installed (or backend='orjson'), orjson writes the ones without floats, which it formats differently. Nested
+    values, non-string keys and ints beyond 64 bits for orjson go through json.dumps
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, default=default)
+
+    def dumps_json(record):
+        return json.dumps(record, indent=2, ensure_ascii=False, default=default).encode('utf-8')
+
+    def dumps_flat(record):
+        if not record:
+            return b'{}'
+        items = []
+        for key, value in record.items():
+            if not isinstance(key, str) or not isinstance(value, FLAT_TYPES):
+                return dumps_json(record)
+            if type(value) is str:
+                value_str = encode_basestring(value)
+            elif type(value) is int:
+                value_str = int.__repr__(value)
+            else:
+                value_str = encoder.encode(value)
+            items.append('%s: %s' % (encode_basestring(key), value_str))
+        return ('{\n  %s\n}' % ',\n  '.join(items)).encode('utf-8')
+
+    orjson = load_orjson() if backend != 'json' else None
+    if backend == 'orjson' and orjson is None:
+        raise Exception('[ERROR] the orjson json backend needs the orjson package')
+    if orjson is None:
+        return dumps_flat
+    option = orjson.OPT_INDENT_2 | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(record):
+        for value in record.values():
+            if not isinstance(value, ORJSON_TYPES):
+                return dumps_flat(record)
+        try:
+            return orjson.dumps(record, default=default, option=option)
+        except TypeError:
+            return dumps_flat(record)
+
+    return dumps
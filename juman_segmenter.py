@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# juman word segmentation with an in-memory LRU cache, an optional sqlite disk cache and a pool of juman workers
+#
+import sqlite3
+from collections import OrderedDict
+
+# one pyknp Juman per worker process
+_juman = None
+
+
+def _init_juman():
+    global _juman
+    from pyknp import Juman
+    _juman = Juman()
+
+
+def _segment_lines(lines):
+    """ the space-separated juman midasi of each line """
+    if _juman is None:
+        _init_juman()
+    return [' '.join([w.midasi for w in _juman.analysis(line).mrph_list()]) for line in lines]
+
+
+class JumanSegmenter(object):
+    """
+    segment normalized lines (the exact juman input) in batches: repeated lines are answered from a bounded LRU
+    cache, then from the disk cache, and only the remaining distinct lines go to juman
+    """
+
+    def __init__(self, workers=1, cache_size=100000, cache_file=None, chunk_size=64):
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.cache = OrderedDict()
+        self.hits, self.disk_hits, self.segmented = 0, 0, 0
+        self.db = None
+        if cache_file:
+            self.db = sqlite3.connect(cache_file)
+            self.db.execute('CREATE TABLE IF NOT EXISTS segments (line TEXT PRIMARY KEY, seg TEXT)')
+        self.pool = None
+        if workers > 1:
+            from multiprocessing import Pool
+            self.pool = Pool(workers, initializer=_init_juman)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    def _remember(self, line, seg):
+        self.cache[line] = seg
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _lookup_disk(self, lines):
+        found = {}
+        for i in range(0, len(lines), 500):
+            chunk = lines[i:i + 500]
+            found.update(self.db.execute('SELECT line, seg FROM segments WHERE line IN (%s)' % ','.join('?' * len(chunk)),
+                                         chunk))
+        return found
+
+    def segment(self, lines):
+        """ the segmented form of every line, in order """
+        segs = {}
+        missing = []
+        for line in lines:
+            if line in segs:
+                self.hits += 1
+            elif line in self.cache:
+                self.cache.move_to_end(line)
+                segs[line] = self.cache[line]
+                self.hits += 1
+            else:
+                # a placeholder, so a line repeated within the batch is segmented once
+                segs[line] = None
+                missing.append(line)
+
+        if missing and self.db:
+            found = self._lookup_disk(missing)
+            self.disk_hits += len(found)
+            segs.update(found)
+            missing = [line for line in missing if line not in found]
+
+        if missing:
+            chunks = [missing[i:i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+            results = self.pool.map(_segment_lines, chunks) if self.pool else map(_segment_lines, chunks)
+            new_segs = []
+            for chunk, chunk_segs in zip(chunks, results):
+                new_segs.extend(zip(chunk, chunk_segs))
+            self.segmented += len(new_segs)
+            segs.update(new_segs)
+            if self.db:
+                self.db.executemany('INSERT OR REPLACE INTO segments VALUES (?, ?)', new_segs)
+                self.db.commit()
+
+        for line in lines:
+            if line not in self.cache:
+                self._remember(line, segs[line])
+        return [segs[line] for line in lines]
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'segmented': self.segmented}
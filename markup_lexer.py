@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+#
+# streaming lexer for the inline annotation markup of the findings ('<doc><line>...<d certainty="positive">...'),
+# an ElementTree-free path for json2brat and json2norm that recovers locally from broken markup
+#
+import re
+from functools import lru_cache
+from argparse import ArgumentParser
+
+# XML names without namespace prefixes, XML whitespace (not \s, which also matches the ideographic space)
+NAME = r'[^\W\d][\w.\-]*'
+S = r'[ \t\r\n]'
+
+TOKEN_RE = re.compile(r'''
+    (?P<text>[^<&\r\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]+)
+  | </(?P<end>%(name)s)%(s)s*>
+  | <(?P<start>%(name)s)(?P<attrs>(?:%(s)s+%(name)s%(s)s*=%(s)s*(?:"[^"<]*"|'[^'<]*'))*)%(s)s*(?P<empty>/?)>
+  | (?P<comment><!--(?:(?!--).)*-->)
+  | <!\[CDATA\[(?P<cdata>.*?)\]\]>
+  | (?P<pi><\?%(name)s(?:%(s)s.*?)?\?>)
+  | <(?P<bad_slash>/?)(?P<bad_name>%(name)s)(?P<bad_attrs>[^<>]*)>
+  | &(?P<ref>\#[0-9]+|\#x[0-9a-fA-F]+|%(name)s);
+  | (?P<cr>\r\n?)
+  | (?P<other>.)
+''' % {'name': NAME, 's': S}, re.X | re.S)
+ATTR_RE = re.compile(r'(%s)%s*=%s*(?:"([^"]*)"|\'([^\']*)\')' % (NAME, S, S))
+LOOSE_ATTR_RE = re.compile(r'(%s)%s*=%s*(?:"([^"]*)"?|\'([^\']*)\'?|([^\s"\'=<>]+))' % (NAME, S, S))
+ATTR_SPACE_RE = re.compile(r'\r\n|[\t\n\r]')
+ATTR_REF_RE = re.compile(r'&(#[0-9]+|#x[0-9a-fA-F]+|%s);' % NAME)
+ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'"}
+# the tags and text of the usual well-formed report, read by _parse_plain without per-char lexing
+PLAIN_TAG_RE = re.compile(r'<(/?)([^\s<>/=\'"!?&]+)([^<>]*?)(/?)>')
+PLAIN_ATTRS_RE = re.compile(r'(?:%s+%s%s*=%s*(?:"[^"<&\t\n\r]*"|\'[^\'<&\t\n\r]*\'))*%s*' % (S, NAME, S, S, S))
+NAME_RE = re.compile(NAME)
+NOT_PLAIN_RE = re.compile(r'[<\r\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+# ElementTree qualifies the names in the scope of a namespace declaration, '{uri}name'
+XMLNS_RE = re.compile(r'<[^<>]*%sxmlns[:=%s]' % (S, S[1:-1]))
+PLAIN_REF_RE = re.compile(r'&((?:lt|gt|amp|quot|apos)|#[0-9]+|#x[0-9a-fA-F]+);')
+
+TEXT, START, END, EMPTY, PROBLEM = 'text', 'start', 'end', 'empty', 'problem'
+
+
+class UnsupportedMarkup(ValueError):
+    """ well-formed markup whose ElementTree walk the lexer does not reproduce, e.g. a line inside a line """
+
+
+def is_xml_char(code):
+    return code in (0x9, 0xA, 0xD) or 0x20 <= code <= 0xD7FF or 0xE000 <= code <= 0xFFFD or 0x10000 <= code <= 0x10FFFF
+
+
+def decode_ref(ref):
+    """ the text of a character or predefined entity reference (without '&' and ';'), None if it is not defined """
+    if ref[0] == '#':
+        code = int(ref[2:], 16) if ref[1] == 'x' else int(ref[1:])
+        return chr(code) if is_xml_char(code) else None
+    return ENTITIES.get(ref)
+
+
+def decode_attr(value, problems):
+    """ an attribute value as an XML parser reports it: line breaks and tabs become spaces, references are decoded """
+    def ref(m):
+        text = decode_ref(m.group(1))
+        if text is None:
+            problems.append('unknown reference %s in an attribute' % m.group(0))
+            return m.group(0)
+        return text
+    value = ATTR_SPACE_RE.sub(' ', value)
+    return ATTR_REF_RE.sub(ref, value) if '&' in value else value
+
+
+def parse_attrs(attrs_str, problems, loose=False):
+    attrs = {}
+    for m in (LOOSE_ATTR_RE if loose else ATTR_RE).finditer(attrs_str):
+        key = m.group(1)
+        value = next(v for v in m.groups()[1:] if v is not None)
+        if key in attrs:
+            problems.append('duplicate attribute %s' % key)
+            continue
+        attrs[key] = decode_attr(value, problems)
+    return attrs
+
+
+def iter_markup_events(markup):
+    """
+    generate the events of a markup string in document order: (TEXT, text), (START, name, attrs, raw),
+    (END, name, raw), (EMPTY, name, attrs, raw) and (PROBLEM, message). Text is reported as an XML parser reports
+    it (references decoded, '\\r\\n' and '\\r' read as '\\n', comments and processing instructions dropped, CDATA
+    kept); a stray '<' or '&', an undefined reference or an invalid char is kept as text and a malformed tag is read
+    leniently, each with a PROBLEM event
+    """
+    for m in TOKEN_RE.finditer(markup):
+        kind = m.lastgroup
+        if kind == 'text':
+            yield TEXT, m.group(kind)
+        elif kind == 'end':
+            yield END, m.group(kind), m.group(0)
+        elif kind in ('start', 'attrs', 'empty'):
+            problems = []
+            attrs = parse_attrs(m.group('attrs'), problems) if m.group('attrs') else {}
+            for problem in problems:
+                yield PROBLEM, problem
+            yield EMPTY if m.group('empty') else START, m.group('start'), attrs, m.group(0)
+        elif kind == 'cdata':
+            yield TEXT, m.group(kind).replace('\r\n', '\n').replace('\r', '\n')
+        elif kind in ('comment', 'pi'):
+            continue
+        elif kind in ('bad_slash', 'bad_name', 'bad_attrs'):
+            problems = ['malformed tag %s' % m.group(0)]
+            raw_attrs = m.group('bad_attrs')
+            if m.group('bad_slash'):
+                for problem in problems:
+                    yield PROBLEM, problem
+                yield END, m.group('bad_name'), m.group(0)
+                continue
+            empty = raw_attrs.endswith('/')
+            attrs = parse_attrs(raw_attrs[:-1] if empty else raw_attrs, problems, loose=True)
+            for problem in problems:
+                yield PROBLEM, problem
+            yield EMPTY if empty else START, m.group('bad_name'), attrs, m.group(0)
+        elif kind == 'ref':
+            text = decode_ref(m.group(kind))
+            if text is None:
+                yield PROBLEM, 'unknown reference %s' % m.group(0)
+                text = m.group(0)
+            yield TEXT, text
+        elif kind == 'cr':
+            yield TEXT, '\n'
+        else:
+            yield PROBLEM, 'stray %r' % m.group(0)
+            yield TEXT, m.group(0)
+
+
+class _Node(object):
+    __slots__ = ('name', 'attrs', 'raw', 'text', 'tail', 'children')
+
+    def __init__(self, name, attrs, raw):
+        self.name, self.attrs, self.raw = name, attrs, raw
+        self.text, self.tail, self.children = [], [], []
+
+
+def _add_text(node, text):
+    """ text after the last child goes to its tail, as in ElementTree """
+    (node.children[-1].tail if node.children else node.text).append(text)
+
+
+def _unwrap(parent, tags, problems):
+    """ replace the unclosed last child of parent by its content; a tag outside the tag set stays as literal text """
+    node = parent.children.pop()
+    problems.append('unclosed %s' % node.raw)
+    if node.name not in tags:
+        _add_text(parent, node.raw)
+    _add_text(parent, ''.join(node.text))
+    for child in node.children:
+        parent.children.append(child)
+    _add_text(parent, ''.join(node.tail))
+
+
+def _walk(node, line_tag, tags, line_tail, items, problems):
+    """ the (text, tag, attrs) items of node in the order of ElementTree's node.iter(): text, tail, then children """
+    text, tail = ''.join(node.text), ''.join(node.tail)
+    if text:
+        if node.name == line_tag:
+            items.append((text, None, {}))
+        elif node.name in tags:
+            items.append((text, node.name, node.attrs))
+        else:
+            problems.append('unknown tag %s' % node.raw)
+            items.append((text, None, {}))
+    if tail and (line_tail or node.name != line_tag):
+        items.append((tail, None, None))
+    for child in node.children:
+        _walk(child, line_tag, tags, line_tail, items, problems)
+
+
+def _decode_plain(text):
+    """ text with its references decoded, None if a '&' does not start a defined reference """
+    parts = PLAIN_REF_RE.split(text)
+    if '&' in ''.join(parts[0::2]):
+        return None
+    for i in range(1, len(parts), 2):
+        parts[i] = decode_ref(parts[i])
+        if parts[i] is None:
+            return None
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=4096)
+def _plain_attrs(attrs_str):
+    """ the attributes of a tag with plain values, None for anything else; the few distinct ones are cached """
+    if not PLAIN_ATTRS_RE.fullmatch(attrs_str):
+        return None
+    attrs = {}
+    for m in ATTR_RE.finditer(attrs_str):
+        if m.group(1) in attrs:
+            return None
+        attrs[m.group(1)] = m.group(2) if m.group(2) is not None else m.group(3)
+    return attrs
+
+
+def _parse_plain(markup, line_tag, tags, line_tail):
+    """
+    parse_markup_lines for markup made of text without CDATA, comments, '\\r' or undefined references, and of
+    tags with plain attribute values, nested well-formed inside the lines of one root; None for anything else.
+    The text after a tag (its tail, or the text of a start tag) comes with it from the split, so every element's
+    items are complete when it closes.
+    """
+    parts = PLAIN_TAG_RE.split(markup)
+    texts = ''.join(parts[0::5])
+    if NOT_PLAIN_RE.search(texts) or parts[0].strip(' \t\n'):
+        return None
+    if ']]>' in texts:
+        return None
+    if '&' in texts:
+        for i in range(0, len(parts), 5):
+            if '&' in parts[i]:
+                parts[i] = _decode_plain(parts[i])
+                if parts[i] is None:
+                    return None
+    lines, problems = [], []
+    # open elements of the current line, as [name, attrs, text, child items, raw attributes], the line first
+    stack = []
+    root, closed = None, False
+    for slash, name, attrs_str, empty, after in zip(parts[1::5], parts[2::5], parts[3::5], parts[4::5], parts[5::5]):
+        if closed or slash and empty:
+            return None
+        if name not in tags and name != line_tag and name != root and not NAME_RE.fullmatch(name):
+            return None
+        if attrs_str:
+            attrs = None if slash else _plain_attrs(attrs_str)
+            if attrs is None:
+                return None
+            attrs = dict(attrs)
+        else:
+            attrs = {}
+        if stack:
+            if slash:
+                elem = stack.pop()
+                if elem[0] != name:
+                    return None
+                if stack:
+                    items = stack[-1][3]
+                    if elem[2]:
+                        if name in tags:
+                            items.append((elem[2], name, elem[1]))
+                        else:
+                            problems.append('unknown tag <%s%s>' % (name, elem[4]))
+                            items.append((elem[2], None, {}))
+                    if after:
+                        items.append((after, None, None))
+                    items.extend(elem[3])
+                else:
+                    # the line, its tail runs to the next tag
+                    items = [(elem[2], None, {})] if elem[2] else []
+                    if after and line_tail:
+                        items.append((after, None, None))
+                    items.extend(elem[3])
+                    lines.append(items)
+            elif name == line_tag:
+                return None
+            elif empty:
+                if after:
+                    stack[-1][3].append((after, None, None))
+            else:
+                stack.append([name, attrs, after, [], attrs_str])
+        elif root is None:
+            if slash or empty or name == line_tag:
+                return None
+            root = name
+        elif slash:
+            if name != root or after.strip(' \t\n'):
+                return None
+            closed = True
+        elif name == line_tag and not empty:
+            stack.append([name, attrs, after, [], attrs_str])
+        else:
+            return None
+    return (lines, problems) if closed else None
+
+
+def parse_markup_lines(markup, line_tag, tags, line_tail=False):
+    """
+    (lines, problems) of a '<doc><{line_tag}>...</{line_tag}>...</doc>' markup string: every line is the list of
+    (text, tag, attrs) items the ElementTree walk `for tag in line.iter()` visits, in the same order, where tag is
+    None for the line's own text and for tails (the line's tail only with line_tail=True), and for elements outside
+    the tag set. On well-formed markup the items are those of ElementTree. Broken markup is recovered locally and
+    reported in problems: an unclosed or mismatched tag loses its span but keeps its text, a stray end tag is
+    dropped, and an unclosed or stray tag outside the tag set stays as literal text.
+    """
+    if 'xmlns' in markup and XMLNS_RE.search(markup):
+        raise UnsupportedMarkup('namespace declaration')
+    plain = _parse_plain(markup, line_tag, tags, line_tail)
+    if plain is not None:
+        return plain
+    lines, problems = [], []
+    root, outer, stack, tail_line = None, [], [], None
+    for event in iter_markup_events(markup):
+        kind = event[0]
+        if kind == PROBLEM:
+            problems.append(event[1])
+        elif stack:
+            # inside a line
+            if kind == TEXT:
+                _add_text(stack[-1], event[1])
+            elif kind in (START, EMPTY):
+                if event[1] == line_tag:
+                    raise UnsupportedMarkup('%s inside a %s' % (event[3], line_tag))
+                node = _Node(event[1], event[2], event[3])
+                stack[-1].children.append(node)
+                if kind == START:
+                    stack.append(node)
+            else:
+                names = [node.name for node in stack]
+                if event[1] in names:
+                    while stack[-1].name != event[1]:
+                        stack.pop()
+                        _unwrap(stack[-1], tags, problems)
+                    line = stack.pop()
+                    if not stack:
+                        tail_line = line
+                elif event[1] == root:
+                    while len(stack) > 1:
+                        stack.pop()
+                        _unwrap(stack[-1], tags, problems)
+                    problems.append('unclosed %s' % stack.pop().raw)
+                    root = False
+                else:
+                    problems.append('stray %s' % event[2])
+                    if event[1] not in tags:
+                        _add_text(stack[-1], event[2])
+        elif root:
+            # between the lines of the document
+            if kind == TEXT:
+                if tail_line:
+                    tail_line.tail.append(event[1])
+            elif kind in (START, EMPTY):
+                tail_line = None
+                if event[1] == line_tag:
+                    lines.append(_Node(event[1], event[2], event[3]))
+                    if kind == START:
+                        stack.append(lines[-1])
+                elif kind == START:
+                    outer.append(event[1])
+            elif outer and event[1] == outer[-1]:
+                outer.pop()
+                tail_line = None
+            elif event[1] == root:
+                problems.extend('unclosed <%s>' % name for name in outer)
+                root = False
+            else:
+                problems.append('stray %s' % event[2])
+        elif root is None and kind in (START, EMPTY):
+            if event[1] == line_tag:
+                raise UnsupportedMarkup('%s is the root' % event[3])
+            root = event[1] if kind == START else False
+        elif kind != TEXT or event[1].strip(' \t\n'):
+            problems.append('%s outside the document' % (event[-1] if kind != TEXT else repr(event[1])))
+    if stack:
+        while len(stack) > 1:
+            stack.pop()
+            _unwrap(stack[-1], tags, problems)
+        problems.append('unclosed %s' % stack[0].raw)
+    if root:
+        problems.append('unclosed document')
+
+    items_per_line = []
+    for line in lines:
+        items = []
+        _walk(line, line_tag, tags, line_tail, items, problems)
+        items_per_line.append(items)
+    return items_per_line, problems
+
+
+if __name__ == '__main__':
+    import sys
+    parser = ArgumentParser(description='Print the lexer events and line items of inline markup read from stdin')
+    parser.add_argument("--line", dest="line_tag", default='line', help="line element, 'line' or 's'")
+    parser.add_argument("--tags", nargs='+', default=['d', 'a', 'f', 'c', 'p', 'TIMEX3', 't-test', 't-key', 't-val',
+                                                      'cc', 'r', 'm-key', 'm-val'],
+                        help="the annotation tag set")
+    args = parser.parse_args()
+
+    markup = sys.stdin.read()
+    for event in iter_markup_events(markup):
+        print(event)
+    lines, problems = parse_markup_lines(markup, args.line_tag, set(args.tags))
+    for items in lines:
+        print(items)
+    for problem in problems:
+        print('[PROBLEM]', problem)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# output sinks of the converters: files written in place, or members of one tar/zip archive, optionally handed to a
+# background writer thread through a bounded queue
+#
+import io
+import os
+import time
+import queue
+import shutil
+import threading
+
+from run_metrics import metrics
+
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
+
+
+class SinkFile(io.TextIOWrapper):
+    """
+    a text file opened with Sink.open: it is handed to its sink when closed, or discarded when its with block
+    raises, so a half-written file never reaches the output
+    """
+
+    def __init__(self, sink, name, buffer, encoding=None):
+        super().__init__(buffer, encoding=encoding)
+        self._sink, self._name, self._failed, self._done = sink, name, False, False
+
+    def __exit__(self, exc_type, *exc):
+        self._failed = exc_type is not None
+        self.close()
+
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        self.flush()
+        buffer = self.detach()
+        if self._failed:
+            self._sink._discard(self._name, buffer)
+        else:
+            self._sink._commit(self._name, buffer)
+
+
+class Sink(object):
+    """
+    where the converters write their output files: open(name) gives a text file like the builtin open(name, 'w'),
+    added to the output once it is closed. The bytes of every added file are counted as 'bytes_written'. Leaving its
+    with block by an exception aborts the sink instead of closing it
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self, name, encoding=None):
+        return SinkFile(self, name, self._buffer(name), encoding)
+
+    def _buffer(self, name):
+        return io.BytesIO()
+
+    def _commit(self, name, buffer):
+        size = buffer.tell()
+        buffer.seek(0)
+        try:
+            self.add(name, buffer, size)
+        finally:
+            buffer.close()
+        metrics.count('bytes_written', size)
+
+    def _discard(self, name, buffer):
+        buffer.close()
+
+    def write(self, name, data):
+        """ add the file name with the bytes data, written elsewhere """
+        buffer = self._buffer(name)
+        buffer.write(data)
+        self._commit(name, buffer)
+
+    def add(self, name, fileobj, size):
+        """ add the size bytes of a binary file object as the file name """
+        raise NotImplementedError
+
+    def remove(self, name):
+        """ remove the file name a previous run left in the output, if there is one """
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """ end a failed conversion: the files already closed stay, what is not complete yet is dropped """
+        pass
+
+
+class FileSink(Sink):
+    """ files written in place, each through a temp file renamed into place when it is closed """
+
+    def _buffer(self, name):
+        return open(name + '.tmp', 'wb')
+
+    def _commit(self, name, buffer):
+        size = buffer.tell()
+        buffer.close()
+        os.replace(name + '.tmp', name)
+        metrics.count('bytes_written', size)
+
+    def _discard(self, name, buffer):
+        buffer.close()
+        os.remove(name + '.tmp')
+
+    def add(self, name, fileobj, size):
+        with open(name + '.tmp', 'wb') as fo:
+            shutil.copyfileobj(fileobj, fo)
+        os.replace(name + '.tmp', name)
+
+    def remove(self, name):
+        if os.path.isfile(name):
+            os.remove(name)
+
+
+class MemorySink(Sink):
+    """ files kept as (name, bytes) pairs, for a pool worker to send them back to the sink of the main process """
+
+    def __init__(self):
+        self.files = []
+
+    def add(self, name, fileobj, size):
+        self.files.append((name, fileobj.read()))
+
+
+class ArchiveSink(Sink):
+    """
+    files added as members of one archive, named by their path relative to root; the archive is written as
+    '{path}.tmp' and renamed into place when the sink is closed, or removed when it is aborted. A new archive holds
+    nothing of a previous run, so remove() has nothing to do
+    """
+
+    def __init__(self, path, root='.'):
+        self.path = path
+        self.root = os.path.join(os.path.abspath(root), '')
+        self.archive = self._open_archive(path + '.tmp')
+
+    def member_name(self, name):
+        abs_name = os.path.abspath(name)
+        if not abs_name.startswith(self.root):
+            raise Exception(f'[ERROR] {name} is outside the archive root {self.root}')
+        return abs_name[len(self.root):].replace(os.sep, '/')
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+            os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        if self.archive is not None:
+            try:
+                self.archive.close()
+            finally:
+                self.archive = None
+                os.remove(self.path + '.tmp')
+
+
+class TarSink(ArchiveSink):
+    """ members of a tar archive, compressed as its suffix says: .tar, .tar.gz/.tgz, .tar.bz2 or .tar.xz """
+
+    def _open_archive(self, tmp_path):
+        import tarfile
+
+        mode = 'w'
+        for suffixes, compression in (('.tar.gz', '.tgz'), 'gz'), (('.tar.bz2',), 'bz2'), (('.tar.xz',), 'xz'):
+            if self.path.endswith(suffixes):
+                mode = 'w:' + compression
+        # GNU headers hold the utf-8 '表示順' names as they are, pax would add a header per member
+        return tarfile.open(tmp_path, mode, format=tarfile.GNU_FORMAT, encoding='utf-8')
+
+    def add(self, name, fileobj, size):
+        import tarfile
+
+        info = tarfile.TarInfo(self.member_name(name))
+        info.size, info.mtime, info.mode = size, int(time.time()), 0o644
+        self.archive.addfile(info, fileobj)
+
+
+class ZipSink(ArchiveSink):
+    """ deflated members of a zip archive """
+
+    def _open_archive(self, tmp_path):
+        import zipfile
+
+        return zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, name, fileobj, size):
+        import zipfile
+
+        info = zipfile.ZipInfo(self.member_name(name), time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        with self.archive.open(info, 'w') as fo:
+            shutil.copyfileobj(fileobj, fo)
+
+
+class ThreadedSink(Sink):
+    """
+    files kept in memory until they are closed, then written to another sink by a background thread: at most
+    queue_size closed files wait for it, a full queue blocks the converter. An error of the writer is raised at the
+    next file closed or at close(), the files queued after it are dropped and the other sink is aborted
+    """
+
+    def __init__(self, sink, queue_size=64):
+        self.sink = sink
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._write, name='output-sink', daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                name, data = item
+                try:
+                    if data is None:
+                        self.sink.remove(name)
+                    else:
+                        self.sink.add(name, io.BytesIO(data), len(data))
+                except Exception as ex:
+                    self.error = ex
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _commit(self, name, buffer):
+        self._check()
+        data = buffer.getvalue()
+        buffer.close()
+        self.queue.put((name, data))
+        metrics.count('bytes_written', len(data))
+
+    def remove(self, name):
+        # queued, so it happens in order with the files added
+        self._check()
+        self.queue.put((name, None))
+
+    def _stop(self):
+        if self.thread is None:
+            return False
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        return True
+
+    def close(self):
+        if self._stop():
+            if self.error is None:
+                self.sink.close()
+            else:
+                self.sink.abort()
+        self._check()
+
+    def abort(self):
+        if self._stop():
+            self.sink.abort()
+
+
+def open_sink(archive=None, root='.', queue_size=0):
+    """
+    the sink of a conversion: files in place, or the members of the archive file (named relative to root) if one
+    is given; with queue_size, written by a background thread with at most that many files waiting
+    """
+    if not archive:
+        sink = FileSink()
+    elif archive.endswith('.zip'):
+        sink = ZipSink(archive, root)
+    elif archive.endswith(ARCHIVE_SUFFIXES):
+        sink = TarSink(archive, root)
+    else:
+        raise Exception(f'[ERROR] unknown archive type {archive}, expected one of {", ".join(ARCHIVE_SUFFIXES)}')
+    return ThreadedSink(sink, queue_size) if queue_size else sink
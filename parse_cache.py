@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# content-addressed cache of parsed findings for json2brat: an in-memory LRU with an optional sqlite disk cache
+#
+import json
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """ sha1 of a json list of strings, numbers and bools: the finding text and the settings its parse depends on """
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def dump_entry(entry):
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def load_entry(entry_str):
+    """ an entry read back from json: (text, tags, attrs, problems) with the tags and attrs as tuples again """
+    text, tags, attrs, problems = json.loads(entry_str)
+    return text, [tuple(tag) for tag in tags], [tuple(attr) for attr in attrs], problems
+
+
+class ParseCache(object):
+    """
+    parsed findings by content key: looked up in a bounded LRU, then in the disk cache. With keep_added=True the
+    entries put since the last take_added() are kept apart, so a pool worker can send them back to the main process
+    """
+
+    def __init__(self, cache_size=10000, cache_file=None, keep_added=False, commit_every=1000):
+        self.cache_size = cache_size
+        self.keep_added = keep_added
+        self.commit_every = commit_every
+        self.cache = OrderedDict()
+        self.added = {}
+        self.pending = []
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self.db = None
+        if cache_file:
+            self.db = sqlite3.connect(cache_file)
+            self.db.execute('CREATE TABLE IF NOT EXISTS findings (key TEXT PRIMARY KEY, entry TEXT)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.db:
+            self._commit()
+            self.db.close()
+            self.db = None
+
+    def _commit(self):
+        if self.pending:
+            self.db.executemany('INSERT OR REPLACE INTO findings VALUES (?, ?)', self.pending)
+            self.db.commit()
+            self.pending = []
+
+    def _remember(self, key, entry):
+        if self.cache_size:
+            self.cache[key] = entry
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def get(self, key):
+        """ the entry of a key, None (and a miss) if it was not parsed before """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        if self.db:
+            row = self.db.execute('SELECT entry FROM findings WHERE key = ?', (key,)).fetchone()
+            if row:
+                entry = load_entry(row[0])
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.keep_added:
+            self.added[key] = entry
+        if self.db:
+            self.pending.append((key, dump_entry(entry)))
+            if len(self.pending) >= self.commit_every:
+                self._commit()
+
+    def update(self, entries):
+        """ add entries looked up elsewhere, without counting or keeping them as put """
+        for key, entry in entries.items():
+            self._remember(key, entry)
+
+    def take_added(self):
+        """ the entries put since the last call """
+        added, self.added = self.added, {}
+        return added
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'entries': len(self.cache),
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0}
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# compact indexed store of the 読影所見 records ('.prism' files)
+#
+# layout: MAGIC, then one (uint32 length, utf-8 json) entry per record, then the json index and a footer of
+# (uint64 index offset, MAGIC); the index holds the 文章名, the line ids with their record offsets and,
+# per index column, the record positions of every value
+#
+import json
+import mmap
+import os
+import struct
+from argparse import ArgumentParser
+
+MAGIC = b'PRISMRS1'
+LENGTH = struct.Struct('<I')
+FOOTER = struct.Struct('<Q8s')
+DEFAULT_INDEX_COLS = ('表示順', '匿名ID', 'ID', '_id')
+
+
+def is_report_store(file_name):
+    return file_name.endswith('.prism')
+
+
+def write_report_store(records, store_file, doc_name, index_cols=DEFAULT_INDEX_COLS, default=None, normalized=None):
+    """
+    write (line id, record) pairs one at a time; a record is stored as compact json.dumps text (ensure_ascii=False,
+    default for dates), which decodes to the same record, so converting back to the json layout is lossless.
+    index_cols missing from a record are not indexed.
+    doc_name may be a function giving it once the records are written; normalized is the 正規化 of the json layout.
+    """
+    line_ids, offsets = [], []
+    indexes = {col: {} for col in index_cols}
+    with open(store_file + '.tmp', 'wb') as store_fo:
+        store_fo.write(MAGIC)
+        for position, (line_id, record) in enumerate(records):
+            record_bytes = json.dumps(record, ensure_ascii=False, default=default).encode('utf-8')
+            line_ids.append(str(line_id))
+            offsets.append(store_fo.tell())
+            store_fo.write(LENGTH.pack(len(record_bytes)))
+            store_fo.write(record_bytes)
+            for col in index_cols:
+                if col in record:
+                    indexes[col].setdefault(str(record[col]), []).append(position)
+
+        index_offset = store_fo.tell()
+        index = {'文章名': doc_name() if callable(doc_name) else doc_name, 'line_ids': line_ids, 'offsets': offsets,
+                 'indexes': {col: values for col, values in indexes.items() if values}}
+        if normalized:
+            index['正規化'] = normalized
+        store_fo.write(json.dumps(index, ensure_ascii=False).encode('utf-8'))
+        store_fo.write(FOOTER.pack(index_offset, MAGIC))
+    os.replace(store_file + '.tmp', store_file)
+
+
+class ReportStore(object):
+    """ read-only, memory-mapped access to a '.prism' store; records are decoded only when asked for """
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self._fi = open(store_file, 'rb')
+        self._mm = mmap.mmap(self._fi.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, magic = FOOTER.unpack(self._mm[-FOOTER.size:])
+        if self._mm[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.close()
+            raise ValueError('[ERROR] %s is not a report store' % store_file)
+        index = json.loads(self._mm[index_offset:-FOOTER.size].decode('utf-8'))
+        self.doc_name = index['文章名']
+        self.normalized = index.get('正規化', {})
+        self.line_ids = index['line_ids']
+        self._offsets = index['offsets']
+        self.indexes = index['indexes']
+        self._positions = {line_id: position for position, line_id in enumerate(self.line_ids)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+        self._fi.close()
+
+    def __len__(self):
+        return len(self.line_ids)
+
+    def __contains__(self, line_id):
+        return str(line_id) in self._positions
+
+    def _record(self, position):
+        offset = self._offsets[position] + LENGTH.size
+        length, = LENGTH.unpack_from(self._mm, self._offsets[position])
+        return json.loads(self._mm[offset:offset + length].decode('utf-8'))
+
+    def get(self, line_id):
+        """ the record of one line id """
+        return self._record(self._positions[str(line_id)])
+
+    def items(self):
+        """ generate every (line id, record) pair in stored order """
+        for position, line_id in enumerate(self.line_ids):
+            yield line_id, self._record(position)
+
+    def select(self, col, value):
+        """ generate the (line id, record) pairs whose index column 'col' equals value """
+        if col not in self.indexes:
+            raise KeyError('[ERROR] %s is not indexed in %s' % (col, self.store_file))
+        for position in self.indexes[col].get(str(value), []):
+            yield self.line_ids[position], self._record(position)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Look up 読影所見 records in a .prism report store')
+    parser.add_argument("store_file", help="input .prism store")
+    parser.add_argument("--line-id", help="print the record of one line id")
+    parser.add_argument("--col", help="index column to select on, e.g. 表示順 or 匿名ID")
+    parser.add_argument("--value", help="value of --col to select")
+    args = parser.parse_args()
+
+    with ReportStore(args.store_file) as store:
+        if args.line_id:
+            selected = [(args.line_id, store.get(args.line_id))]
+        elif args.col:
+            selected = store.select(args.col, args.value)
+        else:
+            print('%s: %i records, indexed by %s' % (store.doc_name, len(store), ', '.join(store.indexes)))
+            selected = []
+        for line_id, record in selected:
+            print(json.dumps({'line_id': line_id, 'record': record}, ensure_ascii=False))
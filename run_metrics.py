@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# per-stage wall times and counters of a format_converter run, summarized as json
+#
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from datetime import datetime
+
+_null_stage = nullcontext()
+
+
+class _Stage(object):
+    __slots__ = ('metrics', 'name', 'start', 'inner', 'stack')
+
+    def __init__(self, metrics, name):
+        self.metrics, self.name = metrics, name
+
+    def __enter__(self):
+        self.stack = self.metrics._stack()
+        self.stack.append(self)
+        self.inner = 0.0
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.stack.pop()
+        # exclusive: the time of the stages run inside this one is only theirs
+        self.metrics.seconds[self.name] += seconds - self.inner
+        self.metrics.calls[self.name] += 1
+        if self.stack:
+            self.stack[-1].inner += seconds
+
+
+class Metrics(object):
+    """
+    stage timers and counters, all no-ops until enable(); counter names with a '/' (e.g. 'parse_failures/mr')
+    are grouped by their prefix in the summary. Stage times are exclusive: a stage entered inside another one (in the
+    same thread) is subtracted from the outer stage, so the stages of one thread add up to at most its wall time
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._local = threading.local()
+        self.reset()
+
+    def _stack(self):
+        """ the stages open in the current thread """
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    def stage(self, name):
+        """ context manager adding its wall time to stage 'name' """
+        return _Stage(self, name) if self.enabled else _null_stage
+
+    def timed_iter(self, name, items):
+        """ pass items through, adding the time spent producing each one to stage 'name' """
+        if not self.enabled:
+            yield from items
+            return
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def count_file(self, file_name):
+        """ add the size of a file just written to 'bytes_written' """
+        if self.enabled:
+            self.counters['bytes_written'] += os.path.getsize(file_name)
+
+    def snapshot(self):
+        """ the current values, picklable, for merge() in another process """
+        return {'seconds': dict(self.seconds), 'calls': dict(self.calls), 'counters': dict(self.counters)}
+
+    def merge(self, snapshot):
+        for name, seconds in snapshot['seconds'].items():
+            self.seconds[name] += seconds
+        self.calls.update(snapshot['calls'])
+        self.counters.update(snapshot['counters'])
+
+    def summary(self, wall_seconds, **info):
+        counters = {}
+        for name, value in sorted(self.counters.items()):
+            if '/' in name:
+                group, key = name.split('/', 1)
+                counters.setdefault(group, {})[key] = value
+            else:
+                counters[name] = value
+        summary = dict(info)
+        summary.update({
+            'wall_seconds': round(wall_seconds, 6),
+            # stages run in pool workers add up over the workers
+            'stages': {name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]}
+                       for name in sorted(self.seconds, key=self.seconds.get, reverse=True)},
+            'counters': counters,
+            'reports_per_second': round(self.counters['reports'] / wall_seconds, 3) if wall_seconds else None,
+        })
+        return summary
+
+    def write_summary(self, metrics_file, wall_seconds, **info):
+        """ write the json summary to metrics_file, or to stdout for '-' """
+        summary_str = json.dumps(self.summary(wall_seconds, finished=datetime.now().isoformat(), **info),
+                                 ensure_ascii=False, indent=2)
+        if metrics_file == '-':
+            sys.stdout.write(summary_str + '\n')
+        else:
+            with open(metrics_file, 'w', encoding='utf-8') as metrics_fo:
+                metrics_fo.write(summary_str + '\n')
+
+
+metrics = Metrics()
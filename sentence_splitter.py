@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# in-process port of `perl sentence-splitter.pl | python split_tnm.py`
+# (SentenceExtractor.pm SplitJapanese rules followed by the TNM code splitting)
+#
+import os
+import re
+import sys
+from argparse import ArgumentParser
+
+from split_tnm import split_by_tnm
+
+comma = '，'
+open_kakko = r'（|〔|［|｛|＜|≪|「|『|【|\(|\[|\{'
+close_kakko = r'）|〕|］|｝|＞|≫|」|』|】|\)|\]|\}'
+period = '。|？|！|♪|…'
+dot = '．'
+alphabet_or_number = '(?:[Ａ-Ｚ]|[ａ-ｚ]|[０-９])'
+itemize_header = f'{alphabet_or_number}．'
+cdot = '・'
+
+delimiter_re = re.compile(
+    f'(?:(?:{period})|((?:{cdot}){{3,}})|(?<!{alphabet_or_number})(?:{dot})(?!{alphabet_or_number}|{comma}))'
+    f'(?:{dot}|{period})*')
+kakko_delimiter_re = re.compile(
+    f'(?:(?:{period})|(?:{cdot}){{3,}}|(?<!{alphabet_or_number})(?:{dot})(?!{alphabet_or_number}|{comma}))'
+    f'(?:{dot}|{period})*')
+kakko_re = re.compile(f'({open_kakko})|(?:{close_kakko})')
+head_kakko_re = re.compile(r'^(（.+?）)(.+)$')
+close_kakko_head_re = re.compile(f'^(?:{close_kakko})+')
+itemize_re = re.compile(f'^{itemize_header}$')
+concat_after_mark_re = re.compile('^(?:と|っ|です)')
+mark_tail_re = re.compile(f'(?:！|？|{close_kakko})$')
+concat_after_item_re = re.compile('^(?:と|や|の)')
+itemize_tail_re = re.compile(f'{itemize_header}$')
+line_re = re.compile(r'[^\n]*\n|[^\n]+')
+
+
+def _perl_true(value):
+    return value is not None and value != '' and value != '0'
+
+
+def fix_parenthesis(slist):
+    # the perl loop bound is evaluated once, before any element is merged away
+    for i in range(len(slist)):
+        if i >= len(slist):
+            continue
+        # 1つ目の文以降で、閉じ括弧が文頭にある場合は、閉じ括弧をとって前の文にくっつける
+        if i > 0:
+            m = close_kakko_head_re.match(slist[i])
+            if m:
+                slist[i - 1] += m.group(0)
+                slist[i] = slist[i][m.end():]
+
+        # 1つ前の文と当該文に”が奇数個含まれている場合は、前の文に該当文をくっつける
+        if i > 0:
+            num_of_zenaku_quote_prev = slist[i - 1].count('”')
+            num_of_zenaku_quote_curr = slist[i].count('”')
+            if num_of_zenaku_quote_prev > 0 and num_of_zenaku_quote_curr > 0:
+                if num_of_zenaku_quote_prev % 2 == 1 and num_of_zenaku_quote_curr % 2 == 1:
+                    slist[i - 1] += slist[i]
+                    del slist[i]
+
+        # 当該文が^$itemize_header$にマッチする場合、箇条書きと判断し、次の文とくっつける
+        if i + 1 < len(slist):
+            if itemize_re.search(slist[i]):
+                slist[i] += slist[i + 1]
+                del slist[i + 1]
+
+
+def concat_sentences(sents):
+    if not sents:
+        return []
+    buff = []
+    tail = len(sents) - 1
+    while tail > 0:
+        if concat_after_mark_re.search(sents[tail]) and mark_tail_re.search(sents[tail - 1]):
+            sents[tail - 1] += sents[tail]
+        elif concat_after_item_re.search(sents[tail]) and itemize_tail_re.search(sents[tail - 1]):
+            sents[tail - 1] += sents[tail]
+        else:
+            buff.insert(0, sents[tail])
+        tail -= 1
+    buff.insert(0, sents[0])
+    return buff
+
+
+def split_japanese(text):
+    """ SentenceExtractor::SplitJapanese, text is one input line (with its newline) """
+    buf, tmp = [], []
+    sent = ''
+    level = 0
+    m = delimiter_re.search(text)
+    while m:
+        pre = text[:m.start()]
+        sent += pre + m.group(0)
+        text = text[m.end():]
+
+        # a sentence should include strings other than $cdot{3,}
+        if m.group(1) is None or pre != '':
+            for k in kakko_re.finditer(pre):
+                level += 1 if k.group(1) else -1
+                level = max(level, 0)
+            if level == 0:
+                tmp.append(sent)
+                sent = ''
+        m = delimiter_re.search(text)
+    tmp.append(sent + text)
+
+    for s in tmp:
+        # 先頭がカッコで囲まれた文から始まっている場合
+        m = head_kakko_re.search(s)
+        if m:
+            s_enclosed_by_kakko, s = m.group(1), m.group(2)
+            s_tmp = ''
+            # カッコで囲まれた文がデリミタを含んでいるならば区切る
+            d = kakko_delimiter_re.search(s_enclosed_by_kakko)
+            while d:
+                pre = s_enclosed_by_kakko[:d.start()]
+                s_tmp += pre + d.group(0)
+                s_enclosed_by_kakko = s_enclosed_by_kakko[d.end():]
+                if not d.group(0).startswith(cdot) or pre != '（':
+                    buf.append(s_tmp)
+                    s_tmp = ''
+                d = kakko_delimiter_re.search(s_enclosed_by_kakko)
+            if s_enclosed_by_kakko != '':
+                buf.append(s_enclosed_by_kakko)
+        if s != '':
+            buf.append(s)
+
+    # strip (?:\s|　)+ from both ends
+    buf = [y.strip() for y in buf]
+    fix_parenthesis(buf)
+    buf = concat_sentences(buf)
+    if buf and not _perl_true(buf[-1]):
+        buf.pop()
+    return buf
+
+
+def split_sentences(text):
+    """ generate the lines `perl sentence-splitter.pl | python split_tnm.py` prints for text """
+    for line in line_re.findall(text):
+        for sentence in split_japanese(line):
+            yield '\n'.join(split_by_tnm(sentence.rstrip()))
+
+
+def split_file(in_file, out_file, sink=None):
+    """ write the sentences of in_file to out_file, through an output_sink sink if given """
+    with open(in_file, 'r', encoding='utf-8', newline='') as fi:
+        text = fi.read()
+    with (sink.open(out_file, encoding='utf-8') if sink else open(out_file, 'w', encoding='utf-8')) as fo:
+        for sent in split_sentences(text):
+            fo.write('%s\n' % sent)
+
+
+def main():
+    parser = ArgumentParser(description='Split Japanese text (and TNM codes) into one sentence per line.')
+    parser.add_argument("files", nargs='*',
+                        help="input txt files, stdin to stdout if omitted")
+    parser.add_argument("--suffix", default='.sent',
+                        help="output file suffix replacing the input extension")
+    parser.add_argument("--archive",
+                        help="write the output files into one .tar, .tar.gz/.tgz, .tar.bz2, .tar.xz or .zip archive, "
+                             "named relative to the common directory of the input files", metavar="ARCHIVE_FILE")
+    parser.add_argument("--io-queue", dest="io_queue", type=int, default=0,
+                        help="write the output files in a background thread, with at most N files waiting", metavar="N")
+    args = parser.parse_args()
+
+    if not args.files:
+        for sent in split_sentences(sys.stdin.read()):
+            print(sent)
+        return
+    from output_sink import open_sink
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(in_file)) for in_file in args.files])
+    with open_sink(args.archive, root, args.io_queue) as sink:
+        for in_file in args.files:
+            out_file = os.path.splitext(in_file)[0] + args.suffix
+            print(out_file)
+            split_file(in_file, out_file, sink)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,4 @@
 #!/bin/bash
+# usage: splitsent.sh DIR [sentence_splitter.py options, e.g. --archive sents.tar.gz --io-queue 64]
 
-for filename in $1/*.txt; do
-    fwop=$(basename "$filename")
-    fwoe="${fwop%.*}"
-    sent_file="$1/$fwoe.sent"
-    echo $sent_file
-    cat $filename | perl sentence-splitter.pl | python split_tnm.py > $sent_file
-done
+python sentence_splitter.py --suffix .sent "${@:2}" $1/*.txt
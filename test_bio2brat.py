@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# bio2brat: the brat pair written straight from the BIO events
+# (python -m unittest test_bio2brat)
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from format_converter import convert_bio_to_brat
+
+BIO = '''肝 B-a _
+に O _
+腫 B-d positive
+瘤 I-d _
+あり O _
+EOR O _
+2020 B-TIMEX3 _
+年 I-TIMEX3 _
+EOR O _
+'''
+
+
+class Bio2BratTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bio_file = os.path.join(self.tmp_dir, 'a.bio')
+        with open(self.bio_file, 'w') as fo:
+            fo.write(BIO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def bio2brat(self):
+        brat_file = os.path.join(self.tmp_dir, 'a')
+        convert_bio_to_brat(self.bio_file, brat_file)
+        with open(brat_file + '.txt', 'r', encoding='utf-8') as fot, \
+                open(brat_file + '.ann', 'r', encoding='utf-8') as foa:
+            return fot.read(), foa.read().splitlines()
+
+    def test_entities_and_certainty(self):
+        text, ann = self.bio2brat()
+        self.assertEqual(text, '肝に腫瘤あり\n2020年\n')
+        self.assertEqual(ann[:2], ['T1\tAnatomical 0 1\t肝', 'T2\tDisease 2 4\t腫瘤'])
+        self.assertEqual(ann[-1], 'A1\tcertainty T2 positive')
+
+    def test_timex3_keeps_its_type(self):
+        text, ann = self.bio2brat()
+        self.assertEqual(ann[2], 'T3\tTIMEX3 7 12\t2020年')
+        self.assertEqual(text[7:12], '2020年')
+
+
+if __name__ == '__main__':
+    unittest.main()
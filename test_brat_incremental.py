@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# the incremental json2brat plan of brat_incremental, and json2brat --incremental against a full rebuild
+# (python -m unittest test_brat_incremental)
+#
+import io
+import os
+import json
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from brat_incremental import SegmentManifest, plan_segments, segment_fingerprint
+from format_converter import BRAT_COLUMNS, extract_brat_from_json
+
+FINDINGS = ['plain', 'また plain', '<d>x</d>', '<d>y</d>あり', '<a>肝</a>の<d>腫瘤</d>', '']
+
+
+def write_json(json_file, rows):
+    """ a central json of (表示順, ann) rows """
+    records = {str(i + 1): {'表示順': rid, '匿名ID': 'p', '記載日': '2020-01-01', 'タイトル': 'X', 'ann': ann}
+               for i, (rid, ann) in enumerate(rows)}
+    with open(json_file, 'w', encoding='utf-8') as fo:
+        json.dump({'読影所見': records, '文章名': 'test'}, fo, ensure_ascii=False, indent=2)
+
+
+def read_dir(brat_dir):
+    """ {file name: content} of the brat pairs and manifest of a directory """
+    files = {}
+    for name in sorted(os.listdir(brat_dir)):
+        with open(os.path.join(brat_dir, name), 'r', encoding='utf-8') as fi:
+            files[name] = fi.read()
+    return files
+
+
+def make_groups(rids, changed=()):
+    """ (group, fingerprint, is_last) triples of one-report groups, with fingerprint 'f{rid}' or 'g{rid}' if changed """
+    return [([(str(i + 1), {'表示順': rid})], ('g%s' if rid in changed else 'f%s') % rid, i == len(rids) - 1)
+            for i, rid in enumerate(rids)]
+
+
+def write_manifest(segments):
+    """ the manifest files of a run writing segments, given as ([rids of its groups], [names of its pairs]) """
+    manifest = SegmentManifest()
+    for i, (rids, pairs) in enumerate(segments):
+        for rid in rids:
+            manifest.add_group(str(rid), 'f%s' % rid)
+        for out_rid in pairs:
+            manifest.add_pair(out_rid, [])
+        manifest.end_segment(final=i == len(segments) - 1)
+    return manifest.files
+
+
+def plan(groups, prev_files, missing=()):
+    """ (表示順, keep) of each group planned by plan_segments """
+    planned = plan_segments(groups, prev_files, lambda group: str(group[0][1]['表示順']),
+                            lambda out_rid: out_rid not in missing)
+    return [(group[0][1]['表示順'], keep) for group, fingerprint, is_last, keep, out_rids in planned]
+
+
+class SegmentPlanTest(unittest.TestCase):
+
+    def test_single_group_segments(self):
+        prev_files = write_manifest([([1], ['表示順1']), ([2], ['表示順2']), ([3], ['表示順3'])])
+        self.assertEqual(prev_files['表示順2'], {'fingerprint': 'f2', 'final': False, 'line_ids': []})
+        self.assertEqual(plan(make_groups([1, 2, 3]), prev_files), [(1, 1), (2, 1), (3, 1)])
+        self.assertEqual(plan(make_groups([1, 2, 3], changed=[2]), prev_files), [(1, 1), (2, 0), (3, 1)])
+        self.assertEqual(plan(make_groups([1, 2, 3]), prev_files, missing=['表示順3']), [(1, 1), (2, 1), (3, 0)])
+
+    def test_multi_group_segments(self):
+        # 1 and 2 without tags join the pair of 3, which is cut after its first report into 表示順1 and 表示順3
+        prev_files = write_manifest([([1, 2, 3], ['表示順1', '表示順3']), ([4], ['表示順4'])])
+        self.assertEqual(prev_files['表示順3']['start'], '1')
+        self.assertEqual(prev_files['表示順1']['groups'], 3)
+        self.assertEqual(prev_files['表示順1']['fingerprint'], segment_fingerprint(['f1', 'f2', 'f3']))
+        self.assertEqual(plan(make_groups([1, 2, 3, 4]), prev_files), [(1, 3), (2, -1), (3, -1), (4, 1)])
+        for changed in [1, 2, 3]:
+            self.assertEqual(plan(make_groups([1, 2, 3, 4], changed=[changed]), prev_files),
+                             [(1, 0), (2, 0), (3, 0), (4, 1)])
+        self.assertEqual(plan(make_groups([1, 2, 3, 4]), prev_files, missing=['表示順3']),
+                         [(1, 0), (2, 0), (3, 0), (4, 1)])
+
+    def test_final_segment(self):
+        prev_files = write_manifest([([1], ['表示順1']), ([2, 3], ['表示順3'])])
+        self.assertEqual(prev_files['表示順3'], {'fingerprint': segment_fingerprint(['f2', 'f3']), 'final': True,
+                                               'line_ids': [], 'groups': 2, 'start': '2'})
+        self.assertEqual(plan(make_groups([1, 2, 3]), prev_files), [(1, 1), (2, 2), (3, -1)])
+        # no longer the last segment
+        self.assertEqual(plan(make_groups([1, 2, 3, 4]), prev_files), [(1, 1), (2, 0), (3, 0), (4, 0)])
+
+    def test_removed_groups(self):
+        prev_files = write_manifest([([1], ['表示順1']), ([2, 3], ['表示順2']), ([4], ['表示順4']), ([5], ['表示順5'])])
+        self.assertEqual(plan(make_groups([1, 2, 4, 5]), prev_files), [(1, 1), (2, 0), (4, 1), (5, 1)])
+        self.assertEqual(plan(make_groups([1, 3, 4, 5]), prev_files), [(1, 1), (3, 0), (4, 1), (5, 1)])
+        self.assertEqual(plan(make_groups([1, 2, 3, 5]), prev_files), [(1, 1), (2, 2), (3, -1), (5, 1)])
+        # the last segment removed: the one before it now ends the input
+        self.assertEqual(plan(make_groups([1, 2, 3, 4]), prev_files), [(1, 1), (2, 2), (3, -1), (4, 0)])
+
+    def test_stale_pairs(self):
+        prev_files = write_manifest([([1], ['表示順1']), ([2], ['表示順2']), ([3], ['表示順3'])])
+        manifest = SegmentManifest()
+        manifest.keep(['表示順1'], prev_files)
+        manifest.add_group('3', 'f3')
+        manifest.add_pair('表示順3', [])
+        manifest.end_segment(final=True)
+        self.assertEqual(manifest.kept, ['表示順1'])
+        self.assertEqual(manifest.stale({'files': prev_files}), ['表示順2'])
+        self.assertEqual(manifest.stale({'files': prev_files, 'shards': [{'name': 'shard0'}]}), ['表示順2', 'shard0'])
+        self.assertEqual(manifest.stale({'shards': [{'name': 'shard0'}]}, [{'name': 'shard0'}]), [])
+
+
+class IncrementalJson2BratTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.json_file = os.path.join(self.tmp_dir, 'a.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json2brat(self, brat_dir, incremental):
+        os.makedirs(brat_dir, exist_ok=True)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            extract_brat_from_json(self.json_file, os.path.join(brat_dir, 's'), 'mr', incremental=incremental,
+                                   **BRAT_COLUMNS['mr'])
+        return ''.join(line for line in out.getvalue().splitlines() if line.startswith('[incremental]'))
+
+    def assert_rebuild(self, rows):
+        """ an incremental run over the previous output gives the brat pairs of a full run """
+        write_json(self.json_file, rows)
+        full_dir = os.path.join(self.tmp_dir, 'full')
+        shutil.rmtree(full_dir, ignore_errors=True)
+        self.json2brat(full_dir, False)
+        summary = self.json2brat(os.path.join(self.tmp_dir, 'inc'), True)
+        full_files, inc_files = read_dir(full_dir), read_dir(os.path.join(self.tmp_dir, 'inc'))
+        self.assertEqual(inc_files, full_files)
+        return summary
+
+    def test_invalidated_segment_of_several_groups(self):
+        rows = [(1, 'plain'), (2, 'plain'), (3, '<d>x</d>'), (4, '<d>y</d>')]
+        self.assert_rebuild(rows)
+        self.assertIn(' 2 unchanged kept', self.assert_rebuild(rows))
+        rows[0] = (1, 'plain, edited')
+        self.assert_rebuild(rows)
+        self.assertIn('0 brat files written', self.assert_rebuild(rows))
+
+    def test_random_edits(self):
+        rnd = random.Random(0)
+        for _ in range(10):
+            rows = [(rid, rnd.choice(FINDINGS)) for rid in range(1, 13) for _ in range(rnd.randint(1, 2))]
+            self.assert_rebuild(rows)
+            for _ in range(4):
+                index = rnd.randrange(len(rows))
+                action = rnd.choice(['edit', 'drop', 'add'])
+                if action == 'edit':
+                    rows[index] = (rows[index][0], rnd.choice(FINDINGS))
+                elif action == 'drop' and len(rows) > 1:
+                    del rows[index]
+                else:
+                    rows.insert(index, (rows[index][0], rnd.choice(FINDINGS)))
+                self.assert_rebuild(rows)
+                self.assertIn('0 brat files written', self.assert_rebuild(rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# json2brat --shard-reports/--shard-chars and brat2json: the sharded round trip against the unsharded one
+# (python -m unittest test_brat_shards)
+#
+import os
+import re
+import json
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from format_converter import BRAT_COLUMNS, combine_brat_to_json, extract_brat_from_json
+from test_brat_incremental import write_json
+
+FINDINGS = ['plain', '<d certainty="positive">腫瘤</d>あり', '<a>肝</a>の<d>腫瘤</d>\n<c>増大</c>',
+            '<TIMEX3 type="DATE">2020年</TIMEX3>より<d>結節</d>', '']
+
+
+class ShardRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.json_file = os.path.join(self.tmp_dir, 'a.json')
+        rnd = random.Random(0)
+        write_json(self.json_file, [(rid, rnd.choice(FINDINGS)) for rid in range(1, 31)
+                                    for _ in range(rnd.randint(1, 3))])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def round_trip(self, name, **shard_args):
+        """ the records of brat2json over the json2brat output, with the T ids of the annotation blanked """
+        brat_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(brat_dir)
+        brat_file, new_json = os.path.join(brat_dir, 's'), os.path.join(brat_dir, 'new.json')
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            extract_brat_from_json(self.json_file, brat_file, 'mr', **shard_args, **BRAT_COLUMNS['mr'])
+            combine_brat_to_json(self.json_file, brat_file, new_json)
+        with open(new_json, 'r', encoding='utf-8') as fi:
+            records = json.load(fi)['読影所見']
+        for record in records.values():
+            record['ann'] = re.sub(r'T\d+', 'T', record['ann'])
+        return records
+
+    def test_sharded_as_unsharded(self):
+        unsharded = self.round_trip('unsharded')
+        self.assertTrue(any('tid="T"' in record['ann'] for record in unsharded.values()))
+        for name, shard_args in [('reports1', {'shard_reports': 1}), ('reports7', {'shard_reports': 7}),
+                                 ('chars50', {'shard_chars': 50}), ('both', {'shard_reports': 5, 'shard_chars': 80})]:
+            sharded = self.round_trip(name, **shard_args)
+            self.assertEqual(sharded, unsharded, name)
+
+    def test_shards_written(self):
+        self.round_trip('reports7', shard_reports=7)
+        names = os.listdir(os.path.join(self.tmp_dir, 'reports7'))
+        with open(os.path.join(self.tmp_dir, 'reports7', 's.manifest.json'), 'r', encoding='utf-8') as fi:
+            shards = json.load(fi)['shards']
+        self.assertGreater(len(shards), 1)
+        self.assertFalse([name for name in names if '表示順' in name])
+        self.assertEqual(sorted(name for name in names if name.endswith('.ann')),
+                         sorted('s.%s.ann' % shard['name'] for shard in shards))
+
+
+if __name__ == '__main__':
+    unittest.main()
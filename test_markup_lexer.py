@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# the markup_lexer reading of the findings against ElementTree, and json2brat --parser lexer against etree
+# (python -m unittest test_markup_lexer)
+#
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from contextlib import redirect_stdout
+
+from format_converter import BRAT_COLUMNS, etree_markup_lines, extract_brat_from_json, tag2name
+from markup_lexer import UnsupportedMarkup, parse_markup_lines
+from test_brat_incremental import read_dir, write_json
+
+WELL_FORMED = [
+    '<doc><line>plain</line></doc>',
+    '<doc><line>肝に<d certainty="positive">腫瘤</d>あり</line><line></line><line>次</line></doc>',
+    '<doc><line><a>肝</a><d certainty=\'suspicious\'>結節<f>多発</f>性</d>。</line></doc>',
+    '<doc>\n<line>a &amp; b &lt;c&gt; &#x41;&#66;</line>\n</doc>',
+    '<doc><line>a<d/>b<TIMEX3 type="DATE" value="2020-01-01">2020年</TIMEX3>c</line></doc>',
+    '<doc><line>a<!-- note -->b<![CDATA[<x>]]>c</line></doc>',
+    '<doc><line>a\r\nb<d certainty="nega\ntive">c</d></line></doc>',
+    '<doc><sec><line>a</line>tail</sec><line>b</line>tail2</doc>',
+]
+PIECES = ['肝', 'x', ' ', '\n', '&amp;', '&lt;', '&#x41;', '\r\n', '<!--c-->', '<![CDATA[<y>]]>']
+TAGS = ['d', 'a', 'f', 'TIMEX3', 't-key', 'm-val']
+
+
+def random_markup(rnd):
+    """ well-formed markup of random lines with tags of the tag set nested up to two deep """
+    def content(depth):
+        parts = []
+        for _ in range(rnd.randint(0, 4)):
+            if depth < 2 and rnd.random() < 0.3:
+                tag = rnd.choice(TAGS)
+                attrs = ' certainty="%s"' % rnd.choice(['positive', 'negative']) if rnd.random() < 0.5 else ''
+                parts.append('<%s%s>%s</%s>' % (tag, attrs, content(depth + 1), tag))
+            else:
+                parts.append(rnd.choice(PIECES))
+        return ''.join(parts)
+    return '<doc>%s</doc>' % ''.join('<line>%s</line>%s' % (content(0), rnd.choice(['', '\n', 'x']))
+                                     for _ in range(rnd.randint(1, 3)))
+
+
+class LexerEtreeTest(unittest.TestCase):
+    """ on well-formed markup the lexer gives the items of the ElementTree walk and no problems """
+
+    def assert_same(self, markup, line_tail=False):
+        try:
+            lines, problems = parse_markup_lines(markup, 'line', tag2name, line_tail)
+        except UnsupportedMarkup:
+            return
+        self.assertEqual(lines, etree_markup_lines(markup, 'line', line_tail), markup)
+        self.assertEqual(problems, [], markup)
+
+    def test_well_formed(self):
+        for markup in WELL_FORMED:
+            self.assert_same(markup)
+            self.assert_same(markup, line_tail=True)
+
+    def test_random_markup(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            markup = random_markup(rnd)
+            self.assert_same(markup, line_tail=rnd.random() < 0.5)
+
+    def test_unsupported_markup(self):
+        for markup in ['<doc><line>a<line>b</line></line></doc>', '<line>a</line>',
+                       '<doc xmlns:x="u"><line>a</line></doc>']:
+            with self.assertRaises(UnsupportedMarkup):
+                parse_markup_lines(markup, 'line', tag2name)
+
+    def test_broken_markup_recovers(self):
+        markup = '<doc><line>a<d certainty="positive">b</line><line>c</a>d</line></doc>'
+        with self.assertRaises(ET.ParseError):
+            etree_markup_lines(markup, 'line')
+        lines, problems = parse_markup_lines(markup, 'line', tag2name)
+        self.assertEqual(lines, [[('ab', None, {})], [('cd', None, {})]])
+        self.assertEqual(problems, ['unclosed <d certainty="positive">', 'stray </a>'])
+
+
+class LexerJson2BratTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.json_file = os.path.join(self.tmp_dir, 'a.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json2brat(self, parser):
+        brat_dir = os.path.join(self.tmp_dir, parser)
+        os.makedirs(brat_dir)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            extract_brat_from_json(self.json_file, os.path.join(brat_dir, 's'), 'mr', parser=parser,
+                                   **BRAT_COLUMNS['mr'])
+        files = read_dir(brat_dir)
+        # the manifest settings name the parser
+        del files['s.manifest.json']
+        return files
+
+    def test_same_brat_pairs(self):
+        rnd = random.Random(1)
+        rows = [(rid, rnd.choice(['plain', '<d certainty="positive">腫瘤</d>あり', '<a>肝</a>&amp;<d>x</d>',
+                                  '<TIMEX3 type="DATE">2020年</TIMEX3><c>増大</c>', '']))
+                for rid in range(1, 21) for _ in range(rnd.randint(1, 2))]
+        write_json(self.json_file, rows)
+        self.assertEqual(self.json2brat('lexer'), self.json2brat('etree'))
+
+
+if __name__ == '__main__':
+    unittest.main()
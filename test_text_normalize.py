@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# the 正規化 of xls2json --normalize in the central json layouts, and json2brat skipping the normalization it did
+# (python -m unittest test_text_normalize)
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from format_converter import dump_json_records, iter_json_records, read_normalized, report_markup
+from text_normalize import normalize_text
+
+RECORDS = [('1', {'表示順': 1, '所見': 'ＣＴで＜d＞腫瘤＜/d＞'}), ('2', {'表示順': 2, '所見': 'ｶﾅ　あり'})]
+
+
+class NormalizedJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_layouts_keep_normalized(self):
+        for name in ['a.json', 'a.ndjson', 'a.prism']:
+            json_file = os.path.join(self.tmp_dir, name)
+            dump_json_records(RECORDS, json_file, 'doc', normalized={'所見': 'zen2han'})
+            self.assertEqual(read_normalized(json_file), {'所見': 'zen2han'}, name)
+            others = {}
+            self.assertEqual(list(iter_json_records(json_file, others)), RECORDS)
+            self.assertEqual(others, {'文章名': 'doc', '正規化': {'所見': 'zen2han'}}, name)
+            dump_json_records(RECORDS, json_file, 'doc')
+            self.assertEqual(read_normalized(json_file), {}, name)
+
+    def test_normalized_finding_not_normalized_again(self):
+        for finding in [RECORDS[0][1]['所見'], RECORDS[1][1]['所見'], 'ａ＆ｂ\r\n＜/d＞']:
+            normalized = normalize_text(finding, 'zen2han')
+            for corpus in ['ou', 'ncc']:
+                self.assertEqual(report_markup(normalized, corpus, normalized=True),
+                                 report_markup(normalized, corpus), finding)
+
+
+if __name__ == '__main__':
+    unittest.main()
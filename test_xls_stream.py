@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# xls2json --stream: the records of iter_xls_records against those of read_xls, whatever the chunk size
+# (python -m unittest test_xls_stream)
+#
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from datetime import datetime
+
+from format_converter import as_json_record, iter_xls_records, read_xls
+
+HEADER = ['表示順', '所見', '記載日', 'mixed', 'flag']
+ROWS = [
+    [1, '<d>腫瘤</d>', datetime(2020, 1, 1), 1, True],
+    [2, None, datetime(2020, 1, 2), 2.5, False],
+    [None, None, None, None, None],
+    [3, 'あり', None, 3, None],
+    [None, 'b', datetime(2020, 1, 4), 'x', True],
+    [5, '', datetime(2020, 1, 5), '001', False],
+    [None, None, None, None, None],
+]
+
+
+class XlsStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        warnings.simplefilter('ignore', FutureWarning)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assert_stream_as_read(self, xls_file):
+        records = {line_id: as_json_record(record) for line_id, record in read_xls(xls_file)['読影所見'].items()}
+        for chunksize in [1, 2, 3, 100]:
+            streamed = {line_id: as_json_record(record)
+                        for line_id, record in iter_xls_records(xls_file, chunksize=chunksize)}
+            self.assertEqual(streamed, records, chunksize)
+            self.assertEqual([str(record['表示順']) for record in streamed.values()],
+                             [str(record['表示順']) for record in records.values()])
+        return records
+
+    def test_xlsx(self):
+        from openpyxl import Workbook
+        xls_file = os.path.join(self.tmp_dir, 'a.xlsx')
+        wb = Workbook()
+        for row in [HEADER] + ROWS:
+            wb.active.append(row)
+        wb.save(xls_file)
+        records = self.assert_stream_as_read(xls_file)
+        # the blank row in the middle is a record, the trailing one is not
+        self.assertEqual(len(records), 6)
+        self.assertEqual([record['表示順'] for record in records.values()], [1.0, 2.0, '', 3.0, '', 5.0])
+
+    def test_csv(self):
+        xls_file = os.path.join(self.tmp_dir, 'a.csv')
+        with open(xls_file, 'w', encoding='utf-8') as fo:
+            fo.write(','.join(HEADER) + '\n')
+            for row in ROWS:
+                fo.write(','.join('' if value is None else str(value) for value in row) + '\n')
+        records = self.assert_stream_as_read(xls_file)
+        self.assertEqual([record['flag'] for record in records.values()], [True, False, '', '', True, False, ''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# rule order of the markup repairs: the RepairEngine passes against the sequential str.replace chain
+# (python -m unittest test_xml_repair)
+#
+import random
+import unittest
+
+from xml_repair import RepairEngine, load_repair_engines
+
+
+def pass_of(engine, pattern):
+    """ the index of the engine pass that applies pattern """
+    for pass_index, (regex, table) in enumerate(engine.passes):
+        if pattern in table:
+            return pass_index
+    raise KeyError(pattern)
+
+
+class RuleTableOrderTest(unittest.TestCase):
+    """ the orderings xml_repair_rules.json relies on """
+
+    def setUp(self):
+        self.engines = load_repair_engines()
+        self.xml = self.engines['xml']
+        self.patterns = [pattern for pattern, replacement in self.xml.rules]
+
+    def test_amp_before_double_lt(self):
+        self.assertLess(self.patterns.index('&'), self.patterns.index('<<'))
+        text = 'a <<b & c>> d &lt;'
+        self.assertEqual(self.xml(text), 'a <b &amp; c> d &amp;lt;')
+        self.assertEqual(self.xml(text), self.xml.apply_sequential(text))
+
+    def test_double_gt_before_suspicious(self):
+        self.assertLess(self.patterns.index('>>'), self.patterns.index('="suspicious>'))
+        # '="suspicious>' ends with '>', so the two rules cannot share a pass
+        self.assertLess(pass_of(self.xml, '>>'), pass_of(self.xml, '="suspicious>'))
+        for text in ['<d certainty="suspicious>>x</d>', '<d certainty="suspicious>>>x</d>',
+                     '<d certainty="suspicious>x</d>']:
+            self.assertEqual(self.xml(text), self.xml.apply_sequential(text))
+        self.assertEqual(self.xml('<d certainty="suspicious>>x</d>'), '<d certainty="suspicious">x</d>')
+
+    def test_random_text_matches_sequential(self):
+        rnd = random.Random(0)
+        for name, engine in self.engines.items():
+            pieces = [pattern for pattern, replacement in engine.rules] + ['<', '>', '"', '&', 'x', '\n', ' ']
+            for _ in range(2000):
+                text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 12)))
+                self.assertEqual(engine(text), engine.apply_sequential(text), (name, text))
+
+
+class PassSplitTest(unittest.TestCase):
+    """ rules whose matches or replacements interact go to separate passes, in rule order """
+
+    def assert_sequential(self, engine, texts):
+        for text in texts:
+            self.assertEqual(engine(text), engine.apply_sequential(text), text)
+
+    def test_independent_rules_share_a_pass(self):
+        engine = RepairEngine([('<A>', '《A》'), ('<B>', '《B》'), ('&', '&amp;')])
+        self.assertEqual(len(engine.passes), 1)
+        self.assert_sequential(engine, ['<A><B>&', '<A&B>', ''])
+
+    def test_overlapping_patterns_split(self):
+        engine = RepairEngine([('ab', 'x'), ('b', 'y')])
+        self.assertEqual(len(engine.passes), 2)
+        self.assertEqual(engine('abb'), 'xy')
+        reverse = RepairEngine([('b', 'y'), ('ab', 'x')])
+        self.assertEqual(reverse('abb'), 'ayy')
+        self.assert_sequential(engine, ['abb', 'bab', 'aab'])
+        self.assert_sequential(reverse, ['abb', 'bab', 'aab'])
+
+    def test_replacement_creating_a_match_splits(self):
+        engine = RepairEngine([('a', 'b'), ('bb', 'c')])
+        self.assertEqual(len(engine.passes), 2)
+        self.assertEqual(engine('ab'), 'c')
+        self.assert_sequential(engine, ['ab', 'aab', 'ba'])
+
+    def test_split_keeps_later_independent_rules_together(self):
+        engine = RepairEngine([('<<', '<'), ('<', '&lt;'), ('X', 'Y'), ('Z', 'W')])
+        self.assertEqual([sorted(table) for regex, table in engine.passes], [['<<'], ['<', 'X', 'Z']])
+        self.assert_sequential(engine, ['<<<X', 'Z<<', '<X<<Z'])
+
+
+class HitCounterTest(unittest.TestCase):
+
+    def test_hits_per_rule(self):
+        engine = RepairEngine([('&', '&amp;'), ('<<', '<'), ('>>', '>'), ('<L/D>', '《L/D》')])
+        engine('a & b && <<c>>')
+        engine('<L/D> &')
+        self.assertEqual([hit for pattern, replacement, hit in engine.stats()], [4, 1, 1, 1])
+
+    def test_hits_of_a_later_pass(self):
+        engine = RepairEngine([('a', 'b'), ('bb', 'c')])
+        engine('aab')
+        # 'aab' -> 'bbb' -> 'cb'
+        self.assertEqual(engine.stats(), [('a', 'b', 2), ('bb', 'c', 1)])
+
+    def test_no_hits(self):
+        engine = RepairEngine([('&', '&amp;')])
+        self.assertEqual(engine('plain'), 'plain')
+        self.assertEqual(engine.stats(), [('&', '&amp;', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# character width normalization with precomputed translation tables and a per-string cache
+#
+#   zen2han: mojimoji.zen_to_han(text, kana=False)
+#   han2zen: mojimoji.han_to_zen(text)
+#   h2z:     h2z.pl
+#
+import re
+import sys
+from argparse import ArgumentParser
+from functools import lru_cache
+
+# the form each corpus applies to its findings before sentence splitting in json2brat
+CORPUS_FORMS = {
+    'mr': None,
+    'ou': 'zen2han',
+    'ncc': 'zen2han',
+}
+
+# h2z.pl: s/ /　/g, then its two tr/// lists (the first of two repeated source chars wins, as in perl, so '[' stays)
+H2Z_SOURCE = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789' + \
+             '!"#$%&\'()=~|`{+*}<>?_-^\\@;:],./ '
+H2Z_TARGET = 'ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ０１２３４５６７８９' + \
+             '！”＃＄％＆’（）＝〜｜‘｛＋＊｝＜＞？＿‐＾￥＠；：」，．／　'
+# lines h2z.pl leaves as they are
+H2Z_SKIP_RE = re.compile(r'^# S-ID')
+
+
+@lru_cache(maxsize=None)
+def mojimoji_tables(form):
+    """
+    (char table, pair table) giving the same result as mojimoji for 'zen2han' or 'han2zen': mojimoji maps char by
+    char, except for half-width kana followed by a (han)dakuten, which han_to_zen joins into one char
+    """
+    import mojimoji
+    if form == 'zen2han':
+        convert = lambda text: mojimoji.zen_to_han(text, kana=False)
+    else:
+        convert = mojimoji.han_to_zen
+    table, pairs = {}, {}
+    for code in range(0x10000):
+        if 0xD800 <= code <= 0xDFFF:
+            continue
+        char = chr(code)
+        converted = convert(char)
+        if converted != char:
+            table[code] = converted
+    if form == 'han2zen':
+        # the half-width katakana block
+        for code in range(0xFF61, 0xFFA0):
+            for mark in 'ﾞﾟ':
+                converted = convert(chr(code) + mark)
+                if len(converted) == 1:
+                    pairs[chr(code) + mark] = converted
+    return table, pairs
+
+
+def h2z_tables(form):
+    assert len(H2Z_SOURCE) == len(H2Z_TARGET)
+    return str.maketrans(H2Z_SOURCE, H2Z_TARGET), {}
+
+
+TABLES = {
+    'zen2han': mojimoji_tables,
+    'han2zen': mojimoji_tables,
+    'h2z': h2z_tables,
+}
+
+
+class Normalizer(object):
+    """ one normalization form as a callable on strings, caching the last cache_size distinct inputs """
+
+    def __init__(self, form, cache_size=100000):
+        if form not in TABLES:
+            raise ValueError('[ERROR] unknown normalization form: %s' % form)
+        self.form = form
+        self.table, self.pairs = TABLES[form](form)
+        self.pair_re = re.compile('|'.join(map(re.escape, sorted(self.pairs)))) if self.pairs else None
+        self._cached = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, text):
+        if self.form == 'h2z':
+            return ''.join(line if H2Z_SKIP_RE.match(line) else line.translate(self.table)
+                           for line in text.splitlines(True))
+        if self.pair_re:
+            text = self.pair_re.sub(lambda m: self.pairs[m.group(0)], text)
+        return text.translate(self.table)
+
+    def __call__(self, text):
+        return self._cached(text)
+
+    def batch(self, texts):
+        """ normalize a batch of strings, leaving non-string values (numbers, dates, '') untouched """
+        return [self(text) if isinstance(text, str) else text for text in texts]
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+_normalizers = {}
+
+
+def get_normalizer(form):
+    """ the shared Normalizer of a form, built on first use """
+    if form not in _normalizers:
+        _normalizers[form] = Normalizer(form)
+    return _normalizers[form]
+
+
+def normalize_text(text, form):
+    return get_normalizer(form)(text) if form else text
+
+
+def normalize_columns(df, col_forms):
+    """ normalize whole DataFrame columns in place, {column: form} """
+    for col, form in col_forms.items():
+        if col in df.columns:
+            df[col] = get_normalizer(form).batch(df[col].tolist())
+    return df
+
+
+def normalize_records(records, col_forms):
+    """ normalize the columns of a batch of record dicts in place, {column: form} """
+    for col, form in col_forms.items():
+        normalizer = get_normalizer(form)
+        for record in records:
+            if isinstance(record.get(col), str):
+                record[col] = normalizer(record[col])
+    return records
+
+
+def parse_col_forms(specs):
+    """ ['col=form', ...] from the command line into {col: form} """
+    col_forms = {}
+    for spec in specs or []:
+        col, _, form = spec.rpartition('=')
+        if not col or form not in TABLES:
+            raise ValueError('[ERROR] expected COLUMN=FORM with FORM in %s, got %s' % ('/'.join(TABLES), spec))
+        col_forms[col] = form
+    return col_forms
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Normalize character widths from stdin to stdout')
+    parser.add_argument("--form", default='h2z', choices=sorted(TABLES),
+                        help="h2z (the h2z.pl mapping), han2zen or zen2han (mojimoji)")
+    args = parser.parse_args()
+
+    normalizer = get_normalizer(args.form)
+    for line in sys.stdin:
+        sys.stdout.write('%s\n' % normalizer(line.rstrip('\n')))
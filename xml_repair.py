@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# rule-table repair of the broken inline markup in 所見/findings
+# (the replacement chains formerly hard-coded in fix_finding_str and fix_xml_str)
+#
+import os
+import re
+import json
+import hashlib
+from argparse import ArgumentParser
+from collections import Counter
+
+RULE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xml_repair_rules.json')
+
+
+def _overlaps(a, b):
+    """ whether an occurrence of a and an occurrence of b can share characters """
+    if not a or not b or a in b or b in a:
+        return True
+    return any(a.endswith(b[:k]) or b.endswith(a[:k]) for k in range(1, min(len(a), len(b))))
+
+
+def _interacts(earlier, later):
+    """
+    whether applying two literal rules one after the other can differ from applying them in one alternation pass:
+    the earlier match may consume part of a later match, or the earlier replacement may create a later match
+    """
+    return _overlaps(earlier[0], later[0]) or _overlaps(earlier[1], later[0])
+
+
+class RepairEngine(object):
+    """
+    ordered (pattern, replacement) literal rules with str.replace chain semantics,
+    compiled into as few single-pass alternation regexes as the rule order allows
+    """
+
+    def __init__(self, rules):
+        self.rules = [tuple(rule) for rule in rules]
+        self.hits = Counter()
+        self.passes = []
+        curr_pass = []
+        for rule_index, rule in enumerate(self.rules):
+            if any(_interacts(self.rules[i], rule) for i in curr_pass):
+                self.passes.append(self._compile(curr_pass))
+                curr_pass = []
+            curr_pass.append(rule_index)
+        if curr_pass:
+            self.passes.append(self._compile(curr_pass))
+
+    def _compile(self, rule_indices):
+        table = {self.rules[i][0]: (i, self.rules[i][1]) for i in rule_indices}
+        # longest first, although patterns inside one pass never overlap
+        patterns = sorted(table, key=len, reverse=True)
+        return re.compile('|'.join(re.escape(p) for p in patterns)), table
+
+    def __call__(self, text):
+        hits = self.hits
+
+        def replace(m):
+            rule_index, replacement = table[m.group(0)]
+            hits[rule_index] += 1
+            return replacement
+
+        for regex, table in self.passes:
+            if regex.search(text):
+                text = regex.sub(replace, text)
+        return text
+
+    def apply_sequential(self, text):
+        """ reference semantics: one str.replace per rule, in file order """
+        for pattern, replacement in self.rules:
+            text = text.replace(pattern, replacement)
+        return text
+
+    def stats(self):
+        return [(pattern, replacement, self.hits[i]) for i, (pattern, replacement) in enumerate(self.rules)]
+
+
+def load_repair_engines(rule_file=RULE_FILE):
+    """ {rule set name: RepairEngine}, i.e. 'finding' and 'xml' """
+    with open(rule_file, 'r', encoding='utf-8') as fi:
+        rule_sets = json.load(fi)
+    return {name: RepairEngine(rules) for name, rules in rule_sets.items()}
+
+
+def rules_digest(engines):
+    """ sha1 of the rule sets of load_repair_engines, it changes with any rule added, removed, edited or moved """
+    rule_sets = {name: engine.rules for name, engine in engines.items()}
+    return hashlib.sha1(json.dumps(rule_sets, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def main():
+    parser = ArgumentParser(description='Count which markup repair rules fire on a json corpus.')
+    parser.add_argument("--json", dest="json_file", required=True,
+                        help="central json file")
+    parser.add_argument("--col", dest="ann_col", default='ann',
+                        help="annotated column, e.g. ann, 所見, findings_demasked")
+    parser.add_argument("--rules", dest="rule_file", default=RULE_FILE,
+                        help="repair rule table")
+    parser.add_argument("--verify", action="store_true",
+                        help="check every result against the sequential str.replace chain")
+    args = parser.parse_args()
+
+    engines = load_repair_engines(args.rule_file)
+    with open(args.json_file, 'r', encoding='utf-8') as fi:
+        json_dict = json.load(fi)
+
+    mismatches = 0
+    for line_id, instance in json_dict['読影所見'].items():
+        if args.ann_col not in instance:
+            continue
+        text = str(instance[args.ann_col])
+        for name in ['finding', 'xml']:
+            fixed = engines[name](text)
+            if args.verify and fixed != engines[name].apply_sequential(text):
+                mismatches += 1
+                print('[ERROR] %s rules differ from the sequential chain, line id: %s' % (name, line_id))
+            text = fixed
+
+    for name, engine in engines.items():
+        print('== %s (%i rules, %i passes)' % (name, len(engine.rules), len(engine.passes)))
+        for pattern, replacement, hit in engine.stats():
+            print('%8i\t%s\t%s' % (hit, json.dumps(pattern, ensure_ascii=False), json.dumps(replacement, ensure_ascii=False)))
+    if args.verify:
+        print('mismatches: %i' % mismatches)
+
+
+if __name__ == "__main__":
+    main()